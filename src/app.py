@@ -5,9 +5,10 @@ import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.logger import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
 
 # Local imports 
-import models
 from routers import (
     energy_producers, 
     electrical_meters, 
@@ -15,7 +16,16 @@ from routers import (
     invoices,
     meter_readings
 )
-from database import engine
+import database
+from compression import CompressionMiddleware
+from config import Settings, get_settings
+from database.connection import build_async_engine, build_engine
+from database.migrations import upgrade
+from instrumentation import QueryBudgetMiddleware
+from group_commit import MeterReadingWriter
+from invoice_jobs import InvoiceScheduler
+from metrics import PrometheusMiddleware, metrics_response
+from pagination import NEXT_CURSOR_HEADER
 # from insert_fake_data import generate_fake_data
 
 # Tell the logger to use gunicorn’s log level instead of the default one
@@ -30,34 +40,145 @@ if __name__ != "__main__":
 else:
     logger.setLevel(logging.DEBUG)
 
-app = FastAPI()
 
-# No CORS restrictions
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=["*"],
-    allow_methods=["GET", "POST"],
-    allow_headers=["*"]
-)
+def create_app(settings: Settings | None = None) -> FastAPI:
+    """
+    Build the API application.
+    Importing or building the application doesn't open the database: the schema is
+    upgraded by the startup hook (unless `upgrade_on_startup` is disabled), which also
+    starts the invoices precomputation (if `invoice_precompute_enabled` is set) and the
+    meter readings group commit (if `meter_reading_group_commit` is set), and the
+    connections are closed by the shutdown hook.
+    By default the application uses the engines of the `database` module, configured
+    from the environment. Other `settings` get their own engines.
+    """
+    if settings is None:
+        settings = get_settings()
+        engine, async_engine = database.engine, database.async_engine
+    else:
+        engine, async_engine = build_engine(settings), build_async_engine(settings)
 
-# Include all routers for each data model
-app.include_router(energy_producers.router)
-app.include_router(factories.router)
-app.include_router(invoices.router)
-app.include_router(electrical_meters.router)
-app.include_router(meter_readings.router)
+    invoice_scheduler = InvoiceScheduler(
+        engine,
+        workers=settings.invoice_precompute_workers,
+        chunk_size=settings.invoice_precompute_chunk_size,
+        delay=settings.invoice_precompute_delay
+    )
 
-# Initialize database tables
-models.Base.metadata.create_all(bind=engine)
+    def upgrade_database():
+        if settings.upgrade_on_startup:
+            upgrade(engine)
 
+    def start_invoice_scheduler():
+        if settings.invoice_precompute_enabled:
+            invoice_scheduler.start()
 
-# Load dummy data in order to test the API
-# generate_fake_data()
+    def stop_invoice_scheduler():
+        invoice_scheduler.stop()
 
-@app.get("/", tags=["Default"])
-def welcome_api_users():
-    """
-    Welcome API users.
-    """
-    return "Hello 👋, check the API docs 👉 <url>:<port>/docs"
\ No newline at end of file
+    meter_reading_writer = None
+    if settings.meter_reading_group_commit:
+        meter_reading_writer = MeterReadingWriter(
+            engine,
+            max_group_size=settings.meter_reading_group_size,
+            max_delay=settings.meter_reading_group_delay / 1000
+        )
+
+    def start_meter_reading_writer():
+        if meter_reading_writer is not None:
+            meter_reading_writer.start()
+
+    def stop_meter_reading_writer():
+        if meter_reading_writer is not None:
+            meter_reading_writer.stop()
+
+    async def close_database():
+        engine.dispose()
+        await async_engine.dispose()
+
+    app = FastAPI(
+        on_startup=[upgrade_database, start_invoice_scheduler, start_meter_reading_writer],
+        on_shutdown=[stop_meter_reading_writer, stop_invoice_scheduler, close_database]
+    )
+    # Used by the meter readings creation route, `None` unless group commit is enabled
+    app.state.meter_reading_writer = meter_reading_writer
+
+    if engine is not database.engine:
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        AsyncSessionLocal = sessionmaker(
+            autocommit=False, autoflush=False, bind=async_engine, class_=AsyncSession)
+
+        def get_db():
+            db = SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        async def get_async_db():
+            async with AsyncSessionLocal() as db:
+                yield db
+
+        app.dependency_overrides[database.get_db] = get_db
+        app.dependency_overrides[database.get_async_db] = get_async_db
+
+    # No CORS restrictions
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=["*"],
+        allow_methods=["GET", "POST"],
+        allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER, "ETag"]
+    )
+
+    # Compression of large responses
+    if settings.compression_enabled:
+        app.add_middleware(
+            CompressionMiddleware,
+            minimum_size=settings.compression_minimum_size,
+            gzip_level=settings.compression_gzip_level,
+            brotli_quality=settings.compression_brotli_quality
+        )
+
+    # Query budgets and N+1 queries detection
+    if settings.query_budget_mode != "off":
+        app.add_middleware(
+            QueryBudgetMiddleware,
+            max_repeats=settings.query_max_repeats,
+            raise_errors=settings.query_budget_mode == "raise"
+        )
+
+    # Request latency and SQL metrics
+    if settings.metrics_enabled:
+        app.add_middleware(PrometheusMiddleware)
+
+    # Include all routers for each data model
+    app.include_router(energy_producers.router)
+    app.include_router(factories.router)
+    app.include_router(invoices.router)
+    app.include_router(electrical_meters.router)
+    app.include_router(meter_readings.router)
+
+    # Load dummy data in order to test the API
+    # generate_fake_data()
+
+    @app.get("/", tags=["Default"])
+    def welcome_api_users():
+        """
+        Welcome API users.
+        """
+        return "Hello 👋, check the API docs 👉 <url>:<port>/docs"
+
+    @app.get("/metrics", tags=["Default"], include_in_schema=False)
+    def read_metrics():
+        """
+        Serve the API metrics in the Prometheus text format.
+        """
+        return metrics_response()
+
+    return app
+
+
+# Application served by `uvicorn app:app` or `gunicorn -c gunicorn_conf.py app:app`
+app = create_app()
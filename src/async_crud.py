@@ -0,0 +1,182 @@
+"""
+Async versions of the `crud` read functions, used by `async def` route handlers.
+Queries are awaited on the event loop instead of holding a thread of the pool.
+Lists are read as plain column tuples (named like the schemas fields) instead of
+ORM objects, see `serialization.rows_response`.
+"""
+# Standard imports
+from datetime import date
+
+# 3rd party imports
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Local imports
+from models import (
+    ChangeCounter,
+    ElectricalMeter,
+    MeterReading,
+    EnergyProducer,
+    Factory,
+    Invoice
+)
+from utils import in_period, period_bounds
+
+
+def columns(model) -> list:
+    """
+    Get the columns of a model, to select rows as tuples instead of ORM objects.
+    """
+    return [getattr(model, column.key) for column in model.__table__.columns]
+
+# -------------- Energy Producers
+
+async def read_energy_producer(db: AsyncSession, uid: int):
+    """
+    Read a specific energy producer using its `uid`.
+    """
+    return await db.get(EnergyProducer, uid)
+
+async def read_energy_producers(
+    db: AsyncSession, skip: int = 0, limit: int = 100, after: tuple[int] = None):
+    """
+    Read all the energy producers in database, ordered by `uid`.
+    Use `after` (a `(uid,)` key) to read the rows following a previous page.
+    """
+    query = select(*columns(EnergyProducer)).order_by(EnergyProducer.uid)
+    if after is not None:
+        query = query.where(EnergyProducer.uid > after[0])
+    return (await db.execute(query.offset(skip).limit(limit))).all()
+
+# -------------- Factories
+
+async def read_factory(db: AsyncSession, uid: int):
+    """
+    Read a specific factory using its `uid`.
+    """
+    return await db.get(Factory, uid)
+
+async def read_factories(
+    db: AsyncSession, skip: int = 0, limit: int = 100, after: tuple[int] = None):
+    """
+    Read all the factories in database, ordered by `uid`.
+    Use `after` (a `(uid,)` key) to read the rows following a previous page.
+    """
+    query = select(*columns(Factory)).order_by(Factory.uid)
+    if after is not None:
+        query = query.where(Factory.uid > after[0])
+    return (await db.execute(query.offset(skip).limit(limit))).all()
+
+# -------------- Electrical Meters
+
+async def read_electrical_meter(db: AsyncSession, uid: int):
+    """
+    Read a specific electrical meter using its `uid`.
+    """
+    return await db.get(ElectricalMeter, uid)
+
+async def read_electrical_meters(
+    db: AsyncSession, skip: int = 0, limit: int = 100, after: tuple[int] = None):
+    """
+    Read all the electrical meters in database, ordered by `uid`.
+    Use `after` (a `(uid,)` key) to read the rows following a previous page.
+    """
+    query = select(*columns(ElectricalMeter)).order_by(ElectricalMeter.uid)
+    if after is not None:
+        query = query.where(ElectricalMeter.uid > after[0])
+    return (await db.execute(query.offset(skip).limit(limit))).all()
+
+# -------------- Meter readings
+
+async def read_meter_reading(db: AsyncSession, uid: int):
+    """
+    Read a specific meter reading using its `uid`.
+    """
+    return await db.get(MeterReading, uid)
+
+async def read_meter_readings(
+    db: AsyncSession,
+    year: int = None,
+    month: int = None,
+    day: int = None,
+    skip: int = 0,
+    limit: int = 100,
+    after: tuple[date, int] = None):
+    """
+    Read all the meter readings in database, ordered by `date` and `uid`.
+    Readings can be filtered on a specific `year`, `month` or `day`.
+    Use `after` (a `(date, uid)` key) to read the rows following a previous page.
+    """
+    query = select(*columns(MeterReading)).order_by(MeterReading.date, MeterReading.uid)
+    if year is not None:
+        start, end = period_bounds(year, month, day if month is not None else None)
+        query = query.where(in_period(MeterReading.date, start, end))
+    if after is not None:
+        query = query.where(tuple_(MeterReading.date, MeterReading.uid) > tuple_(*after))
+    return (await db.execute(query.offset(skip).limit(limit))).all()
+
+# -------------- Invoices
+
+async def read_invoice(db: AsyncSession, uid: int):
+    """
+    Read a specific invoice using its `uid`.
+    """
+    return await db.get(Invoice, uid)
+
+async def read_invoices(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    date: date = None,
+    after: tuple[date, int] = None):
+    """
+    Read all the invoices in database, ordered by `date` and `uid`.
+    Invoices can be filtered on the month of a specific `date`.
+    Use `after` (a `(date, uid)` key) to read the rows following a previous page.
+    """
+    query = select(*columns(Invoice)).order_by(Invoice.date, Invoice.uid)
+    if date is not None:
+        start, end = period_bounds(date.year, date.month)
+        query = query.where(in_period(Invoice.date, start, end))
+    if after is not None:
+        query = query.where(tuple_(Invoice.date, Invoice.uid) > tuple_(*after))
+    return (await db.execute(query.offset(skip).limit(limit))).all()
+
+async def read_energy_producer_invoices(
+    db: AsyncSession,
+    energy_producer_uid: int,
+    skip: int = 0,
+    limit: int = 100,
+    year: int = None,
+    month: int = None,
+    after: tuple[date, int] = None):
+    """
+    Read the invoices of all the factories of a specific energy producer in one query,
+    ordered by `date` and `uid`.
+    Invoices can be filtered on a `year`, or on a `month` of a `year`.
+    Use `after` (a `(date, uid)` key) to read the rows following a previous page.
+    """
+    query = (
+        select(*columns(Invoice))
+        .join(Factory, Invoice.factory_uid == Factory.uid)
+        .where(Factory.owner_uid == energy_producer_uid)
+        .order_by(Invoice.date, Invoice.uid)
+    )
+    if year is not None:
+        start, end = period_bounds(year, month)
+        query = query.where(in_period(Invoice.date, start, end))
+    if after is not None:
+        query = query.where(tuple_(Invoice.date, Invoice.uid) > tuple_(*after))
+    return (await db.execute(query.offset(skip).limit(limit))).all()
+
+# -------------- Change counters
+
+async def read_change_counter(
+    db: AsyncSession, scope: str, key: int = 0) -> tuple[int, int] | None:
+    """
+    Read the `(version, updated_at)` change counter of a collection,
+    `None` if it never changed.
+    """
+    query = select(ChangeCounter.version, ChangeCounter.updated_at).where(
+        ChangeCounter.scope == scope, ChangeCounter.key == key)
+    return (await db.execute(query)).first()
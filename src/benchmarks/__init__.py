@@ -0,0 +1,3 @@
+"""
+Benchmarks of the API, run from the `src/` directory with `python -m benchmarks.<name>`.
+"""
@@ -0,0 +1,109 @@
+"""
+Compare the synchronous and the async database layers under concurrent requests.
+The same queries are served by a `def` handler using `crud` (run in Starlette's thread
+pool) and by an `async def` handler using `async_crud` (run on the event loop).
+Usage: `python -m benchmarks.async_db --database database/streem_sql.db`
+"""
+# Standard imports
+import argparse
+import asyncio
+import statistics
+import time
+
+# 3rd party imports
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+# Local imports
+import async_crud
+import crud
+from schemas import MeterReading
+
+
+def build_app(database: str) -> FastAPI:
+    """
+    Build an app serving the same meter readings page in both modes.
+    """
+    engine = create_engine(
+        f"sqlite:///{database}", connect_args={"check_same_thread": False})
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{database}")
+    AsyncSessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, bind=async_engine, class_=AsyncSession)
+
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def get_async_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    app = FastAPI()
+
+    @app.get("/sync/{year}/{month}", response_model=list[MeterReading])
+    def read_sync(year: int, month: int, db: Session = Depends(get_db)):
+        return crud.read_meter_readings(db, year=year, month=month)
+
+    @app.get("/async/{year}/{month}", response_model=list[MeterReading])
+    async def read_async(year: int, month: int, db: AsyncSession = Depends(get_async_db)):
+        return await async_crud.read_meter_readings(db, year=year, month=month)
+
+    return app
+
+
+async def run(app: FastAPI, mode: str, requests: int, concurrency: int) -> dict:
+    """
+    Send `requests` requests with at most `concurrency` of them in flight.
+    """
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        async def send(i: int):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(f"/{mode}/2022/{i % 12 + 1}")
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "rps": requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database", default="database/streem_sql.db")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64, 256])
+    args = parser.parse_args()
+
+    app = build_app(args.database)
+    print(f"{'mode':<6} {'concurrency':>11} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for concurrency in args.concurrency:
+        for mode in ("sync", "async"):
+            result = asyncio.run(run(app, mode, args.requests, concurrency))
+            print(
+                f"{result['mode']:<6} {result['concurrency']:>11} {result['rps']:>8.0f} "
+                f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
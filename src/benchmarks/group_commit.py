@@ -0,0 +1,104 @@
+"""
+Compare the throughput of meter readings created one per request, with a commit per
+reading (`crud.create_meter_reading`) then with the group commit writer, for several
+numbers of concurrent clients. Each run uses a new database.
+Usage: `python -m benchmarks.group_commit --clients 1 8 32 --synchronous FULL`
+"""
+# Standard imports
+import argparse
+import datetime
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# 3rd party imports
+from sqlalchemy.orm import sessionmaker
+
+# Local imports
+import crud
+from config import Settings
+from database.connection import build_engine
+from database.migrations import upgrade
+from group_commit import MeterReadingWriter
+from models import ElectricalMeter, EnergyProducer, Factory
+from schemas import MeterReadingCreate
+
+
+def run(settings: Settings, clients: int, duration: float, group_commit: bool) -> float:
+    """
+    Run `clients` threads creating meter readings one at a time for `duration` seconds.
+    Return the number of created readings per second.
+    """
+    engine = build_engine(settings)
+    upgrade(engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with SessionLocal() as db:
+        db.add(EnergyProducer(uid=1, name="edf"))
+        db.add(Factory(uid=1, name="ED_Cha_1", owner_uid=1))
+        db.add(ElectricalMeter(uid=1, name="ED_Cha_1_em1", is_producer=True, factory_uid=1))
+        db.commit()
+
+    writer = None
+    if group_commit:
+        writer = MeterReadingWriter(
+            engine,
+            max_group_size=settings.meter_reading_group_size,
+            max_delay=settings.meter_reading_group_delay / 1000
+        )
+        writer.start()
+
+    counts = [0] * clients
+    stop = threading.Event()
+
+    def client(index: int):
+        db = SessionLocal()
+        start = datetime.date(2000, 1, 1)
+        while not stop.is_set():
+            # Each client writes its own days, so that readings are inserted, not overwritten
+            day = start + datetime.timedelta(days=counts[index] * clients + index)
+            meter_reading = MeterReadingCreate(date=day, amount=index, electrical_meter_uid=1)
+            if writer is not None:
+                writer.write(meter_reading)
+            else:
+                crud.create_meter_reading(db, meter_reading=meter_reading)
+            counts[index] += 1
+        db.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    if writer is not None:
+        writer.stop()
+    engine.dispose()
+    return sum(counts) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=3.0, help="in seconds")
+    parser.add_argument("--synchronous", default="NORMAL", choices=["NORMAL", "FULL"])
+    args = parser.parse_args()
+
+    print(f"{'clients':>7} {'per-row commits/s':>18} {'group commit/s':>15}")
+    with tempfile.TemporaryDirectory() as directory:
+        for clients in args.clients:
+            results = []
+            for group_commit in (False, True):
+                database = Path(directory) / f"{clients}-{group_commit}.db"
+                settings = Settings(
+                    database_url=f"sqlite:///{database}",
+                    sqlite_synchronous=args.synchronous,
+                    database_pool_size=clients + 1
+                )
+                results.append(run(settings, clients, args.duration, group_commit))
+            print(f"{clients:>7} {results[0]:>18.0f} {results[1]:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
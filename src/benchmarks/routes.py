@@ -0,0 +1,286 @@
+"""
+Benchmark the hot API routes on generated datasets of several scales.
+Datasets are generated once with `insert_fake_data` (fixed seed) and reused, each run
+works on a copy of the dataset. Requests are sent in-process (no network) and the
+p50/p99 latencies and requests per second of each scenario are saved as JSON.
+Usage, from the `src/` directory:
+- `python -m benchmarks.routes --scale 10k` (also `1m` and `10m`)
+- `python -m benchmarks.routes --compare main.json branch.json`
+"""
+# Standard imports
+import argparse
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Callable
+
+# 3rd party imports
+from fastapi.testclient import TestClient
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+# Local imports
+from app import app
+from cache import invoice_cache
+from config import Settings
+from database import get_async_db, get_db
+from database.connection import build_async_engine, build_engine
+from insert_fake_data import generate_fake_data
+from models import Invoice
+
+BENCHMARKS_PATH = Path(__file__).parent
+START_DATE = date(2022, 1, 1)
+
+# Dataset shapes: (producers, factories per producer, meters per factory, days)
+SCALES = {
+    "10k": (5, 4, 1, 500),
+    "1m": (100, 10, 1, 1000),
+    "10m": (1000, 10, 1, 1000),
+}
+
+
+def dataset_path(scale: str, seed: int) -> Path:
+    """
+    Get the path of the dataset of a scale, generating it if needed.
+    """
+    path = BENCHMARKS_PATH / "data" / f"{scale}-{seed}.db"
+    if not path.exists():
+        path.parent.mkdir(exist_ok=True)
+        producers, factories, meters, days = SCALES[scale]
+        print(f"Generating the {scale} dataset in {path}...")
+        engine = build_engine(Settings(database_url=f"sqlite:///{path}"))
+        generate_fake_data(
+            engine,
+            seed=seed,
+            producers=producers,
+            factories=factories,
+            meters=meters,
+            days=days,
+            start_date=START_DATE,
+            workers=4
+        )
+        # Closing the connections checkpoints the WAL into the database file
+        engine.dispose()
+    return path
+
+
+class Scenario:
+    """
+    A named kind of request, with an optional setup run before measuring.
+    """
+    def __init__(self, name: str, request: Callable, setup: Callable = None):
+        self.name = name
+        self.request = request
+        self.setup = setup
+
+
+def build_scenarios(scale: str, rng: random.Random) -> list[Scenario]:
+    producers, factories, meters, days = SCALES[scale]
+    months = [(d.year, d.month) for d in (START_DATE + timedelta(days=i) for i in range(days))]
+    months = sorted(set(months))
+    meter_count = producers * factories * meters
+
+    def random_day() -> date:
+        return START_DATE + timedelta(days=rng.randrange(days))
+
+    def day_path(day: date) -> str:
+        return f"{day.year}/{day.month}/{day.day}"
+
+    def clear_invoices(db):
+        # Invoices are computed on the first request of each factory and month
+        db.execute(delete(Invoice))
+        db.commit()
+        invoice_cache.clear()
+
+    def new_reading() -> dict:
+        return {
+            "date": str(random_day()),
+            "amount": rng.randrange(1000),
+            "electrical_meter_uid": rng.randint(1, meter_count)
+        }
+
+    return [
+        Scenario(
+            "invoice_factory",
+            lambda c: c.get(
+                f"/factories/{rng.randint(1, producers * factories)}/invoices/%d/%d"
+                % rng.choice(months)),
+            setup=clear_invoices
+        ),
+        Scenario(
+            "invoice_energy_producer",
+            lambda c: c.get(
+                f"/energy-producers/{rng.randint(1, producers)}/invoices/%d/%d"
+                % rng.choice(months)),
+            setup=clear_invoices
+        ),
+        Scenario(
+            "meter_readings_by_month",
+            lambda c: c.get("/meter-readings/%d/%d" % rng.choice(months))
+        ),
+        Scenario(
+            "meter_readings_by_day",
+            lambda c: c.get(f"/meter-readings/{day_path(random_day())}")
+        ),
+        Scenario(
+            "list_meter_readings",
+            lambda c: c.get("/meter-readings/", params={"skip": rng.randrange(1000)})
+        ),
+        Scenario(
+            "list_factories",
+            lambda c: c.get("/factories/", params={"skip": rng.randrange(producers * factories)})
+        ),
+        Scenario("list_invoices", lambda c: c.get("/invoices/")),
+        Scenario(
+            "create_meter_reading",
+            lambda c: c.post("/meter-readings/", json=new_reading())
+        ),
+        Scenario(
+            "create_meter_readings_bulk_1000",
+            lambda c: c.post("/meter-readings/bulk", json=[new_reading() for _ in range(1000)])
+        ),
+    ]
+
+
+def measure(client: TestClient, scenario: Scenario, requests: int, db) -> dict:
+    """
+    Send `requests` requests of a scenario, after a few warm-up requests.
+    """
+    if scenario.setup is not None:
+        scenario.setup(db)
+    for _ in range(min(5, requests)):
+        scenario.request(client)
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        request_start = time.perf_counter()
+        response = scenario.request(client)
+        latencies.append(time.perf_counter() - request_start)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{scenario.name}: {response.status_code} {response.text}")
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "rps": requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000,
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scale: str, seed: int, requests: int, only: list[str] | None) -> dict:
+    """
+    Run the scenarios on a copy of the dataset of a scale.
+    """
+    source = dataset_path(scale, seed)
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / source.name
+        shutil.copy(source, path)
+        settings = Settings(database_url=f"sqlite:///{path}")
+        engine = build_engine(settings)
+        async_engine = build_async_engine(settings)
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        AsyncSessionLocal = sessionmaker(
+            autocommit=False, autoflush=False, bind=async_engine, class_=AsyncSession)
+
+        def override_get_db():
+            db = SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        async def override_get_async_db():
+            async with AsyncSessionLocal() as db:
+                yield db
+
+        previous_overrides = dict(app.dependency_overrides)
+        app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[get_async_db] = override_get_async_db
+        client = TestClient(app)
+        rng = random.Random(seed)
+        db = SessionLocal()
+        results = {}
+        try:
+            for scenario in build_scenarios(scale, rng):
+                if only and scenario.name not in only:
+                    continue
+                results[scenario.name] = measure(client, scenario, requests, db)
+                print(
+                    f"{scenario.name:<32} {results[scenario.name]['rps']:>8.0f} req/s "
+                    f"p50 {results[scenario.name]['p50_ms']:>7.2f} ms "
+                    f"p99 {results[scenario.name]['p99_ms']:>7.2f} ms"
+                )
+        finally:
+            db.close()
+            app.dependency_overrides = previous_overrides
+            engine.dispose()
+
+    return {
+        "scale": scale,
+        "seed": seed,
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+
+
+def compare(baseline_path: Path, candidate_path: Path):
+    """
+    Print the p50 latency and throughput changes between two result files.
+    """
+    baseline = json.loads(baseline_path.read_text())["results"]
+    candidate = json.loads(candidate_path.read_text())["results"]
+    print(f"{'scenario':<32} {'p50 ms':>17} {'req/s':>17}")
+    for name in sorted(baseline.keys() & candidate.keys()):
+        old, new = baseline[name], candidate[name]
+        print(
+            f"{name:<32} {old['p50_ms']:>7.2f} -> {new['p50_ms']:>7.2f} "
+            f"{old['rps']:>7.0f} -> {new['rps']:>7.0f} ({new['rps'] / old['rps']:.2f}x)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", choices=SCALES, default="10k")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--scenario", action="append", help="Only run these scenarios")
+    parser.add_argument("--output", type=Path, help="Result file (JSON)")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("BASELINE", "CANDIDATE"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = run(args.scale, args.seed, args.requests, args.scenario)
+    output = args.output or (
+        BENCHMARKS_PATH / "results" / f"{args.scale}-{report['git_revision'] or 'local'}.json")
+    output.parent.mkdir(exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results saved in {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Compare the serialization of list responses before and after the orjson fast path.
+- `orm`: ORM objects validated against the `response_model` (Pydantic `orm_mode`),
+  encoded by `jsonable_encoder` and the standard JSON encoder, as FastAPI does.
+- `rows`: column tuples encoded by orjson (`serialization.rows_response`).
+Timings include reading the rows from an in-memory SQLite database.
+Usage, from the `src/` directory: `python -m benchmarks.serialization --sizes 100 10000`
+"""
+# Standard imports
+import argparse
+import statistics
+import time
+from datetime import date, timedelta
+from typing import Callable
+
+# 3rd party imports
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+# Local imports
+import schemas
+from async_crud import columns
+from database import Base
+from models import MeterReading
+from serialization import rows_response
+
+
+def build_session(rows: int) -> Session:
+    """
+    Session on an in-memory database holding `rows` meter readings.
+    """
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(insert(MeterReading), [
+            {
+                "date": date(2022, 1, 1) + timedelta(days=uid % 365),
+                "amount": uid * 1.5,
+                "electrical_meter_uid": uid % 100
+            }
+            for uid in range(rows)
+        ])
+    return Session(engine)
+
+
+def measure(function: Callable[[], bytes], repeat: int) -> tuple[float, int]:
+    """
+    Get the median duration (in ms) of `function` and the size of the body it returns.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations), len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    db = build_session(max(args.sizes))
+
+    def orm_body(size: int) -> bytes:
+        db.expunge_all()  # Each request has its own session
+        db_meter_readings = db.scalars(select(MeterReading).limit(size)).all()
+        content = jsonable_encoder(
+            [schemas.MeterReading.from_orm(db_reading) for db_reading in db_meter_readings])
+        return JSONResponse(content).body
+
+    def rows_body(size: int) -> bytes:
+        rows = db.execute(select(*columns(MeterReading)).limit(size)).all()
+        return rows_response(rows).body
+
+    print(f"{'rows':>8} {'orm ms':>9} {'rows ms':>9} {'speedup':>8} {'bytes':>10}")
+    for size in args.sizes:
+        orm_ms, orm_bytes = measure(lambda: orm_body(size), args.repeat)
+        rows_ms, rows_bytes = measure(lambda: rows_body(size), args.repeat)
+        assert orm_bytes == rows_bytes, "Both paths must produce the same payload size"
+        print(
+            f"{size:>8} {orm_ms:>9.2f} {rows_ms:>9.2f} "
+            f"{orm_ms / rows_ms:>7.1f}x {rows_bytes:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Measure SQLite read/write throughput with concurrent readers and a writer, using the
+rollback journal defaults then the tuned pragmas of `config.Settings` (WAL, ...).
+Each mode runs on its own copy of the database.
+Usage: `python -m benchmarks.sqlite_concurrency --database database/streem_sql.db`
+"""
+# Standard imports
+import argparse
+import datetime
+import random
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# 3rd party imports
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+# Local imports
+import crud
+from config import Settings
+from database.connection import build_engine
+from database.migrations import upgrade
+from models import ElectricalMeter, Factory
+from schemas import MeterReadingCreate
+from utils import compute_productions
+
+# Settings matching SQLite defaults: rollback journal and full fsync on each commit
+DEFAULT_PRAGMAS = {
+    "sqlite_journal_mode": "DELETE",
+    "sqlite_synchronous": "FULL",
+    "sqlite_mmap_size": 0,
+    "sqlite_cache_size": -2000,
+}
+
+
+def run(settings: Settings, readers: int, duration: float) -> dict:
+    """
+    Run `readers` reader threads computing invoices and one writer thread creating
+    meter readings (one commit each) for `duration` seconds.
+    """
+    engine = build_engine(settings)
+    upgrade(engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = SessionLocal()
+    factory_uids = [uid for uid, in db.query(Factory.uid)]
+    meter_uids = [uid for uid, in db.query(ElectricalMeter.uid)]
+    db.close()
+
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def count(key: str):
+        with lock:
+            counts[key] += 1
+
+    def reader(seed: int):
+        rng = random.Random(seed)
+        db = SessionLocal()
+        while not stop.is_set():
+            try:
+                month = datetime.date(2022, rng.randint(1, 12), 1)
+                compute_productions(db, rng.sample(factory_uids, 4), month)
+                db.rollback()
+                count("reads")
+            except OperationalError:
+                db.rollback()
+                count("errors")
+        db.close()
+
+    def writer():
+        rng = random.Random(0)
+        db = SessionLocal()
+        while not stop.is_set():
+            try:
+                crud.create_meter_reading(db, MeterReadingCreate(
+                    date=datetime.date(2022, rng.randint(1, 12), rng.randint(1, 28)),
+                    amount=rng.randint(0, 1000),
+                    electrical_meter_uid=rng.choice(meter_uids)
+                ))
+                count("writes")
+            except OperationalError:
+                db.rollback()
+                count("errors")
+        db.close()
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    return {
+        "reads_per_s": counts["reads"] / duration,
+        "writes_per_s": counts["writes"] / duration,
+        "errors": counts["errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database", default="database/streem_sql.db")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0, help="in seconds")
+    args = parser.parse_args()
+
+    modes = {"default": Settings(**DEFAULT_PRAGMAS), "tuned": Settings()}
+    print(f"{'mode':<8} {'reads/s':>9} {'writes/s':>9} {'errors':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        for mode, settings in modes.items():
+            database = Path(directory) / f"{mode}.db"
+            shutil.copy(args.database, database)
+            settings.database_url = f"sqlite:///{database}"
+            result = run(settings, args.readers, args.duration)
+            print(
+                f"{mode:<8} {result['reads_per_s']:>9.0f} "
+                f"{result['writes_per_s']:>9.0f} {result['errors']:>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Measure the startup time of the API.
+- `import`: time to import the `app` module in a new interpreter (cold start).
+- `uvicorn` / `gunicorn`: time from launching the server to its first response
+  (gunicorn preloads the application and forks `--workers` workers).
+Usage, from the `src/` directory: `python -m benchmarks.startup --workers 4`
+"""
+# Standard imports
+import argparse
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+# 3rd party imports
+import httpx
+
+IMPORT_SCRIPT = (
+    "import time; start = time.perf_counter(); import app; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import() -> float:
+    """
+    Time (in seconds) to import the application in a new interpreter.
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT], check=True, capture_output=True, text=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def measure_server(command: list[str], port: int, timeout: float = 30) -> float:
+    """
+    Time (in seconds) from launching a server to its first response.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/").status_code == 200:
+                    return time.perf_counter() - start
+            except httpx.TransportError:
+                time.sleep(0.01)
+        raise TimeoutError(f"No response after {timeout}s: {' '.join(command)}")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    def uvicorn() -> float:
+        port = free_port()
+        return measure_server(["uvicorn", "app:app", "--port", str(port)], port)
+
+    def gunicorn() -> float:
+        port = free_port()
+        return measure_server([
+            "gunicorn", "-c", "gunicorn_conf.py", "app:app",
+            "--workers", str(args.workers), "--bind", f"127.0.0.1:{port}"
+        ], port)
+
+    scenarios = {"import": measure_import, "uvicorn": uvicorn, "gunicorn": gunicorn}
+    print(f"{'scenario':<10} {'median ms':>10} {'max ms':>10}")
+    for name, measure in scenarios.items():
+        durations = [measure() * 1000 for _ in range(args.repeat)]
+        print(f"{name:<10} {statistics.median(durations):>10.0f} {max(durations):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+In-process caches.
+Each worker process has its own cache: an entry evicted in one worker may still be
+served by another one until its TTL expires. Likewise, computations are only coalesced
+within a process, unique indexes keep the results of other processes consistent.
+"""
+# Standard imports
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+# Local imports
+from config import get_settings
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire `ttl` seconds after being set.
+    """
+    def __init__(self, maxsize: int, ttl: float, timer: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._timer = timer
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any | None:
+        """
+        Get the value of `key`, or `None` if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self._timer():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Set the value of `key`, evicting the least recently used entry if the cache is full.
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._timer() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def evict(self, *keys: Hashable):
+        """
+        Remove `keys` from the cache.
+        """
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def evict_matching(self, predicate: Callable[[Hashable], bool]):
+        """
+        Remove the keys for which `predicate` is true.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        """
+        Remove all the entries and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """
+        Get the hit and miss counters of the cache.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl
+        }
+
+
+class SingleFlight:
+    """
+    Coalesce the concurrent calls sharing a key: the first call runs the function, the
+    calls made while it runs wait for its result (or exception) instead of running it again.
+    """
+    def __init__(self):
+        self._calls: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        """
+        Call `function`, unless a call of the same `key` is in flight, and get its result.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+
+        try:
+            call.set_result(function())
+        except BaseException as error:
+            call.set_exception(error)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return call.result()
+
+
+# Invoices computed for a factory, keyed by `("factory", factory_uid, year, month)`,
+# or for all the factories of a producer, keyed by `("energy_producer", uid, year, month)`
+invoice_cache = TTLCache(
+    maxsize=get_settings().invoice_cache_size, ttl=get_settings().invoice_cache_ttl
+)
+
+
+# Invoice computations in flight, keyed like the cache entries they fill
+invoice_flights = SingleFlight()
+
+
+def factory_invoice_key(factory_uid: int, year: int, month: int) -> tuple:
+    return ("factory", factory_uid, year, month)
+
+
+def energy_producer_invoices_key(energy_producer_uid: int, year: int, month: int) -> tuple:
+    return ("energy_producer", energy_producer_uid, year, month)
+
+
+def is_energy_producer_invoices_key(key: tuple, energy_producer_uid: int) -> bool:
+    """
+    Tell if `key` holds the invoices of a producer, whatever their month.
+    """
+    return key[:2] == ("energy_producer", energy_producer_uid)
@@ -0,0 +1,246 @@
+"""
+Columnar store of the meter readings.
+Next to the `meter_readings` table, the readings of each electrical meter are appended to
+two fixed-width files: `<uid>.dates` (`datetime64[D]`) and `<uid>.amounts` (`float64`),
+both written under the lock of a `<uid>.lock` file shared by all the API workers.
+They are memory-mapped when read, so aggregates over date ranges run as NumPy reductions
+without building a Python object per reading.
+The store is optional, it is enabled by the `columnar_store_path` setting and fed after
+each committed write of readings. A reading sent again for the same date is appended as
+well, reads only keep the last amount appended for each date. Writers hold the lock of
+the store (see `ColumnarStore.writing`) from their database write to their append, so
+the readings are appended in the order they were committed, whatever the process.
+If the store gets out of sync with the database (e.g. the process stopped between the
+commit and the append), rebuild it from the `src/` directory:
+`python -m columnar rebuild`
+"""
+# Standard imports
+import argparse
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import date
+from pathlib import Path
+from typing import Iterable
+
+# 3rd party imports
+import numpy as np
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where only threads are synchronized
+    fcntl = None
+from sqlalchemy.engine import Connection
+
+# Local imports
+from config import get_settings
+from database import engine as default_engine
+from models import MeterReading
+
+DATE_DTYPE = np.dtype("datetime64[D]")
+AMOUNT_DTYPE = np.dtype("float64")
+
+
+def latest_amounts(dates: np.ndarray, amounts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Keep the last amount of each date. Arrays without duplicate dates (e.g. appended
+    chronologically) are returned as is, otherwise they are sorted by date.
+    """
+    if len(dates) < 2 or np.all(dates[1:] > dates[:-1]):
+        return dates, amounts
+    order = np.argsort(dates, kind="stable")
+    dates, amounts = dates[order], amounts[order]
+    is_last = np.append(dates[1:] != dates[:-1], True)
+    return dates[is_last], amounts[is_last]
+
+
+@contextmanager
+def file_lock(path: Path):
+    """
+    Hold an exclusive lock on the file at `path`, shared by all the threads and processes.
+    """
+    with open(path, "ab") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # Closing the file releases the lock
+        yield
+
+
+class ColumnarStore:
+    """
+    Append-only, memory-mapped date and amount arrays of each electrical meter.
+    """
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # Memory maps of each meter, with the inode and size of the file they map
+        self._maps: dict[int, tuple[tuple, np.ndarray, np.ndarray]] = {}
+
+    def _paths(self, electrical_meter_uid: int) -> tuple[Path, Path]:
+        return (
+            self.path / f"{electrical_meter_uid}.dates",
+            self.path / f"{electrical_meter_uid}.amounts"
+        )
+
+    def _lock_path(self, electrical_meter_uid: int) -> Path:
+        return self.path / f"{electrical_meter_uid}.lock"
+
+    @contextmanager
+    def writing(self):
+        """
+        Hold the write lock of the store, shared by all the threads and processes.
+        Readings must be written to the database and appended within the same lock,
+        otherwise two overwrites of a date could be appended in another order than the
+        one of their commits, and the store would keep the amount the database replaced.
+        """
+        with self._write_lock, file_lock(self.path / "store.lock"):
+            yield
+
+    def append(self, electrical_meter_uid: int, dates: Iterable, amounts: Iterable):
+        """
+        Append readings to the arrays of an electrical meter.
+        """
+        dates = np.asarray(dates, dtype=DATE_DTYPE)
+        amounts = np.asarray(amounts, dtype=AMOUNT_DTYPE)
+        if dates.shape != amounts.shape:
+            raise ValueError("Dates and amounts must have the same length")
+
+        dates_path, amounts_path = self._paths(electrical_meter_uid)
+        # Other workers append to the same files, the columns must stay aligned
+        with self._lock, file_lock(self._lock_path(electrical_meter_uid)):
+            # Readers size the arrays on the amounts file, which is written last
+            with open(dates_path, "ab") as dates_file:
+                dates_file.write(dates.tobytes())
+            with open(amounts_path, "ab") as amounts_file:
+                amounts_file.write(amounts.tobytes())
+
+    def append_readings(self, meter_readings: Iterable):
+        """
+        Append meter readings (with `date`, `amount` and `electrical_meter_uid`
+        attributes), grouped by electrical meter.
+        """
+        columns = defaultdict(lambda: ([], []))
+        for meter_reading in meter_readings:
+            if meter_reading.electrical_meter_uid is None:
+                continue
+            dates, amounts = columns[meter_reading.electrical_meter_uid]
+            dates.append(meter_reading.date)
+            amounts.append(meter_reading.amount)
+
+        for electrical_meter_uid, (dates, amounts) in columns.items():
+            self.append(electrical_meter_uid, dates, amounts)
+
+    def read(
+        self,
+        electrical_meter_uid: int,
+        start: date = None,
+        end: date = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Read the `(dates, amounts)` arrays of an electrical meter, with a single amount
+        per date (the last appended one), sorted by date.
+        Readings can be filtered on a `[start, end[` date range.
+        """
+        dates_path, amounts_path = self._paths(electrical_meter_uid)
+        try:
+            stat = os.stat(amounts_path)
+            version, count = (stat.st_ino, stat.st_size), stat.st_size // AMOUNT_DTYPE.itemsize
+        except FileNotFoundError:
+            version, count = None, 0
+
+        # Maps are reused until the file grows or is replaced (e.g. by a rebuild)
+        cached = self._maps.get(electrical_meter_uid)
+        if cached is not None and cached[0] == version:
+            _, dates, amounts = cached
+        elif count == 0:
+            dates, amounts = np.empty(0, DATE_DTYPE), np.empty(0, AMOUNT_DTYPE)
+        else:
+            dates = np.memmap(dates_path, dtype=DATE_DTYPE, mode="r", shape=(count,))
+            amounts = np.memmap(amounts_path, dtype=AMOUNT_DTYPE, mode="r", shape=(count,))
+            dates, amounts = latest_amounts(dates, amounts)
+            self._maps[electrical_meter_uid] = (version, dates, amounts)
+
+        if start is None and end is None:
+            return dates, amounts
+        mask = np.ones(len(dates), dtype=bool)
+        if start is not None:
+            mask &= dates >= np.datetime64(start, "D")
+        if end is not None:
+            mask &= dates < np.datetime64(end, "D")
+        return dates[mask], amounts[mask]
+
+    def sum_amounts(
+        self, electrical_meter_uids: list[int], start: date, end: date) -> np.ndarray:
+        """
+        Sum the readings of several electrical meters over a `[start, end[` date range.
+        """
+        return np.array([
+            self.read(electrical_meter_uid, start, end)[1].sum()
+            for electrical_meter_uid in electrical_meter_uids
+        ], dtype=AMOUNT_DTYPE)
+
+    def clear(self):
+        """
+        Remove the readings of all the electrical meters.
+        """
+        with self._lock:
+            self._maps.clear()
+            for path in self.path.glob("*.dates"):
+                path.unlink()
+            for path in self.path.glob("*.amounts"):
+                path.unlink()
+
+
+def rebuild(store: ColumnarStore, connection: Connection, batch_size: int = 100_000) -> int:
+    """
+    Regenerate the columnar store from the meter readings of the database.
+    Writes of readings wait for the end of the rebuild.
+    Return the number of stored readings.
+    """
+    with store.writing():
+        store.clear()
+        result = connection.execution_options(stream_results=True).exec_driver_sql(
+            f"SELECT electrical_meter_uid, date, amount FROM {MeterReading.__tablename__} "
+            "WHERE electrical_meter_uid IS NOT NULL ORDER BY electrical_meter_uid, date, uid"
+        )
+        count = 0
+        while rows := result.fetchmany(batch_size):
+            meter_uids, dates, amounts = (np.array(column) for column in zip(*rows))
+            # Rows are sorted by meter, append each meter's slice of the batch at once
+            uids, starts = np.unique(meter_uids, return_index=True)
+            for uid, start, end in zip(uids, starts, [*starts[1:], len(rows)]):
+                store.append(int(uid), dates[start:end], amounts[start:end])
+            count += len(rows)
+    return count
+
+
+# Store of the API process, `None` unless the `columnar_store_path` setting is set
+reading_store = (
+    ColumnarStore(get_settings().columnar_store_path)
+    if get_settings().columnar_store_path else None
+)
+
+
+def writing_readings():
+    """
+    Hold the write lock of the API store, if enabled, while writing readings.
+    """
+    return reading_store.writing() if reading_store is not None else nullcontext()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the columnar store of the readings.")
+    parser.add_argument("command", choices=["rebuild"])
+    args = parser.parse_args()
+
+    if reading_store is None:
+        parser.error("Set STREEM_COLUMNAR_STORE_PATH to enable the columnar store")
+
+    if args.command == "rebuild":
+        with default_engine.connect() as connection:
+            print(f"{rebuild(reading_store, connection)} readings stored")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+API configuration.
+Every setting can be overridden with an environment variable prefixed with `STREEM_`
+(e.g. `STREEM_DATABASE_URL`) or in a `.env` file.
+"""
+# Standard imports
+from functools import lru_cache
+from typing import Literal
+
+# 3rd party imports
+from pydantic import BaseSettings
+
+
+class Settings(BaseSettings):
+    """
+    API settings.
+    """
+    # Create or upgrade the database schema when the application starts
+    upgrade_on_startup: bool = True
+
+    # Database engine
+    database_url: str = "sqlite:///./database/streem_sql.db"
+    async_database_url: str | None = None  # Derived from `database_url` if not set
+    database_echo: bool = False
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_timeout: float = 30  # in seconds
+
+    # Pragmas applied to each new SQLite connection
+    sqlite_journal_mode: Literal["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"] = "WAL"
+    sqlite_synchronous: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = "NORMAL"
+    sqlite_mmap_size: int = 256 * 1024 * 1024  # in bytes
+    sqlite_cache_size: int = -64 * 1024  # Negative values are in KiB, positive in pages
+    sqlite_busy_timeout: int = 5000  # in milliseconds
+    sqlite_foreign_keys: bool = True
+
+    # Compression of the responses (gzip, or brotli if installed)
+    compression_enabled: bool = True
+    compression_minimum_size: int = 1000  # in bytes, smaller responses are not compressed
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 4
+
+    # Prometheus metrics served on `/metrics`
+    metrics_enabled: bool = True
+
+    # SQL statements checks of each request: "off", "warn" (log) or "raise"
+    query_budget_mode: Literal["off", "warn", "raise"] = "warn"
+    query_max_repeats: int = 5  # Max executions of the same statement per request
+
+    # Directory of the columnar store of the meter readings (disabled when unset)
+    columnar_store_path: str | None = None
+
+    # Precomputation of the missing invoices of all the factories when a month closes
+    invoice_precompute_enabled: bool = False
+    invoice_precompute_workers: int = 1  # Processes computing the invoices
+    invoice_precompute_chunk_size: int = 1000  # Factories per chunk
+    invoice_precompute_delay: float = 24  # in hours after the month closes, for late readings
+
+    # Group commit of the meter readings created one at a time
+    meter_reading_group_commit: bool = False
+    meter_reading_group_size: int = 256  # Max readings per transaction
+    meter_reading_group_delay: float = 0  # in milliseconds, max wait for more readings
+
+    # Cache of the invoices read by month (0 disables it)
+    invoice_cache_size: int = 4096  # Max number of entries
+    invoice_cache_ttl: float = 300  # in seconds
+
+    class Config:
+        env_prefix = "STREEM_"
+        env_file = ".env"
+
+    def get_async_database_url(self) -> str:
+        """
+        Get the URL of the async engine, using the aiosqlite driver for SQLite databases.
+        """
+        if self.async_database_url is not None:
+            return self.async_database_url
+        return self.database_url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+
+@lru_cache()
+def get_settings() -> Settings:
+    """
+    Get the API settings, read once from the environment.
+    """
+    return Settings()
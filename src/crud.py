@@ -1,20 +1,36 @@
 # Standard imports
+from contextlib import contextmanager
 from datetime import date
+from typing import Iterator
 
 # 3rd party imports
 from fastapi.logger import logger
-from sqlalchemy import extract
+from sqlalchemy import Integer, and_, cast, delete, exists, func, insert, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 
 # Local imports
+import columnar
 import schemas
+from cache import (
+    energy_producer_invoices_key,
+    factory_invoice_key,
+    invoice_cache,
+    is_energy_producer_invoices_key
+)
 from models import (
+    DEFERRED_CHANGES_SCOPE,
+    ChangeCounter,
     ElectricalMeter,
     MeterReading,
     EnergyProducer,
     Factory,
     Invoice
 )
+from utils import in_period, period_bounds
+
+SQL_CHUNK_SIZE = 500  # Max number of values bound in a single `IN` clause
+DEFERRED_CHANGES_MIN_ROWS = 100  # Smaller writes let the triggers count their changes
 
 # -------------- Energy Producers
 
@@ -30,11 +46,16 @@ def read_energy_producer_by_name(db: Session, name: str):
     """
     return db.query(EnergyProducer).filter(EnergyProducer.name == name).first()
 
-def read_energy_producers(db: Session, skip: int = 0, limit: int = 100):
+def read_energy_producers(
+    db: Session, skip: int = 0, limit: int = 100, after: tuple[int] = None):
     """
-    Read all the energy producers in database.
+    Read all the energy producers in database, ordered by `uid`.
+    Use `after` (a `(uid,)` key) to read the rows following a previous page.
     """
-    return db.query(EnergyProducer).offset(skip).limit(limit).all()
+    query = db.query(EnergyProducer).order_by(EnergyProducer.uid)
+    if after is not None:
+        query = query.filter(EnergyProducer.uid > after[0])
+    return query.offset(skip).limit(limit).all()
 
 def create_energy_producer(db: Session, energy_producer: schemas.EnergyProducerCreate):
     """
@@ -55,11 +76,16 @@ def read_factory(db: Session, uid: int):
     """
     return db.query(Factory).filter(Factory.uid == uid).first()
 
-def read_factories(db: Session, skip: int = 0, limit: int = 100):
+def read_factories(
+    db: Session, skip: int = 0, limit: int = 100, after: tuple[int] = None):
     """
-    Read all the factories in database.
+    Read all the factories in database, ordered by `uid`.
+    Use `after` (a `(uid,)` key) to read the rows following a previous page.
     """
-    return db.query(Factory).offset(skip).limit(limit).all()
+    query = db.query(Factory).order_by(Factory.uid)
+    if after is not None:
+        query = query.filter(Factory.uid > after[0])
+    return query.offset(skip).limit(limit).all()
 
 def create_factory(db: Session, factory: schemas.FactoryCreate):
     """
@@ -69,6 +95,7 @@ def create_factory(db: Session, factory: schemas.FactoryCreate):
     db.add(db_factory)
     db.commit()
     db.refresh(db_factory)
+    evict_cached_energy_producer_invoices(db_factory.owner_uid)
     logger.debug("Factory created: %s", db_factory)
     return db_factory
 
@@ -80,11 +107,31 @@ def read_electrical_meter(db: Session, uid: int):
     """
     return db.query(ElectricalMeter).filter(ElectricalMeter.uid == uid).first()
 
-def read_electrical_meters(db: Session, skip: int = 0, limit: int = 100):
+def read_electrical_meters(
+    db: Session, skip: int = 0, limit: int = 100, after: tuple[int] = None):
     """
-    Read all the electrical meters in database.
+    Read all the electrical meters in database, ordered by `uid`.
+    Use `after` (a `(uid,)` key) to read the rows following a previous page.
     """
-    return db.query(ElectricalMeter).offset(skip).limit(limit).all()
+    query = db.query(ElectricalMeter).order_by(ElectricalMeter.uid)
+    if after is not None:
+        query = query.filter(ElectricalMeter.uid > after[0])
+    return query.offset(skip).limit(limit).all()
+
+def read_existing_electrical_meter_uids(db: Session, uids: set[int]) -> set[int]:
+    """
+    Get the subset of `uids` matching an electrical meter in database.
+    """
+    uids = list(uids)
+    existing_uids = set()
+    # Stay below the SQLite limit of host parameters per statement
+    for i in range(0, len(uids), SQL_CHUNK_SIZE):
+        existing_uids.update(
+            uid for uid, in db.query(ElectricalMeter.uid).filter(
+                ElectricalMeter.uid.in_(uids[i:i + SQL_CHUNK_SIZE])
+            )
+        )
+    return existing_uids
 
 def create_electrical_meter(db: Session, electrical_meter: schemas.ElectricalMeterCreate):
     """
@@ -98,6 +145,10 @@ def create_electrical_meter(db: Session, electrical_meter: schemas.ElectricalMet
     db.add(db_electrical_meter)
     db.commit()
     db.refresh(db_electrical_meter)
+    if len(invoice_cache):
+        owner_uid = db.query(Factory.owner_uid).filter(
+            Factory.uid == db_electrical_meter.factory_uid).scalar()
+        evict_cached_energy_producer_invoices(owner_uid)
     logger.debug("Electrical meter created: %s", db_electrical_meter)
     return db_electrical_meter
 
@@ -115,49 +166,208 @@ def read_meter_readings(
     month: int = None,
     day: int = None,
     skip: int = 0,
-    limit: int = 100):
+    limit: int = 100,
+    after: tuple[date, int] = None):
     """
-    Read all the meter readings in database.
+    Read all the meter readings in database, ordered by `date` and `uid`.
+    Readings can be filtered on a specific `year`, `month` or `day`.
+    Use `after` (a `(date, uid)` key) to read the rows following a previous page.
     """
+    query = db.query(MeterReading).order_by(MeterReading.date, MeterReading.uid)
     if year is not None:
-        if month is not None:
-            if day is not None:
-                # Full date case
-                return db.query(MeterReading).filter(
-                    extract("year", MeterReading.date) == year,
-                    extract("month", MeterReading.date) == month,
-                    extract("day", MeterReading.date) == day
-                ).offset(skip).limit(limit).all()
-
-            # Month case
-            return db.query(MeterReading).filter(
-                extract("year", MeterReading.date) == year,
-                extract("month", MeterReading.date) == month
-            ).offset(skip).limit(limit).all()
-
-        # Default case, only year
-        return db.query(MeterReading).filter(
-            extract("year", MeterReading.date) == year
-        ).offset(skip).limit(limit).all()
-
-    return db.query(MeterReading).offset(skip).limit(limit).all()
+        start, end = period_bounds(year, month, day if month is not None else None)
+        query = query.filter(in_period(MeterReading.date, start, end))
+    if after is not None:
+        query = query.filter(tuple_(MeterReading.date, MeterReading.uid) > tuple_(*after))
 
-def create_meter_reading(
-    db: Session, meter_reading: schemas.MeterReadingCreate):
+    return query.offset(skip).limit(limit).all()
+
+def iter_electrical_meter_readings(
+    db: Session, electrical_meter_uid: int, batch_size: int = 1000) -> Iterator[tuple]:
+    """
+    Iterate over all the meter readings of a specific electrical meter, ordered by date.
+    Readings are fetched `batch_size` rows at a time from the database cursor and
+    yielded as plain `(uid, date, amount, electrical_meter_uid)` tuples,
+    so memory stays flat whatever the length of the history.
+    """
+    return db.query(
+        MeterReading.uid,
+        MeterReading.date,
+        MeterReading.amount,
+        MeterReading.electrical_meter_uid
+    ).filter(
+        MeterReading.electrical_meter_uid == electrical_meter_uid
+    ).order_by(MeterReading.date, MeterReading.uid).yield_per(batch_size)
+
+def evict_cached_energy_producer_invoices(energy_producer_uid: int):
+    """
+    Evict the cached invoices of an energy producer for every month, e.g. when one of its
+    factories is created.
+    """
+    if len(invoice_cache):
+        invoice_cache.evict_matching(
+            lambda key: is_energy_producer_invoices_key(key, energy_producer_uid))
+
+def evict_cached_invoices(db: Session, meter_readings: list[schemas.MeterReadingCreate]):
+    """
+    Evict the cached invoices of the factories (and their owners) whose production
+    changes with `meter_readings`.
+    """
+    if not len(invoice_cache):
+        return
+
+    periods = {}
+    for meter_reading in meter_readings:
+        periods.setdefault(meter_reading.electrical_meter_uid, set()).add(
+            (meter_reading.date.year, meter_reading.date.month))
+    meter_uids = list(periods)
+    for i in range(0, len(meter_uids), SQL_CHUNK_SIZE):
+        rows = db.query(
+            ElectricalMeter.uid, Factory.uid, Factory.owner_uid
+        ).join(Factory).filter(ElectricalMeter.uid.in_(meter_uids[i:i + SQL_CHUNK_SIZE]))
+        for meter_uid, factory_uid, owner_uid in rows:
+            for year, month in periods[meter_uid]:
+                invoice_cache.evict(
+                    factory_invoice_key(factory_uid, year, month),
+                    energy_producer_invoices_key(owner_uid, year, month)
+                )
+
+def delete_outdated_invoices(
+    db: Session, meter_readings: list[schemas.MeterReadingCreate]) -> int:
+    """
+    Delete the saved invoices of the factories whose production changes with
+    `meter_readings`, for the months of the readings (e.g. readings sent late, after the
+    invoices were precomputed), without committing. They are computed again when read.
+    Return the number of deleted invoices.
+    """
+    months = {}
+    for meter_reading in meter_readings:
+        months.setdefault(meter_reading.electrical_meter_uid, set()).add(
+            meter_reading.date.replace(day=1))
+    meter_uids = list(months)
+    keys = set()
+    for i in range(0, len(meter_uids), SQL_CHUNK_SIZE):
+        rows = db.query(ElectricalMeter.uid, ElectricalMeter.factory_uid).filter(
+            ElectricalMeter.uid.in_(meter_uids[i:i + SQL_CHUNK_SIZE]))
+        for meter_uid, factory_uid in rows:
+            keys.update((factory_uid, month) for month in months[meter_uid])
+
+    # Invoices are dated on the first day of their month
+    keys = list(keys)
+    deleted = 0
+    for i in range(0, len(keys), SQL_CHUNK_SIZE):
+        deleted += db.execute(
+            delete(Invoice).where(
+                tuple_(Invoice.factory_uid, Invoice.date).in_(keys[i:i + SQL_CHUNK_SIZE])
+            ).execution_options(synchronize_session=False)
+        ).rowcount
+    return deleted
+
+def _upsert_meter_readings_statement():
     """
-    Create a new electrical production in database.
+    Statement inserting meter readings, or overwriting the amount of the reading of the
+    same electrical meter and date (e.g. sent again by a gateway).
     """
-    db_meter_reading = MeterReading(
-        date=meter_reading.date,
-        amount=meter_reading.amount,
-        electrical_meter_uid=meter_reading.electrical_meter_uid
+    statement = sqlite_insert(MeterReading)
+    return statement.on_conflict_do_update(
+        index_elements=[MeterReading.electrical_meter_uid, MeterReading.date],
+        set_={"amount": statement.excluded.amount}
     )
-    db.add(db_meter_reading)
-    db.commit()
-    db.refresh(db_meter_reading)
+
+def _meter_reading_values(meter_reading: schemas.MeterReadingCreate) -> dict:
+    return {
+        "date": meter_reading.date,
+        "amount": meter_reading.amount,
+        "electrical_meter_uid": meter_reading.electrical_meter_uid
+    }
+
+def _execute_meter_readings_upsert(
+    db: Session, meter_readings: list[schemas.MeterReadingCreate]):
+    """
+    Upsert many meter readings with `executemany`, incrementing the change counter
+    of each electrical meter once.
+    """
+    meter_uids = {meter_reading.electrical_meter_uid for meter_reading in meter_readings}
+    counters = {"meter_readings": meter_uids}
+    with deferred_change_counters(db, counters, row_count=len(meter_readings)):
+        db.execute(
+            _upsert_meter_readings_statement(),
+            [_meter_reading_values(meter_reading) for meter_reading in meter_readings]
+        )
+
+def upsert_meter_readings(
+    db: Session, meter_readings: list[schemas.MeterReadingCreate]) -> list[int]:
+    """
+    Create or overwrite many meter readings in the current transaction, without
+    committing it, and delete the invoices they make outdated.
+    Return the `uid` of each reading.
+    """
+    if not meter_readings:
+        return []
+
+    _execute_meter_readings_upsert(db, meter_readings)
+    delete_outdated_invoices(db, meter_readings)
+    keys = list({
+        (meter_reading.electrical_meter_uid, meter_reading.date)
+        for meter_reading in meter_readings
+    })
+    uids = {}
+    for i in range(0, len(keys), SQL_CHUNK_SIZE):
+        rows = db.query(
+            MeterReading.electrical_meter_uid, MeterReading.date, MeterReading.uid
+        ).filter(
+            tuple_(MeterReading.electrical_meter_uid, MeterReading.date).in_(
+                keys[i:i + SQL_CHUNK_SIZE])
+        )
+        uids.update({(meter_uid, date): uid for meter_uid, date, uid in rows})
+    return [
+        uids[meter_reading.electrical_meter_uid, meter_reading.date]
+        for meter_reading in meter_readings
+    ]
+
+def create_meter_reading(
+    db: Session, meter_reading: schemas.MeterReadingCreate):
+    """
+    Create a new electrical production in database, or overwrite the amount of the
+    reading of the same electrical meter and date. The saved invoice of the month of the
+    reading is deleted (see `delete_outdated_invoices`).
+    """
+    values = _meter_reading_values(meter_reading)
+    with columnar.writing_readings():
+        db.execute(_upsert_meter_readings_statement().values(values))
+        delete_outdated_invoices(db, [meter_reading])
+        db.commit()
+        if columnar.reading_store is not None:
+            columnar.reading_store.append_readings([meter_reading])
+    db_meter_reading = db.query(MeterReading).filter(
+        MeterReading.electrical_meter_uid == values["electrical_meter_uid"],
+        MeterReading.date == values["date"]
+    ).one()
+    evict_cached_invoices(db, [meter_reading])
     logger.debug("Meter reading created: %s", db_meter_reading)
     return db_meter_reading
 
+def create_meter_readings(
+    db: Session, meter_readings: list[schemas.MeterReadingCreate]) -> int:
+    """
+    Create (or overwrite) many meter readings in database using a single transaction.
+    Rows are upserted with `executemany`, the ORM objects are never built.
+    The saved invoices of the months of the readings are deleted.
+    Return the number of written meter readings.
+    """
+    if not meter_readings:
+        return 0
+
+    with columnar.writing_readings():
+        _execute_meter_readings_upsert(db, meter_readings)
+        delete_outdated_invoices(db, meter_readings)
+        db.commit()
+        if columnar.reading_store is not None:
+            columnar.reading_store.append_readings(meter_readings)
+    evict_cached_invoices(db, meter_readings)
+    logger.debug("%s meter readings created", len(meter_readings))
+    return len(meter_readings)
+
 # -------------- Invoices
 
 def read_invoice(db: Session, uid: int):
@@ -166,30 +376,179 @@ def read_invoice(db: Session, uid: int):
     """
     return db.query(Invoice).filter(Invoice.uid == uid).first()
 
+def read_factory_invoices(db: Session, factory_uid: int):
+    """
+    Read all the invoices of a specific factory as column tuples, ordered by `date`.
+    """
+    return db.query(
+        Invoice.uid,
+        Invoice.date,
+        Invoice.production,
+        Invoice.price,
+        Invoice.factory_uid
+    ).filter(
+        Invoice.factory_uid == factory_uid
+    ).order_by(Invoice.date, Invoice.uid).all()
+
 def read_invoices(
-    db: Session, skip: int = 0, limit: int = 100, date: date = None):
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    date: date = None,
+    after: tuple[date, int] = None):
     """
-    Read all the invoices in database.
+    Read all the invoices in database, ordered by `date` and `uid`.
+    Invoices can be filtered on the month of a specific `date`.
+    Use `after` (a `(date, uid)` key) to read the rows following a previous page.
     """
+    query = db.query(Invoice).order_by(Invoice.date, Invoice.uid)
     if date is not None:
-        return db.query(Invoice).filter(
-            extract("month", Invoice.date) == date.month
-        ).offset(skip).limit(limit).all()
+        start, end = period_bounds(date.year, date.month)
+        query = query.filter(in_period(Invoice.date, start, end))
+    if after is not None:
+        query = query.filter(tuple_(Invoice.date, Invoice.uid) > tuple_(*after))
 
-    return db.query(Invoice).offset(skip).limit(limit).all()
+    return query.offset(skip).limit(limit).all()
 
-def create_invoice(db: Session, invoice: schemas.InvoiceCreate):
+def read_factory_invoice_at_date(db: Session, factory_uid: int, date: date):
+    """
+    Read the invoice of a specific factory for the month of a specific `date`.
+    """
+    start, end = period_bounds(date.year, date.month)
+    return db.query(Invoice).filter(
+        Invoice.factory_uid == factory_uid,
+        in_period(Invoice.date, start, end)
+    ).first()
+
+def read_energy_producer_invoices_at_date(db: Session, energy_producer_uid: int, date: date):
     """
-    Create a new invoice in database.
+    Read the invoices of all the factories of a specific energy producer
+    for the month of a specific `date`, ordered by factory.
     """
-    db_invoice = Invoice(
-        date=invoice.date,
-        production=invoice.production,
-        price=invoice.price,
-        factory_uid=invoice.factory_uid
+    start, end = period_bounds(date.year, date.month)
+    return db.query(Invoice).join(Factory).filter(
+        Factory.owner_uid == energy_producer_uid,
+        in_period(Invoice.date, start, end)
+    ).order_by(Invoice.factory_uid, Invoice.uid).all()
+
+def read_factory_uids_without_invoice(
+    db: Session,
+    date: date,
+    energy_producer_uid: int = None,
+    with_readings: bool = False) -> list[int]:
+    """
+    Get the `uid` of the factories (of a specific energy producer, or all of them)
+    that have no invoice for the month of a specific `date`.
+    With `with_readings`, factories without any meter reading in that month are skipped.
+    """
+    start, end = period_bounds(date.year, date.month)
+    query = db.query(Factory.uid).outerjoin(Invoice, and_(
+        Invoice.factory_uid == Factory.uid,
+        in_period(Invoice.date, start, end)
+    )).filter(Invoice.uid.is_(None))
+    if energy_producer_uid is not None:
+        query = query.filter(Factory.owner_uid == energy_producer_uid)
+    if with_readings:
+        query = query.filter(exists().where(
+            ElectricalMeter.factory_uid == Factory.uid,
+            MeterReading.electrical_meter_uid == ElectricalMeter.uid,
+            in_period(MeterReading.date, start, end)
+        ))
+    return [uid for uid, in query.order_by(Factory.uid)]
+
+def _upsert_invoices_statement():
+    """
+    Statement inserting invoices, dated on the first day of their month, or replacing
+    the amounts of the invoice of the same factory and month (computed concurrently).
+    """
+    statement = sqlite_insert(Invoice)
+    return statement.on_conflict_do_update(
+        index_elements=[Invoice.factory_uid, Invoice.date],
+        set_={"production": statement.excluded.production, "price": statement.excluded.price}
     )
-    db.add(db_invoice)
+
+def _invoice_values(invoice: schemas.InvoiceCreate) -> dict:
+    return {
+        "date": date(invoice.date.year, invoice.date.month, 1),
+        "production": invoice.production,
+        "price": invoice.price,
+        "factory_uid": invoice.factory_uid
+    }
+
+def create_invoice(db: Session, invoice: schemas.InvoiceCreate):
+    """
+    Create a new invoice in database, or update the invoice of the same factory and month.
+    """
+    values = _invoice_values(invoice)
+    db.execute(_upsert_invoices_statement().values(values))
     db.commit()
-    db.refresh(db_invoice)
+    db_invoice = db.query(Invoice).filter(
+        Invoice.factory_uid == values["factory_uid"],
+        Invoice.date == values["date"]
+    ).one()
     logger.debug("Invoice created: %s", db_invoice)
     return db_invoice
+
+def create_invoices(db: Session, invoices: list[schemas.InvoiceCreate]) -> int:
+    """
+    Create (or update) many invoices in database using a single transaction.
+    Return the number of written invoices.
+    """
+    if not invoices:
+        return 0
+
+    counters = {
+        "invoices": {0},
+        "factory_invoices": {invoice.factory_uid for invoice in invoices}
+    }
+    with deferred_change_counters(db, counters, row_count=len(invoices)):
+        db.execute(
+            _upsert_invoices_statement(), [_invoice_values(invoice) for invoice in invoices])
+    db.commit()
+    logger.debug("%s invoices created", len(invoices))
+    return len(invoices)
+
+# -------------- Change counters
+
+@contextmanager
+def deferred_change_counters(
+    db: Session, counters: dict[str, set[int]], row_count: int) -> Iterator[None]:
+    """
+    Disable the change counter triggers for the writes of the block, then increment
+    each of `counters` (the keys of each scope) once, in the current transaction.
+    Triggers run for each row, this keeps writes of many rows from incrementing the same
+    counters thousands of times. Writes of less than `DEFERRED_CHANGES_MIN_ROWS` rows
+    keep the triggers, which cost less than the 3 statements deferring them.
+    """
+    if row_count < DEFERRED_CHANGES_MIN_ROWS:
+        yield
+        return
+
+    db.execute(insert(ChangeCounter).values(scope=DEFERRED_CHANGES_SCOPE, key=0, version=0))
+    try:
+        yield
+    finally:
+        # Rows written before a failing statement change the counters too
+        db.execute(
+            delete(ChangeCounter).where(ChangeCounter.scope == DEFERRED_CHANGES_SCOPE))
+        rows = [
+            {"scope": scope, "key": key, "version": 1}
+            for scope, keys in counters.items() for key in keys
+        ]
+        statement = sqlite_insert(ChangeCounter).values(
+            updated_at=cast(func.strftime("%s", "now"), Integer))
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[ChangeCounter.scope, ChangeCounter.key],
+            set_={
+                "version": ChangeCounter.version + 1,
+                "updated_at": statement.excluded.updated_at
+            }
+        ), rows)
+
+def read_change_counter(db: Session, scope: str, key: int = 0) -> tuple[int, int] | None:
+    """
+    Read the `(version, updated_at)` change counter of a collection,
+    `None` if it never changed.
+    """
+    return db.query(ChangeCounter.version, ChangeCounter.updated_at).filter(
+        ChangeCounter.scope == scope, ChangeCounter.key == key).first()
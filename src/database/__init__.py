@@ -1,4 +1,4 @@
-from .connection import Base, SessionLocal, engine
+from .connection import AsyncSessionLocal, Base, SessionLocal, async_engine, engine
 
 def get_db():
     """
@@ -8,4 +8,11 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    """
+    Helper function used to get an async database session.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,14 +1,90 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./database/streem_sql.db"
+from config import Settings, get_settings
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, echo=False, connect_args={"check_same_thread": False}
-)
+
+def set_sqlite_pragmas(dbapi_connection, settings: Settings):
+    """
+    Apply the configured pragmas to a new SQLite connection.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+    cursor.execute(f"PRAGMA cache_size={int(settings.sqlite_cache_size)}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout)}")
+    cursor.execute(f"PRAGMA foreign_keys={'ON' if settings.sqlite_foreign_keys else 'OFF'}")
+    cursor.close()
+
+
+def _engine_options(url: str, settings: Settings, poolclass) -> dict:
+    options = {"echo": settings.database_echo}
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+        if url.database in (None, "", ":memory:"):
+            # In-memory databases only live as long as their connection
+            return options
+
+    # Keep connections open, so that SQLite page cache and memory map are reused
+    options.update(
+        poolclass=poolclass,
+        pool_size=settings.database_pool_size,
+        max_overflow=settings.database_max_overflow,
+        pool_timeout=settings.database_pool_timeout
+    )
+    return options
+
+
+def build_engine(settings: Settings) -> Engine:
+    """
+    Build the database engine described by `settings`.
+    """
+    engine = create_engine(
+        settings.database_url, **_engine_options(settings.database_url, settings, QueuePool)
+    )
+    if engine.dialect.name == "sqlite":
+        event.listen(
+            engine,
+            "connect",
+            lambda dbapi_connection, _: set_sqlite_pragmas(dbapi_connection, settings)
+        )
+    return engine
+
+
+def build_async_engine(settings: Settings) -> AsyncEngine:
+    """
+    Build the async database engine described by `settings`.
+    """
+    url = settings.get_async_database_url()
+    async_engine = create_async_engine(
+        url, **_engine_options(url, settings, AsyncAdaptedQueuePool)
+    )
+    if async_engine.dialect.name == "sqlite":
+        event.listen(
+            async_engine.sync_engine,
+            "connect",
+            lambda dbapi_connection, _: set_sqlite_pragmas(dbapi_connection, settings)
+        )
+    return async_engine
+
+
+engine = build_engine(get_settings())
+
+# Async engine on the same database, used by `async def` route handlers
+async_engine = build_async_engine(get_settings())
 
 # Database session
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()   
\ No newline at end of file
+# Async database session
+AsyncSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=async_engine, class_=AsyncSession
+)
+
+Base = declarative_base()
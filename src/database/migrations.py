@@ -0,0 +1,229 @@
+"""
+Database migrations.
+`Base.metadata.create_all` only creates missing tables, this module also brings the
+tables of an existing database (like `streem_sql.db`) up to date with the models.
+Usage, from the `src/` directory:
+- `python -m database.migrations` upgrades the database.
+- `python -m database.migrations deduplicate` deletes the duplicates that keep unique
+  indexes from being created (reported by the upgrade), then upgrades the database.
+- `python -m database.migrations rebuild-rollups` regenerates the monthly productions
+  rollup from the raw meter readings.
+"""
+# Standard imports
+import argparse
+
+# 3rd party imports
+from fastapi.logger import logger
+from sqlalchemy import Integer, cast, delete, func, inspect, insert, literal, select, true
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection, Engine
+
+# Local imports
+import models
+from .connection import engine as default_engine
+
+
+def rebuild_monthly_productions(connection: Connection):
+    """
+    Regenerate the monthly productions rollup from the raw meter readings.
+    """
+    reading = models.MeterReading
+    year = cast(func.strftime("%Y", reading.date), Integer)
+    month = cast(func.strftime("%m", reading.date), Integer)
+    connection.execute(delete(models.MonthlyProduction))
+    connection.execute(insert(models.MonthlyProduction).from_select(
+        ["electrical_meter_uid", "year", "month", "amount", "reading_count"],
+        select(
+            reading.electrical_meter_uid,
+            year,
+            month,
+            func.sum(func.coalesce(reading.amount, 0)),
+            func.count()
+        ).where(
+            reading.date.is_not(None),
+            reading.electrical_meter_uid.is_not(None)
+        ).group_by(reading.electrical_meter_uid, year, month)
+    ))
+
+
+def rebuild_change_counters(connection: Connection):
+    """
+    Increment the change counters of every collection holding rows, after rows were
+    written with the triggers disabled (or before the counters existed).
+    """
+    now = cast(func.strftime("%s", "now"), Integer)
+    collections = [
+        select(literal("invoices"), literal(0)).where(
+            select(models.Invoice.uid).exists()),
+        select(literal("factory_invoices"), models.Invoice.factory_uid).where(
+            models.Invoice.factory_uid.is_not(None)).distinct(),
+        select(literal("meter_readings"), models.MeterReading.electrical_meter_uid).where(
+            models.MeterReading.electrical_meter_uid.is_not(None)).distinct(),
+    ]
+    counter = models.ChangeCounter
+    for collection in collections:
+        # SQLite needs a `WHERE` clause to parse the `ON CONFLICT` of an `INSERT ... SELECT`
+        statement = sqlite_insert(counter).from_select(
+            ["scope", "key", "version", "updated_at"],
+            select(*collection.subquery().c, literal(1), now).where(true())
+        )
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[counter.scope, counter.key],
+            set_={"version": counter.version + 1, "updated_at": statement.excluded.updated_at}
+        ))
+
+
+def duplicate_invoices() -> list:
+    """
+    Conditions selecting the invoices computed more than once for the same factory and
+    month, except the first one.
+    """
+    invoice = models.Invoice
+    first_uids = select(func.min(invoice.uid)).group_by(invoice.factory_uid, invoice.date)
+    return [invoice.factory_uid.is_not(None), invoice.uid.not_in(first_uids)]
+
+
+def duplicate_meter_readings() -> list:
+    """
+    Conditions selecting the readings sent more than once for the same electrical meter
+    and date, except the last one.
+    """
+    reading = models.MeterReading
+    last_uids = select(func.max(reading.uid)).group_by(
+        reading.electrical_meter_uid, reading.date)
+    return [
+        reading.electrical_meter_uid.is_not(None),
+        reading.date.is_not(None),
+        reading.uid.not_in(last_uids)
+    ]
+
+
+# Unique indexes added to existing tables, with the non-unique index they replace and
+# the conditions selecting the duplicates they would reject
+UNIQUE_INDEXES = {
+    "uq_invoices_factory_uid_date": (
+        models.Invoice.__table__,
+        "ix_invoices_factory_uid_date",
+        duplicate_invoices
+    ),
+    "uq_meter_readings_electrical_meter_uid_date": (
+        models.MeterReading.__table__,
+        "ix_meter_readings_electrical_meter_uid_date",
+        duplicate_meter_readings
+    ),
+}
+
+
+def _missing_unique_indexes(connection: Connection) -> list[str]:
+    return [
+        index_name for index_name, (table, _, _) in UNIQUE_INDEXES.items()
+        if index_name not in {
+            index["name"] for index in inspect(connection).get_indexes(table.name)}
+    ]
+
+
+def deduplicate(connection: Connection) -> dict[str, int]:
+    """
+    Delete the duplicates of the tables not given their unique index yet, so that the
+    next upgrade can create it. Keep the first invoice of each factory and month, and the
+    last reading of each electrical meter and date.
+    Return the number of deleted rows of each table.
+    """
+    deleted = {}
+    for index_name in _missing_unique_indexes(connection):
+        table, _, duplicate_rows = UNIQUE_INDEXES[index_name]
+        deleted[table.name] = connection.execute(
+            delete(table).where(*duplicate_rows())).rowcount
+    return deleted
+
+
+def upgrade(engine: Engine) -> dict[str, int]:
+    """
+    Create the missing tables, indexes and triggers of the database.
+    Every step is idempotent, so this can safely run each time the API starts.
+    Unique indexes are not created on tables holding duplicates, which are never deleted
+    here: a warning asks to run the `deduplicate` command.
+    Return the number of duplicates of each table left without its unique index.
+    """
+    duplicates = {}
+    has_rollup = inspect(engine).has_table(models.MonthlyProduction.__tablename__)
+    has_change_counters = inspect(engine).has_table(models.ChangeCounter.__tablename__)
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as connection:
+        skipped_indexes = set()
+        for index_name in _missing_unique_indexes(connection):
+            table, replaced_name, duplicate_rows = UNIQUE_INDEXES[index_name]
+            count = connection.execute(
+                select(func.count()).select_from(table).where(*duplicate_rows())
+            ).scalar()
+            if count:
+                # Tables that used to be unconstrained keep their index until deduplicated
+                duplicates[table.name] = count
+                skipped_indexes.add(index_name)
+                logger.warning(
+                    "%s duplicate rows in the %s table, %s not created and writes to the "
+                    "table fail until they are deleted with "
+                    "`python -m database.migrations deduplicate`",
+                    count, table.name, index_name
+                )
+            else:
+                connection.exec_driver_sql(f"DROP INDEX IF EXISTS {replaced_name}")
+
+        # Indexes of tables that already existed are not created by `create_all`
+        for table in models.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in skipped_indexes:
+                    index.create(bind=connection, checkfirst=True)
+
+        # Triggers are recreated in case their definition changed
+        for trigger_name in models.TRIGGERS:
+            connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger_name}")
+            connection.exec_driver_sql(models.create_trigger_statement(trigger_name))
+
+        # The rollup of an existing database starts empty, fill it from its readings
+        if not has_rollup:
+            rebuild_monthly_productions(connection)
+        if not has_change_counters:
+            rebuild_change_counters(connection)
+
+    return duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upgrade the API database.")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["upgrade", "deduplicate", "rebuild-rollups"],
+        default="upgrade"
+    )
+    args = parser.parse_args()
+
+    deleted = {}
+    if args.command == "deduplicate":
+        with default_engine.begin() as connection:
+            deleted = deduplicate(connection)
+        for table_name, count in deleted.items():
+            print(f"{count} duplicate rows deleted from the {table_name} table")
+
+    upgrade(default_engine)
+    if deleted.get(models.MeterReading.__tablename__):
+        # Local imports
+        import columnar
+
+        # The columnar store still holds the deleted readings
+        if columnar.reading_store is not None:
+            with default_engine.connect() as connection:
+                count = columnar.rebuild(columnar.reading_store, connection)
+            print(f"Columnar store rebuilt with {count} readings")
+        else:
+            print("Rebuild the columnar store if the API enables it: "
+                  "`python -m columnar rebuild`")
+    if args.command == "rebuild-rollups":
+        with default_engine.begin() as connection:
+            rebuild_monthly_productions(connection)
+
+
+if __name__ == "__main__":
+    main()
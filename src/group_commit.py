@@ -0,0 +1,138 @@
+"""
+Group commit of the meter readings created one at a time.
+Each SQLite commit takes the write lock and syncs the journal, which limits the rate of
+single-reading requests. `MeterReadingWriter` queues these readings instead, and a single
+writer thread inserts them in groups, one transaction per group. A group holds the
+readings queued while the previous one was being committed (up to `max_group_size`), and
+can wait up to `max_delay` seconds for more readings, at the cost of latency under a low
+load. Each request is acknowledged only once the group holding its reading is committed.
+The writer is enabled by the `meter_reading_group_commit` setting.
+"""
+# Standard imports
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# 3rd party imports
+from fastapi.logger import logger
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# Local imports
+import columnar
+import crud
+import schemas
+
+
+class MeterReadingWriter:
+    """
+    Writer thread committing the queued meter readings in groups.
+    """
+    def __init__(self, engine: Engine, max_group_size: int = 256, max_delay: float = 0):
+        self.engine = engine
+        self.max_group_size = max_group_size
+        self.max_delay = max_delay
+        # Readings to write with the future of their request, `None` stops the writer
+        self._queue: queue.SimpleQueue[tuple[schemas.MeterReadingCreate, Future] | None] = \
+            queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="meter-reading-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """
+        Stop the writer once the readings queued so far are written.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, meter_reading: schemas.MeterReadingCreate) -> Future:
+        """
+        Queue a meter reading, the returned future gets the created reading once committed.
+        """
+        future = Future()
+        self._queue.put((meter_reading, future))
+        return future
+
+    def write(self, meter_reading: schemas.MeterReadingCreate) -> schemas.MeterReading:
+        """
+        Queue a meter reading and wait for its group to be committed.
+        """
+        return self.submit(meter_reading).result()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            group = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(group) < self.max_group_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                group.append(item)
+            self._write_group(group)
+
+    def _write_group(self, group: list[tuple[schemas.MeterReadingCreate, Future]]):
+        meter_readings = [meter_reading for meter_reading, _ in group]
+        try:
+            with columnar.writing_readings():
+                created = self._insert(meter_readings)
+                self._append(meter_readings)
+        except Exception as error:
+            if len(group) == 1:
+                group[0][1].set_exception(error)
+                return
+            # An invalid reading (e.g. of an unknown meter) fails the whole transaction,
+            # write the readings of the group one by one to only reject the invalid ones
+            for item in group:
+                self._write_group([item])
+            return
+
+        try:
+            with Session(self.engine) as db:
+                crud.evict_cached_invoices(db, meter_readings)
+        except Exception:
+            logger.exception("Post-commit update of %s meter readings failed", len(group))
+
+        for (_, future), meter_reading in zip(group, created):
+            future.set_result(meter_reading)
+        logger.debug("%s meter readings created in a group", len(group))
+
+    def _append(self, meter_readings: list[schemas.MeterReadingCreate]):
+        """
+        Append committed meter readings to the columnar store, if enabled.
+        """
+        if columnar.reading_store is None:
+            return
+        try:
+            columnar.reading_store.append_readings(meter_readings)
+        except Exception:
+            # The readings are committed, they must not be written again
+            logger.exception("Columnar append of %s meter readings failed", len(meter_readings))
+
+    def _insert(
+        self, meter_readings: list[schemas.MeterReadingCreate]) -> list[schemas.MeterReading]:
+        """
+        Write meter readings in a single transaction, and get them with their `uid`.
+        """
+        with Session(self.engine) as db:
+            uids = crud.upsert_meter_readings(db, meter_readings)
+            db.commit()
+        return [
+            schemas.MeterReading(uid=uid, **meter_reading.dict())
+            for uid, meter_reading in zip(uids, meter_readings)
+        ]
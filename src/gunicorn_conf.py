@@ -0,0 +1,40 @@
+"""
+Gunicorn configuration of the API, with uvicorn workers.
+Usage, from the `src/` directory: `gunicorn -c gunicorn_conf.py app:app`
+The application is imported once by the master process (`preload_app`) and the workers
+are forked with every module already loaded. Importing the application doesn't open the
+database, so the workers don't inherit any connection. The master upgrades the schema
+once before forking, the workers skip the startup upgrade.
+Set `WEB_CONCURRENCY` to choose the number of workers and `BIND` the listening address.
+"""
+# Standard imports
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# Set before the application is preloaded
+raw_env = ["STREEM_UPGRADE_ON_STARTUP=false"]
+
+
+def on_starting(server):
+    # Local imports
+    from database import engine
+    from database.migrations import upgrade
+
+    # Duplicates keeping unique indexes from being created are logged, never deleted
+    # (see `python -m database.migrations deduplicate`)
+    upgrade(engine)
+    # Close the connections of the master, they must not be shared with the workers
+    engine.dispose()
+
+
+def child_exit(server, worker):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # 3rd party imports
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,58 @@
+"""
+HTTP validation of collection responses (ETag, Last-Modified).
+Validators come from the change counter of the collection (see `models.ChangeCounter`),
+read with a single primary key lookup: when the client copy is still valid, the route
+answers `304 Not Modified` without reading nor serializing the collection.
+"""
+# Standard imports
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+# 3rd party imports
+from fastapi import Request, Response
+
+
+def cache_headers(counter) -> dict[str, str]:
+    """
+    Get the `ETag` and `Last-Modified` headers of a `(version, updated_at)` change counter.
+    """
+    version, updated_at = counter
+    return {
+        # Weak, responses may be compressed
+        "ETag": f'W/"{version}-{updated_at}"',
+        "Last-Modified": formatdate(updated_at, usegmt=True),
+    }
+
+
+def _opaque_tag(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request: Request, headers: dict[str, str]) -> bool:
+    """
+    Check whether the validators sent by the client match the `cache_headers` of the
+    collection. `If-None-Match` takes precedence over `If-Modified-Since`.
+    `Last-Modified` has a one second resolution: a collection modified during the current
+    second may change again within that second, so `If-Modified-Since` is only honored
+    for collections last modified before it.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etag = _opaque_tag(headers["ETag"])
+        return any(
+            tag.strip() == "*" or _opaque_tag(tag) == etag for tag in if_none_match.split(","))
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        last_modified = parsedate_to_datetime(headers["Last-Modified"])
+        return last_modified <= since and last_modified.timestamp() < int(time.time())
+    return False
+
+
+def not_modified_response(headers: dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
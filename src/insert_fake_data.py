@@ -1,14 +1,39 @@
+"""
+Fake data generator, used to test the API and to build load testing datasets.
+Data is deterministic for a given `--seed`. Meter readings are generated as NumPy arrays
+by worker processes and bulk inserted by the main process in large transactions.
+Usage, from the `src/` directory:
+`python insert_fake_data.py --seed 42 --producers 100 --factories 10 --meters 10 --days 1000`
+"""
 # Standard imports
+import argparse
 import csv
 import random 
-from datetime import datetime, timedelta
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from pathlib import Path
 
-# Local imports
-import crud
-from database import SessionLocal
-from models import ElectricalMeter, MeterReading, EnergyProducer, Factory
+# 3rd party imports
+import numpy as np
+from sqlalchemy import insert
+from sqlalchemy.engine import Connection, Engine
 
-random.seed(datetime.now().timestamp())
+# Local imports
+import columnar
+from columnar import ColumnarStore
+from config import Settings
+from database import engine as default_engine
+from database.connection import build_engine
+from database.migrations import rebuild_change_counters, rebuild_monthly_productions, upgrade
+from models import (
+    TRIGGERS,
+    ElectricalMeter,
+    EnergyProducer,
+    Factory,
+    MeterReading,
+    create_trigger_statement
+)
 
 
 COMPANIES = [
@@ -20,9 +45,30 @@ COMPANIES = [
     "FutureNRG"
 ]
 
-factory_cities = []
-with open("../data/cities.csv", "r", encoding="utf8") as fp:
-    factory_cities = [row["name"] for row in csv.DictReader(fp, delimiter=",")]
+CITIES_PATH = Path(__file__).parent.parent / "data" / "cities.csv"
+DEFAULT_CITIES = ["Paris", "Lyon", "Marseille", "Toulouse", "Nantes", "Lille", "Bordeaux"]
+
+MAX_PRODUCTION = 1000  # Max daily amount of a producer meter (in kWh)
+MAX_CONSUMPTION = 500  # Max daily amount of a consumer meter (in kWh)
+
+
+def read_factory_cities() -> list[str]:
+    """
+    Read the cities in which factories are built, from `data/cities.csv` if it exists.
+    """
+    if not CITIES_PATH.exists():
+        return DEFAULT_CITIES
+    with open(CITIES_PATH, "r", encoding="utf8") as fp:
+        return [row["name"] for row in csv.DictReader(fp, delimiter=",")]
+
+
+def build_company_name(idx: int) -> str:
+    """
+    Build a unique company name, using the default names first.
+    """
+    if idx < len(COMPANIES):
+        return COMPANIES[idx]
+    return f"{COMPANIES[idx % len(COMPANIES)]}{idx // len(COMPANIES)}"
 
 
 def build_factory_name(company: str, city: str, idx: int) -> str:
@@ -37,59 +83,202 @@ def build_factory_name(company: str, city: str, idx: int) -> str:
     return f"{upper_case_company}_{three_letters_city}_{idx}"
 
 
-def decision(probability):
+def decision(rng: random.Random, probability: float) -> bool:
     """
     Used to decide if an electrical meter is a producer or not
     """
-    return random.random() < probability
+    return rng.random() < probability
 
 
-def generate_fake_data():
+def insert_structure(
+    connection: Connection,
+    seed: int,
+    producers: int,
+    factories: int,
+    meters: int,
+    producer_ratio: float) -> list[tuple[int, bool]]:
     """
-    Generate some fake data for the API using random.
+    Insert `producers` energy producers, each with `factories` factories,
+    each with `meters` electrical meters.
+    Return the `(uid, is_producer)` of the created electrical meters.
     """
+    rng = random.Random(seed)
+    cities = read_factory_cities()
+    electrical_meters = []
+    for idx_c in range(producers):
+        company = build_company_name(idx_c)
+        company_uid = connection.execute(
+            insert(EnergyProducer).values(name=company)).inserted_primary_key[0]
 
-    db = SessionLocal()
+        for idx_f in range(factories):
+            factory_name = build_factory_name(company, rng.choice(cities), idx_f)
+            factory_uid = connection.execute(insert(Factory).values(
+                name=factory_name, owner_uid=company_uid)).inserted_primary_key[0]
 
-    electrical_meters = []
-    start_date = datetime.strptime("2022-01-01", "%Y-%m-%d")
-    day_count = (datetime.now() - start_date).days
-
-    for company in COMPANIES:
-        # Step 1: Insert companies
-        company_uid = crud.create_energy_producer(db, EnergyProducer(name=company)).uid
-
-        # Step 2: Insert between 2 and 6 factories for each company
-        nb_factories = random.choice(range(2, 7))
-        for idx_f in range(nb_factories):
-            city = random.choice(factory_cities)
-            factory_name = build_factory_name(company, city, idx_f)
-            factory_uid = crud.create_factory(db, Factory(
-                name=factory_name,
-                owner_uid=company_uid 
-            )).uid
-
-            # Step 3: Insert between 1 and 4 electrical meters for each factory
-            nb_elec_meters = random.choice(range(1, 5))
-            for idx_em in range(nb_elec_meters):
-                em = crud.create_electrical_meter(db, ElectricalMeter(
+            for idx_em in range(meters):
+                is_producer = decision(rng, producer_ratio)
+                meter_uid = connection.execute(insert(ElectricalMeter).values(
                     name=f"{factory_name}_em{idx_em}",
-                    is_producer=decision(0.8),  # 80% prob. to be a producer
-                    factory_uid=factory_uid 
-                ))
-                electrical_meters.append(em)
-
-    # Step 4: Insert a meter reading for each day from 01/01/2022 to now 
-    # for each electrical meters
-    for em in electrical_meters:
-        # from 01/01/2022 to now  
-        for single_date in (start_date + timedelta(n) for n in range(day_count)):
-            crud.create_meter_reading(db, MeterReading(
-                date=single_date.date(),
-                amount=(
-                    random.choice(range(1000)) if em.is_producer else random.choice(range(500))
-                ),
-                electrical_meter_uid=em.uid
-            ))
-
-    db.close()
\ No newline at end of file
+                    is_producer=is_producer,
+                    factory_uid=factory_uid
+                )).inserted_primary_key[0]
+                electrical_meters.append((meter_uid, is_producer))
+
+    return electrical_meters
+
+
+def generate_readings(
+    seed: int,
+    electrical_meters: list[tuple[int, bool]],
+    start_date: date,
+    days: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Generate one reading per day for each electrical meter, as `(dates, amounts, meter_uids)`
+    arrays. Each meter has its own random stream, so the readings don't depend on how
+    meters are split between workers.
+    """
+    dates = np.datetime_as_string(
+        np.datetime64(start_date, "D") + np.arange(days), unit="D")
+    all_amounts = []
+    for meter_uid, is_producer in electrical_meters:
+        rng = np.random.default_rng([seed, meter_uid])
+        high = MAX_PRODUCTION if is_producer else MAX_CONSUMPTION
+        all_amounts.append(rng.integers(0, high, size=days).astype(np.float64))
+
+    return (
+        np.tile(dates, len(electrical_meters)),
+        np.concatenate(all_amounts) if all_amounts else np.empty(0),
+        np.repeat([meter_uid for meter_uid, _ in electrical_meters], days)
+    )
+
+
+def _generate_readings_task(task: tuple) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return generate_readings(*task)
+
+
+def insert_readings(
+    connection: Connection, dates: np.ndarray, amounts: np.ndarray, meter_uids: np.ndarray):
+    """
+    Insert meter readings arrays with a single `executemany`.
+    """
+    connection.exec_driver_sql(
+        f"INSERT INTO {MeterReading.__tablename__} (date, amount, electrical_meter_uid) "
+        "VALUES (?, ?, ?)",
+        list(zip(dates.tolist(), amounts.tolist(), meter_uids.tolist()))
+    )
+
+
+def generate_fake_data(
+    engine: Engine = default_engine,
+    seed: int = 0,
+    producers: int = len(COMPANIES),
+    factories: int = 4,
+    meters: int = 3,
+    days: int = 365,
+    start_date: date = date(2022, 1, 1),
+    producer_ratio: float = 0.8,
+    workers: int = 1,
+    batch_size: int = 500_000,
+    reading_store: ColumnarStore | None = None):
+    """
+    Generate some fake data for the API.
+    Readings are inserted in transactions of about `batch_size` rows. The triggers are
+    suspended during the load, the rollup and the change counters are rebuilt at the end
+    (even if the load fails), as well as the columnar `reading_store` if any.
+    """
+    upgrade(engine)
+    with engine.begin() as connection:
+        electrical_meters = insert_structure(
+            connection, seed, producers, factories, meters, producer_ratio)
+
+    meters_per_task = max(1, batch_size // max(days, 1))
+    tasks = [
+        (seed, electrical_meters[i:i + meters_per_task], start_date, days)
+        for i in range(0, len(electrical_meters), meters_per_task)
+    ]
+
+    with engine.connect() as connection:
+        # The connection goes back to the pool, its setting is restored after the load
+        synchronous = connection.exec_driver_sql("PRAGMA synchronous").scalar()
+        connection.exec_driver_sql("PRAGMA synchronous=OFF")
+        try:
+            with connection.begin():
+                for trigger_name in TRIGGERS:
+                    connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger_name}")
+
+            if workers > 1:
+                # Workers generate the next batches while the main process inserts
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    for readings in executor.map(_generate_readings_task, tasks):
+                        with connection.begin():
+                            insert_readings(connection, *readings)
+            else:
+                for task in tasks:
+                    with connection.begin():
+                        insert_readings(connection, *generate_readings(*task))
+        finally:
+            try:
+                # Batches committed before a failure are counted too
+                with connection.begin():
+                    rebuild_monthly_productions(connection)
+                    rebuild_change_counters(connection)
+                    for trigger_name in TRIGGERS:
+                        connection.exec_driver_sql(create_trigger_statement(trigger_name))
+            finally:
+                connection.exec_driver_sql(f"PRAGMA synchronous={int(synchronous)}")
+
+        if reading_store is not None:
+            columnar.rebuild(reading_store, connection)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate fake data for the API.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--producers", type=int, default=len(COMPANIES),
+                        help="Number of energy producers")
+    parser.add_argument("--factories", type=int, default=4,
+                        help="Number of factories per energy producer")
+    parser.add_argument("--meters", type=int, default=3,
+                        help="Number of electrical meters per factory")
+    parser.add_argument("--days", type=int, default=365,
+                        help="Number of daily readings per electrical meter")
+    parser.add_argument("--start-date", type=date.fromisoformat, default=date(2022, 1, 1))
+    parser.add_argument("--producer-ratio", type=float, default=0.8,
+                        help="Probability for an electrical meter to be a producer")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes generating the readings")
+    parser.add_argument("--batch-size", type=int, default=500_000,
+                        help="Number of readings inserted per transaction")
+    parser.add_argument("--database-url", default=None,
+                        help="Database to fill, defaults to the API database")
+    parser.add_argument("--columnar-store", type=Path, default=None,
+                        help="Columnar store to fill, defaults to the API store if enabled")
+    args = parser.parse_args()
+
+    engine, reading_store = default_engine, columnar.reading_store
+    if args.database_url is not None:
+        engine = build_engine(Settings(database_url=args.database_url))
+        reading_store = None
+    if args.columnar_store is not None:
+        reading_store = ColumnarStore(args.columnar_store)
+
+    start = time.perf_counter()
+    generate_fake_data(
+        engine=engine,
+        seed=args.seed,
+        producers=args.producers,
+        factories=args.factories,
+        meters=args.meters,
+        days=args.days,
+        start_date=args.start_date,
+        producer_ratio=args.producer_ratio,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        reading_store=reading_store
+    )
+    readings = args.producers * args.factories * args.meters * args.days
+    print(f"{readings} meter readings generated in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Per-request SQL instrumentation.
+SQLAlchemy events record every statement executed while a request is handled, on any
+engine (sync or async). Statistics are stored in a context variable, which is copied
+to the threads running synchronous route handlers and dependencies.
+`QueryBudgetMiddleware` uses them to report the routes going over their query budget
+(see `query_budget`) or repeating the same statement, the signature of N+1 queries.
+"""
+# Standard imports
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar, Token
+from typing import Callable
+
+# 3rd party imports
+from fastapi.logger import logger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Placeholders lists of expanded `IN` clauses, whose length depends on the parameters
+_PLACEHOLDERS_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACES = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """
+    Raised when a request runs more SQL statements than allowed.
+    """
+
+
+class RequestStats:
+    """
+    SQL statistics of a request.
+    """
+    __slots__ = ("queries", "query_duration", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_duration = 0.0  # in seconds
+        self.statements = Counter()  # Number of executions of each statement shape
+
+    def repeated_statements(self, max_repeats: int) -> dict[str, int]:
+        """
+        Get the statement shapes executed more than `max_repeats` times.
+        """
+        return {
+            statement: count
+            for statement, count in self.statements.items()
+            if count > max_repeats
+        }
+
+
+def statement_shape(statement: str) -> str:
+    """
+    Normalize a SQL statement so that executions with different parameters match.
+    """
+    statement = _PLACEHOLDERS_LIST.sub("(?)", statement)
+    return _WHITESPACES.sub(" ", statement).strip()
+
+
+def query_budget(max_queries: int) -> Callable:
+    """
+    Declare the maximum number of SQL statements a route handler may run per request.
+    Apply it below the router decorator:
+
+        @router.get("/{factory_uid}")
+        @query_budget(1)
+        def read_factory(...):
+    """
+    def decorator(endpoint: Callable) -> Callable:
+        endpoint.query_budget = max_queries
+        return endpoint
+    return decorator
+
+
+_request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+def start_request() -> Token:
+    """
+    Start recording the SQL statements of the current request.
+    """
+    return _request_stats.set(RequestStats())
+
+
+def end_request(token: Token) -> RequestStats:
+    """
+    Stop recording the SQL statements of the current request and get its statistics.
+    """
+    stats = _request_stats.get()
+    _request_stats.reset(token)
+    return stats
+
+
+def current_request_stats() -> RequestStats | None:
+    """
+    Get the SQL statistics of the current request, if it is recorded.
+    """
+    return _request_stats.get()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _request_stats.get() is not None:
+        conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_stats.get()
+    if stats is not None and conn.info.get("query_start_times"):
+        stats.queries += 1
+        stats.query_duration += time.perf_counter() - conn.info["query_start_times"].pop()
+        stats.statements[statement_shape(statement)] += 1
+
+
+def check_query_budget(
+    stats: RequestStats, endpoint: Callable | None, max_repeats: int) -> list[str]:
+    """
+    Get the query budget violations of a request handled by `endpoint`.
+    """
+    violations = []
+    budget = getattr(endpoint, "query_budget", None)
+    if budget is not None and stats.queries > budget:
+        violations.append(f"{stats.queries} SQL statements run, budget is {budget}")
+    for statement, count in stats.repeated_statements(max_repeats).items():
+        violations.append(f"statement run {count} times (N+1 query?): {statement}")
+    return violations
+
+
+class QueryBudgetMiddleware:
+    """
+    ASGI middleware checking the SQL statements run by each HTTP request.
+    Violations are logged as warnings, or raised as `QueryBudgetExceeded`
+    with `raise_errors` (e.g. in tests).
+    """
+    def __init__(self, app: ASGIApp, max_repeats: int = 5, raise_errors: bool = False):
+        self.app = app
+        self.max_repeats = max_repeats
+        self.raise_errors = raise_errors
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Share the statistics of the request when they are already recorded
+        token = start_request() if current_request_stats() is None else None
+        stats = current_request_stats()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if token is not None:
+                end_request(token)
+
+        violations = check_query_budget(stats, scope.get("endpoint"), self.max_repeats)
+        if violations:
+            route = getattr(scope.get("route"), "path", scope["path"])
+            message = f"{scope['method']} {route}: " + "; ".join(violations)
+            if self.raise_errors:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
@@ -0,0 +1,219 @@
+"""
+Month-end precomputation of the invoices.
+Once a month is closed (and a grace delay is over, for the readings sent late), the
+invoices of every factory that has readings but no invoice for that month are computed
+ahead of the API requests. Readings written later delete the invoices of their month,
+which are then computed again when read (see `crud.delete_outdated_invoices`). Factories are split in chunks, computed by a pool of
+processes (each with its own database engine), and the invoices of each chunk are written
+with a single bulk insert by the calling process, the only writer of the database.
+The job runs from the `src/` directory:
+`python -m invoice_jobs [--year 2022 --month 12] [--workers 4]`
+or in the API process, when the `invoice_precompute_enabled` setting is set.
+"""
+# Standard imports
+import argparse
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time as day_start, timedelta
+
+# 3rd party imports
+from fastapi.logger import logger
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# Local imports
+import crud
+from config import Settings, get_settings
+from database import engine as default_engine
+from database.connection import build_engine
+from schemas import InvoiceCreate
+from utils import compute_invoices
+
+STOP_TIMEOUT = 10  # Max wait for a running precomputation when stopping (in seconds)
+
+# Engine of a pool worker process, built once by `_init_worker`
+_worker_engine: Engine | None = None
+
+
+def last_closed_month(today: date = None) -> date:
+    """
+    Get the first day of the last month that is over.
+    """
+    today = today or date.today()
+    if today.month == 1:
+        return date(today.year - 1, 12, 1)
+    return date(today.year, today.month - 1, 1)
+
+
+def next_month_start(today: date = None) -> date:
+    """
+    Get the first day of the month following `today`.
+    """
+    today = today or date.today()
+    if today.month == 12:
+        return date(today.year + 1, 1, 1)
+    return date(today.year, today.month + 1, 1)
+
+
+def compute_invoices_chunk(
+    engine: Engine, factory_uids: list[int], month: date) -> list[InvoiceCreate]:
+    """
+    Compute the invoices of a chunk of factories for a month, without saving them.
+    """
+    with Session(engine) as db:
+        return [
+            InvoiceCreate(
+                date=invoice.date,
+                production=invoice.production,
+                price=invoice.price,
+                factory_uid=invoice.factory_uid
+            )
+            for invoice in compute_invoices(db, factory_uids=factory_uids, date=month)
+        ]
+
+
+def _init_worker(settings: Settings):
+    global _worker_engine
+    _worker_engine = build_engine(settings)
+
+
+def _compute_invoices_task(task: tuple[list[int], date]) -> list[InvoiceCreate]:
+    return compute_invoices_chunk(_worker_engine, *task)
+
+
+def precompute_invoices(
+    engine: Engine = default_engine,
+    month: date = None,
+    workers: int = 1,
+    chunk_size: int = 1000,
+    stopped: threading.Event | None = None) -> int:
+    """
+    Compute and save the missing invoices of all the factories for a `month`
+    (the last closed month by default). Factories without any reading in the month
+    (e.g. without meters) are skipped.
+    Once `stopped` is set, the chunks not computed yet are skipped.
+    Return the number of created invoices.
+    """
+    month = (month or last_closed_month()).replace(day=1)
+    with Session(engine) as db:
+        factory_uids = crud.read_factory_uids_without_invoice(
+            db, date=month, with_readings=True)
+    chunks = [
+        factory_uids[i:i + chunk_size] for i in range(0, len(factory_uids), chunk_size)
+    ]
+
+    created = 0
+    with Session(engine) as db:
+        if workers > 1 and len(chunks) > 1:
+            settings = get_settings().copy(update={
+                "database_url": engine.url.render_as_string(hide_password=False)
+            })
+            # Workers are spawned: the API process runs threads (event loop, database
+            # drivers, writers) whose locks would be copied in any state by a fork
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(settings,)
+            ) as executor:
+                tasks = [(chunk, month) for chunk in chunks]
+                for invoices in executor.map(_compute_invoices_task, tasks):
+                    created += crud.create_invoices(db, invoices=invoices)
+                    if stopped is not None and stopped.is_set():
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        break
+        else:
+            for chunk in chunks:
+                if stopped is not None and stopped.is_set():
+                    break
+                invoices = compute_invoices_chunk(engine, chunk, month)
+                created += crud.create_invoices(db, invoices=invoices)
+
+    logger.info("%s invoices precomputed for %s", created, month.strftime("%Y-%m"))
+    return created
+
+
+class InvoiceScheduler:
+    """
+    Background thread precomputing the invoices of the last closed month when started,
+    then again each time a month closes. Months are only considered closed `delay` hours
+    after their end, to leave time for the readings sent late.
+    """
+    def __init__(
+        self, engine: Engine, workers: int = 1, chunk_size: int = 1000, delay: float = 0):
+        self.engine = engine
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.delay = timedelta(hours=delay)
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="invoice-precompute", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = STOP_TIMEOUT):
+        """
+        Stop the precomputation, waiting at most `timeout` seconds for the chunk being
+        computed. The thread of a precomputation still running is left to the interpreter.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            today = (datetime.now() - self.delay).date()
+            try:
+                precompute_invoices(
+                    self.engine,
+                    month=last_closed_month(today),
+                    workers=self.workers,
+                    chunk_size=self.chunk_size,
+                    stopped=self._stopped
+                )
+            except Exception:
+                logger.exception("Invoices precomputation failed")
+
+            # Wake up once the current month closed, unless stopped before
+            wake_up = datetime.combine(next_month_start(today), day_start()) + self.delay
+            if self._stopped.wait(max(0.0, (wake_up - datetime.now()).total_seconds())):
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute the missing invoices of all the factories for a month.")
+    parser.add_argument("--year", type=int, default=None,
+                        help="Year of the invoices, defaults to the last closed month")
+    parser.add_argument("--month", type=int, default=None, choices=range(1, 13),
+                        metavar="[1-12]")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes computing the invoices")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                        help="Number of factories per computed and inserted chunk")
+    parser.add_argument("--database-url", default=None,
+                        help="Database to fill, defaults to the API database")
+    args = parser.parse_args()
+
+    if (args.year is None) != (args.month is None):
+        parser.error("--year and --month must be given together")
+    month = date(args.year, args.month, 1) if args.year is not None else None
+
+    engine = default_engine
+    if args.database_url is not None:
+        engine = build_engine(Settings(database_url=args.database_url))
+
+    start = time.perf_counter()
+    created = precompute_invoices(
+        engine, month=month, workers=args.workers, chunk_size=args.chunk_size)
+    print(f"{created} invoices precomputed in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
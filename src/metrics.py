@@ -0,0 +1,120 @@
+"""
+Prometheus metrics.
+`PrometheusMiddleware` records the latency, the number of SQL queries and the SQL time
+of each request, labelled by route template (e.g. `/factories/{factory_uid}`).
+When the API runs with several gunicorn workers, set the `PROMETHEUS_MULTIPROC_DIR`
+environment variable so that `/metrics` aggregates the metrics of all the workers.
+"""
+# Standard imports
+import os
+import time
+
+# 3rd party imports
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Local imports
+import instrumentation
+from cache import invoice_cache
+
+UNMATCHED_ROUTE = "unmatched"  # Label of requests matching no route (404)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests.",
+    ["method", "route", "status"]
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Number of HTTP requests being handled.",
+    ["method"],
+    multiprocess_mode="livesum"
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Number of SQL queries executed by HTTP requests.",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+)
+REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent executing SQL queries by HTTP requests.",
+    ["method", "route"]
+)
+
+
+class InvoiceCacheCollector:
+    """
+    Expose the counters of the invoice cache of this worker.
+    """
+    def collect(self):
+        stats = invoice_cache.stats()
+        hits = CounterMetricFamily("invoice_cache_hits", "Invoice cache hits.")
+        hits.add_metric([], stats["hits"])
+        misses = CounterMetricFamily("invoice_cache_misses", "Invoice cache misses.")
+        misses.add_metric([], stats["misses"])
+        size = GaugeMetricFamily("invoice_cache_size", "Number of cached invoice entries.")
+        size.add_metric([], stats["size"])
+        return [hits, misses, size]
+
+
+REGISTRY.register(InvoiceCacheCollector())
+
+
+class PrometheusMiddleware:
+    """
+    ASGI middleware recording the metrics of each HTTP request.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.labels(method).inc()
+        token = instrumentation.start_request()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            stats = instrumentation.end_request(token)
+            REQUESTS_IN_PROGRESS.labels(method).dec()
+            # The router sets the matched route in the scope
+            route = getattr(scope.get("route"), "path", UNMATCHED_ROUTE)
+            REQUEST_DURATION.labels(method, route, status).observe(duration)
+            REQUEST_DB_QUERIES.labels(method, route).observe(stats.queries)
+            REQUEST_DB_DURATION.labels(method, route).observe(stats.query_duration)
+
+
+def metrics_response() -> Response:
+    """
+    Render the metrics in the Prometheus text format.
+    """
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(InvoiceCacheCollector())
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -1,5 +1,16 @@
 # 3rd party imports
-from sqlalchemy import Boolean, Column, Date, Float, ForeignKey, Integer, String
+from sqlalchemy import (
+    DDL,
+    Boolean,
+    Column,
+    Date,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    event
+)
 from sqlalchemy.orm import relationship
 
 # Local imports
@@ -32,7 +43,7 @@ class Factory(Base):
 
     uid = Column(Integer, primary_key=True)
     name = Column(String)
-    owner_uid = Column(Integer, ForeignKey("energy_producers.uid"))
+    owner_uid = Column(Integer, ForeignKey("energy_producers.uid"), index=True)
 
     owner = relationship("EnergyProducer", back_populates="factories")
     electrical_meters = relationship("ElectricalMeter", back_populates="factory")
@@ -49,6 +60,12 @@ class Invoice(Base):
     Each energy producer can have multiple invoices, one per factory per month.
     """
     __tablename__ = "invoices"
+    __table_args__ = (
+        # Invoices are looked up by factory and month, or by month only.
+        # A factory has a single invoice per month (dated on its first day)
+        Index("uq_invoices_factory_uid_date", "factory_uid", "date", unique=True),
+        Index("ix_invoices_date", "date"),
+    )
 
     uid = Column(Integer, primary_key=True)
     date = Column(Date)
@@ -78,7 +95,7 @@ class ElectricalMeter(Base):
     uid = Column(Integer, primary_key=True)
     name = Column(String)
     is_producer = Column(Boolean, default=False)
-    factory_uid = Column(Integer, ForeignKey("factories.uid"))
+    factory_uid = Column(Integer, ForeignKey("factories.uid"), index=True)
 
     factory = relationship("Factory", back_populates="electrical_meters")
     readings = relationship(
@@ -94,6 +111,17 @@ class MeterReading(Base):
     Register amount of electricity produced or consumed everyday.
     """
     __tablename__ = "meter_readings"
+    __table_args__ = (
+        # Readings are filtered by date ranges, for a specific meter or for all meters.
+        # A meter has a single reading per day, sending it again overwrites it
+        Index(
+            "uq_meter_readings_electrical_meter_uid_date",
+            "electrical_meter_uid",
+            "date",
+            unique=True
+        ),
+        Index("ix_meter_readings_date", "date"),
+    )
 
     uid = Column(Integer, primary_key=True)
     date = Column(Date)
@@ -109,3 +137,173 @@ class MeterReading(Base):
             + f"date={self.date}, "
             + f"production={self.production} kWh)>"
         )
+
+
+class MonthlyProduction(Base):
+    """
+    Monthly production rollup.
+    Sum of the readings of an electrical meter for each month, so that invoices don't
+    need to scan the daily readings. Rows are maintained by triggers on `meter_readings`,
+    in the same transaction as every insert, update or delete of a reading.
+    """
+    __tablename__ = "monthly_productions"
+
+    electrical_meter_uid = Column(
+        Integer, ForeignKey("electrical_meters.uid"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    amount = Column(Float, default=0)
+    reading_count = Column(Integer, default=0)
+
+    def __repr__(self) -> str:
+        return (
+            f"<MonthlyProduction("
+            + f"electrical_meter_uid={self.electrical_meter_uid}, "
+            + f"period={self.year}-{self.month:02d}, "
+            + f"amount={self.amount} kWh)>"
+        )
+
+
+# Add (or remove) the amount of a reading to the rollup of its meter and month
+_ROLLUP_ADD = """
+    INSERT INTO monthly_productions (electrical_meter_uid, year, month, amount, reading_count)
+    VALUES (
+        NEW.electrical_meter_uid,
+        CAST(strftime('%Y', NEW.date) AS INTEGER),
+        CAST(strftime('%m', NEW.date) AS INTEGER),
+        COALESCE(NEW.amount, 0),
+        1
+    )
+    ON CONFLICT (electrical_meter_uid, year, month) DO UPDATE SET
+        amount = amount + excluded.amount,
+        reading_count = reading_count + 1;
+"""
+_ROLLUP_REMOVE = """
+    UPDATE monthly_productions SET
+        amount = amount - COALESCE(OLD.amount, 0),
+        reading_count = reading_count - 1
+    WHERE electrical_meter_uid = OLD.electrical_meter_uid
+        AND year = CAST(strftime('%Y', OLD.date) AS INTEGER)
+        AND month = CAST(strftime('%m', OLD.date) AS INTEGER);
+    DELETE FROM monthly_productions
+    WHERE electrical_meter_uid = OLD.electrical_meter_uid
+        AND year = CAST(strftime('%Y', OLD.date) AS INTEGER)
+        AND month = CAST(strftime('%m', OLD.date) AS INTEGER)
+        AND reading_count <= 0;
+"""
+_NEW_IS_SET = "NEW.date IS NOT NULL AND NEW.electrical_meter_uid IS NOT NULL"
+_OLD_IS_SET = "OLD.date IS NOT NULL AND OLD.electrical_meter_uid IS NOT NULL"
+
+MONTHLY_PRODUCTION_TRIGGERS = {
+    "meter_readings_rollup_insert": f"""
+    AFTER INSERT ON meter_readings WHEN {_NEW_IS_SET}
+    BEGIN {_ROLLUP_ADD} END""",
+    "meter_readings_rollup_delete": f"""
+    AFTER DELETE ON meter_readings WHEN {_OLD_IS_SET}
+    BEGIN {_ROLLUP_REMOVE} END""",
+    "meter_readings_rollup_update_remove": f"""
+    AFTER UPDATE OF date, amount, electrical_meter_uid ON meter_readings WHEN {_OLD_IS_SET}
+    BEGIN {_ROLLUP_REMOVE} END""",
+    "meter_readings_rollup_update_add": f"""
+    AFTER UPDATE OF date, amount, electrical_meter_uid ON meter_readings WHEN {_NEW_IS_SET}
+    BEGIN {_ROLLUP_ADD} END""",
+}
+
+
+class ChangeCounter(Base):
+    """
+    Change counter of a collection of rows.
+    `version` is incremented by triggers each time a row of the collection is inserted,
+    updated or deleted, so HTTP responses can be validated (ETag, Last-Modified)
+    without reading the collection.
+    Scopes are `invoices` (all the invoices, `key` 0), `factory_invoices` and
+    `meter_readings` (keyed by factory and electrical meter `uid`).
+    While a transaction holds the counter of the `deferred` scope, the triggers skip its
+    rows, and the counters are incremented once for the whole write instead
+    (see `crud.deferred_change_counters`).
+    """
+    __tablename__ = "change_counters"
+
+    scope = Column(String, primary_key=True)
+    key = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0)
+    updated_at = Column(Integer)  # Unix timestamp (in seconds) of the last change
+
+    def __repr__(self) -> str:
+        return f"<ChangeCounter(scope={self.scope}, key={self.key}, version={self.version})>"
+
+
+def _bump_change_counter(scope: str, key: str) -> str:
+    return f"""
+    INSERT INTO change_counters (scope, key, version, updated_at)
+    VALUES ('{scope}', {key}, 1, CAST(strftime('%s', 'now') AS INTEGER))
+    ON CONFLICT (scope, key) DO UPDATE SET
+        version = version + 1,
+        updated_at = excluded.updated_at;
+"""
+
+
+# Held by writes of many rows within their transaction, never seen by other connections
+DEFERRED_CHANGES_SCOPE = "deferred"
+_CHANGES_NOT_DEFERRED = (
+    f"NOT EXISTS (SELECT 1 FROM change_counters WHERE scope = '{DEFERRED_CHANGES_SCOPE}')")
+
+CHANGE_COUNTER_TRIGGERS = {
+    "invoices_change_insert": f"""
+    AFTER INSERT ON invoices WHEN {_CHANGES_NOT_DEFERRED}
+    BEGIN
+        {_bump_change_counter("invoices", "0")}
+        {_bump_change_counter("factory_invoices", "COALESCE(NEW.factory_uid, 0)")}
+    END""",
+    "invoices_change_delete": f"""
+    AFTER DELETE ON invoices WHEN {_CHANGES_NOT_DEFERRED}
+    BEGIN
+        {_bump_change_counter("invoices", "0")}
+        {_bump_change_counter("factory_invoices", "COALESCE(OLD.factory_uid, 0)")}
+    END""",
+    "invoices_change_update": f"""
+    AFTER UPDATE ON invoices WHEN {_CHANGES_NOT_DEFERRED}
+    BEGIN
+        {_bump_change_counter("invoices", "0")}
+        {_bump_change_counter("factory_invoices", "COALESCE(OLD.factory_uid, 0)")}
+        {_bump_change_counter("factory_invoices", "COALESCE(NEW.factory_uid, 0)")}
+    END""",
+    "meter_readings_change_insert": f"""
+    AFTER INSERT ON meter_readings WHEN {_CHANGES_NOT_DEFERRED}
+    BEGIN
+        {_bump_change_counter("meter_readings", "COALESCE(NEW.electrical_meter_uid, 0)")}
+    END""",
+    "meter_readings_change_delete": f"""
+    AFTER DELETE ON meter_readings WHEN {_CHANGES_NOT_DEFERRED}
+    BEGIN
+        {_bump_change_counter("meter_readings", "COALESCE(OLD.electrical_meter_uid, 0)")}
+    END""",
+    "meter_readings_change_update": f"""
+    AFTER UPDATE ON meter_readings WHEN {_CHANGES_NOT_DEFERRED}
+    BEGIN
+        {_bump_change_counter("meter_readings", "COALESCE(OLD.electrical_meter_uid, 0)")}
+        {_bump_change_counter("meter_readings", "COALESCE(NEW.electrical_meter_uid, 0)")}
+    END""",
+}
+
+TRIGGERS = {**MONTHLY_PRODUCTION_TRIGGERS, **CHANGE_COUNTER_TRIGGERS}
+
+
+def create_trigger_statement(name: str) -> str:
+    """
+    Get the `CREATE TRIGGER` statement of a trigger of `TRIGGERS`.
+    """
+    return f"CREATE TRIGGER IF NOT EXISTS {name} {TRIGGERS[name]}"
+
+
+for table, triggers in (
+    (MonthlyProduction.__table__, MONTHLY_PRODUCTION_TRIGGERS),
+    (Invoice.__table__, [name for name in CHANGE_COUNTER_TRIGGERS if "invoices" in name]),
+    (MeterReading.__table__, [name for name in CHANGE_COUNTER_TRIGGERS if "readings" in name])):
+    for trigger_name in triggers:
+        # `DDL` statements are %-formatted, escape the `strftime` formats
+        event.listen(
+            table,
+            "after_create",
+            DDL(create_trigger_statement(trigger_name).replace("%", "%%"))
+        )
@@ -0,0 +1,85 @@
+"""
+Keyset (cursor) pagination helpers.
+A cursor is an opaque string holding the sort key of the last row of a page,
+the next page starts right after this key instead of skipping rows with `OFFSET`.
+The cursor of the next page is sent in the `X-Next-Cursor` response header.
+"""
+# Standard imports
+import base64
+import datetime
+import json
+from typing import Any, Callable
+
+# 3rd party imports
+from fastapi import HTTPException, Query, Response
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+CURSOR_DESCRIPTION = (
+    f"Opaque cursor returned in the `{NEXT_CURSOR_HEADER}` header of the previous page."
+)
+
+
+def encode_cursor(key: tuple) -> str:
+    """
+    Encode a sort key (made of integers and dates) as an opaque cursor.
+    """
+    values = [value.isoformat() if isinstance(value, datetime.date) else value for value in key]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types: Callable[[Any], Any]) -> tuple:
+    """
+    Decode an opaque cursor into a sort key, converting each value with `types`.
+    Raise a `ValueError` if the cursor is malformed.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, UnicodeDecodeError) as error:
+        raise ValueError("Invalid cursor") from error
+
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError("Invalid cursor")
+    try:
+        return tuple(type_(value) for type_, value in zip(types, values))
+    except (TypeError, ValueError) as error:
+        raise ValueError("Invalid cursor") from error
+
+
+def _cursor_dependency(*types: Callable[[Any], Any]):
+    def dependency(cursor: str | None = Query(None, description=CURSOR_DESCRIPTION)):
+        if cursor is None:
+            return None
+        try:
+            return decode_cursor(cursor, *types)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return dependency
+
+
+def _int(value: Any) -> int:
+    if not isinstance(value, int):
+        raise TypeError("Not an integer")
+    return value
+
+
+# Dependencies decoding the `cursor` query parameter of lists sorted by `uid`,
+# or by `(date, uid)` for time-series lists
+uid_cursor = _cursor_dependency(_int)
+date_uid_cursor = _cursor_dependency(datetime.date.fromisoformat, _int)
+
+
+def set_next_cursor(
+    response: Response, rows: list, limit: int, key: Callable[[Any], tuple]):
+    """
+    Set the cursor of the next page in the response headers, unless `rows` is the last page.
+    """
+    if rows and len(rows) >= limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(key(rows[-1]))
+
+
+def uid_key(row) -> tuple:
+    return (row.uid,)
+
+
+def date_uid_key(row) -> tuple:
+    return (row.date, row.uid)
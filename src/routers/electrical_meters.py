@@ -1,12 +1,28 @@
+# Standard imports
+import csv
+import io
+import json
+from typing import Iterator, Literal
+
 # 3rd party imports
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 # Local imports 
+import async_crud
 import crud
 from schemas import ElectricalMeter, ElectricalMeterCreate, MeterReading, HTTPError
-from database import get_db
+from database import get_async_db, get_db
+from http_cache import cache_headers, is_not_modified, not_modified_response
+from instrumentation import query_budget
+from pagination import uid_cursor, uid_key
+from serialization import rows_response
+
 
+STREAM_BATCH_SIZE = 1000  # Number of readings fetched and sent at once when streaming
+READINGS_FIELDS = ("uid", "date", "amount", "electrical_meter_uid")
 
 # Create router for electrical meters
 router = APIRouter(
@@ -20,22 +36,35 @@ router = APIRouter(
     "/",
     response_model=ElectricalMeter,
     status_code=200,
-    responses={400: {"model": HTTPError}}
+    responses={404: {"model": HTTPError}}
 )
 def create_electrical_meter(
     electrical_meter: ElectricalMeterCreate, db: Session = Depends(get_db)):
     """
     Create a new electrical meter in database.
     """
+    db_factory = crud.read_factory(db, uid=electrical_meter.factory_uid)
+    if db_factory is None:
+        raise HTTPException(status_code=404, detail="Factory not found")
+
     return crud.create_electrical_meter(db, electrical_meter=electrical_meter)
 
 
 @router.get("/", response_model=list[ElectricalMeter])
-def read_electrical_meters(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@query_budget(1)
+async def read_electrical_meters(
+    skip: int = 0,
+    limit: int = 100,
+    after: tuple | None = Depends(uid_cursor),
+    db: AsyncSession = Depends(get_async_db)):
     """
     Read all the electric meters in database.
+    Pages can be read with `skip` and `limit`, or by passing the `cursor`
+    returned in the `X-Next-Cursor` header of the previous page.
     """
-    return crud.read_electrical_meters(db, skip=skip, limit=limit)
+    db_electrical_meters = await async_crud.read_electrical_meters(
+        db, skip=skip, limit=limit, after=after)
+    return rows_response(db_electrical_meters, limit, key=uid_key)
 
 
 @router.get(
@@ -44,27 +73,97 @@ def read_electrical_meters(skip: int = 0, limit: int = 100, db: Session = Depend
     status_code=200,
     responses={404: {"model": HTTPError}}
 )
-def read_electrical_meter(electrical_meter_uid: int, db: Session = Depends(get_db)):
+@query_budget(1)
+async def read_electrical_meter(
+    electrical_meter_uid: int, db: AsyncSession = Depends(get_async_db)):
     """
     Read a specific electrical meter using its `uid`.
     """
-    db_electrical_meter = crud.read_electrical_meter(db, uid=electrical_meter_uid)
+    db_electrical_meter = await async_crud.read_electrical_meter(db, uid=electrical_meter_uid)
     if db_electrical_meter is None:
         raise HTTPException(status_code=404, detail="Electrical meter not found")
     return db_electrical_meter
 
 
+def stream_ndjson(rows: Iterator[tuple]) -> Iterator[str]:
+    """
+    Encode meter readings rows as NDJSON, one batch of lines at a time.
+    """
+    lines = []
+    for uid, date, amount, electrical_meter_uid in rows:
+        lines.append(json.dumps({
+            "uid": uid,
+            "date": date.isoformat(),
+            "amount": amount,
+            "electrical_meter_uid": electrical_meter_uid
+        }))
+        if len(lines) == STREAM_BATCH_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def stream_csv(rows: Iterator[tuple]) -> Iterator[str]:
+    """
+    Encode meter readings rows as CSV (with a header), one batch of lines at a time.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(READINGS_FIELDS)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % STREAM_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
 @router.get(
     "/{electrical_meter_uid}/readings", 
     response_model=list[MeterReading],
     status_code=200,
-    responses={404: {"model": HTTPError}}
+    responses={
+        200: {"content": {"application/x-ndjson": {}, "text/csv": {}}},
+        304: {"description": "Not modified"},
+        404: {"model": HTTPError}
+    }
 )
-def read_factory_electrical_meters(electrical_meter_uid: int, db: Session = Depends(get_db)):
+def read_factory_electrical_meters(
+    electrical_meter_uid: int,
+    request: Request,
+    format: Literal["ndjson", "csv"] | None = None,
+    db: Session = Depends(get_db)):
     """
     Read all the meter readings of a specific electrical meter using its `uid`.
+    Use `format=ndjson` or `format=csv` to stream the full history ordered by date,
+    without loading it in memory.
+    Responses carry an `ETag`, send it back in `If-None-Match` to get a `304`
+    when no reading of the meter changed.
     """
+    counter = crud.read_change_counter(
+        db, scope="meter_readings", key=electrical_meter_uid)
+    headers = cache_headers(counter) if counter is not None else {}
+    if headers and is_not_modified(request, headers):
+        return not_modified_response(headers)
+
     db_electrical_meter = crud.read_electrical_meter(db, uid=electrical_meter_uid)
     if db_electrical_meter is None:
         raise HTTPException(status_code=404, detail="Electrical meter not found")
-    return db_electrical_meter.readings.all()
+
+    rows = crud.iter_electrical_meter_readings(
+        db, electrical_meter_uid=electrical_meter_uid, batch_size=STREAM_BATCH_SIZE)
+    if format is None:
+        response = rows_response(rows.all())
+        response.headers.update(headers)
+        return response
+    if format == "csv":
+        filename = f"electrical_meter_{electrical_meter_uid}_readings.csv"
+        return StreamingResponse(
+            stream_csv(rows),
+            media_type="text/csv",
+            headers={**headers, "Content-Disposition": f"attachment; filename={filename}"}
+        )
+    return StreamingResponse(
+        stream_ndjson(rows), media_type="application/x-ndjson", headers=headers)
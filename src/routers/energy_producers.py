@@ -1,18 +1,29 @@
 # Standard imports
-from datetime import datetime
+from datetime import date, datetime
 
 # 3rd party imports
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import extract
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 # Local imports 
+import async_crud
 import crud
-from database import get_db
-from schemas import EnergyProducer, EnergyProducerCreate, Factory, Invoice, HTTPError
-from utils import compute_invoice
-
-import models
+from cache import energy_producer_invoices_key, invoice_cache, invoice_flights
+from database import get_async_db, get_db
+from instrumentation import query_budget
+from pagination import date_uid_cursor, date_uid_key, uid_cursor, uid_key
+from serialization import rows_response
+from schemas import (
+    EnergyProducer,
+    EnergyProducerCreate,
+    Factory,
+    Granularity,
+    HTTPError,
+    Invoice,
+    ProductionPoint
+)
+from utils import MAX_YEAR, compute_invoices, compute_production_series
 
 # Create router for energy producers
 router = APIRouter(
@@ -41,11 +52,20 @@ def create_energy_producer(
 
 
 @router.get("/", response_model=list[EnergyProducer])
-def read_energy_producers(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@query_budget(1)
+async def read_energy_producers(
+    skip: int = 0,
+    limit: int = 100,
+    after: tuple | None = Depends(uid_cursor),
+    db: AsyncSession = Depends(get_async_db)):
     """
     Read all energy producers in database.
+    Pages can be read with `skip` and `limit`, or by passing the `cursor`
+    returned in the `X-Next-Cursor` header of the previous page.
     """
-    return crud.read_energy_producers(db, skip=skip, limit=limit)
+    db_energy_producers = await async_crud.read_energy_producers(
+        db, skip=skip, limit=limit, after=after)
+    return rows_response(db_energy_producers, limit, key=uid_key)
 
 
 @router.get(
@@ -54,11 +74,12 @@ def read_energy_producers(skip: int = 0, limit: int = 100, db: Session = Depends
     status_code=200,
     responses={404: {"model": HTTPError}}
 )
-def read_energy_producer(energy_producer_uid: int, db: Session = Depends(get_db)):
+@query_budget(1)
+async def read_energy_producer(energy_producer_uid: int, db: AsyncSession = Depends(get_async_db)):
     """
     Read a specific energy producer using its `uid`.
     """
-    db_energy_producer = crud.read_energy_producer(db, uid=energy_producer_uid)
+    db_energy_producer = await async_crud.read_energy_producer(db, uid=energy_producer_uid)
     if db_energy_producer is None:
         raise HTTPException(status_code=404, detail="Energy producer not found")
     return db_energy_producer
@@ -70,6 +91,7 @@ def read_energy_producer(energy_producer_uid: int, db: Session = Depends(get_db)
     status_code=200,
     responses={404: {"model": HTTPError}}
 )
+@query_budget(2)
 def read_energy_producer_factories(energy_producer_uid: int, db: Session = Depends(get_db)):
     """
     Read all the factories of a specific energy producer using its `uid`.
@@ -82,24 +104,52 @@ def read_energy_producer_factories(energy_producer_uid: int, db: Session = Depen
 
 @router.get(
     "/{energy_producer_uid}/invoices", 
-    response_model=list[Invoice] | list,
+    response_model=list[Invoice],
     status_code=200,
-    responses={404: {"model": HTTPError}}
+    responses={400: {"model": HTTPError}, 404: {"model": HTTPError}}
 )
-def read_energy_producer_invoices(energy_producer_uid: int, db: Session = Depends(get_db)):
+@query_budget(2)
+async def read_energy_producer_invoices(
+    energy_producer_uid: int,
+    year: int | None = None,
+    month: int | None = None,
+    skip: int = 0,
+    limit: int = 100,
+    after: tuple | None = Depends(date_uid_cursor),
+    db: AsyncSession = Depends(get_async_db)):
     """
-    Read all the invoices of a specific energy producer using its `uid`.
+    Read all the invoices of a specific energy producer using its `uid`, ordered by `date`.
+    Invoices can be filtered on a `year`, or on a `month` of a `year`.
+    Pages can be read with `skip` and `limit`, or by passing the `cursor`
+    returned in the `X-Next-Cursor` header of the previous page.
     """
-    db_energy_producer = crud.read_energy_producer(db, uid=energy_producer_uid)
+    db_energy_producer = await async_crud.read_energy_producer(db, uid=energy_producer_uid)
     if db_energy_producer is None:
         raise HTTPException(status_code=404, detail="Energy producer not found")
 
-    db_factories = db_energy_producer.factories
-    invoices = []
-    for db_factory in db_factories:
-        invoices = [*invoices, *db_factory.invoices]
+    if month is not None and year is None:
+        raise HTTPException(status_code=400, detail="Month can't be used without a year")
+
+    if year is not None and year < 1900:
+        raise HTTPException(status_code=400, detail="Year can't be < 1900")
+
+    if year is not None and year > MAX_YEAR:
+        raise HTTPException(status_code=400, detail=f"Year can't be > {MAX_YEAR}")
+
+    if month is not None and not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="Month must be in range [1, 12]")
+
+    db_invoices = await async_crud.read_energy_producer_invoices(
+        db,
+        energy_producer_uid=energy_producer_uid,
+        skip=skip,
+        limit=limit,
+        year=year,
+        month=month,
+        after=after
+    )
+    return rows_response(db_invoices, limit, key=date_uid_key)
 
-    return invoices
 
 @router.get(
     "/{energy_producer_uid}/invoices/{year}/{month}", 
@@ -107,6 +157,7 @@ def read_energy_producer_invoices(energy_producer_uid: int, db: Session = Depend
     status_code=200,
     responses={400: {"model": HTTPError}}
 )
+@query_budget(8)  # Writes of many invoices run 3 statements to count their changes
 def read_energy_producer_invoice_at_date(
     energy_producer_uid: int, 
     year: int, 
@@ -114,29 +165,80 @@ def read_energy_producer_invoice_at_date(
     db: Session = Depends(get_db)):
     """
     Read the invoice of a specific `date` for a specific energy producer using its `uid`.
+    Invoices are cached, the cache entry is evicted when a reading of the month is created.
+    Concurrent requests of missing invoices compute them once.
     """
+    cache_key = energy_producer_invoices_key(energy_producer_uid, year, month)
+    cached_invoices = invoice_cache.get(cache_key)
+    if cached_invoices is not None:
+        return cached_invoices
+
     db_energy_producer = crud.read_energy_producer(db, uid=energy_producer_uid)
     if db_energy_producer is None:
         raise HTTPException(status_code=404, detail="Energy producer not found")
 
     if year < 1900:
         raise HTTPException(status_code=400, detail="Year can't be < 1900")
+
+    if year > MAX_YEAR:
+        raise HTTPException(status_code=400, detail=f"Year can't be > {MAX_YEAR}")
     
     if not 1 <= month <= 12:
         raise HTTPException(status_code=400, detail="Month must be in range [1, 12]")
 
     custom_date = datetime.strptime(f"{year}-{month}", "%Y-%m")
-    db_factories = db_energy_producer.factories
-    invoices = []
-    for factory in db_factories:
-        db_invoice = factory.invoices.filter(
-            extract("year", models.Invoice.date) == custom_date.year,
-            extract("month", models.Invoice.date) == custom_date.month 
-        ).first()
-        if db_invoice is None:
-            invoice = compute_invoice(db, factory_uid=factory.uid, date=custom_date)
-            db_invoice = crud.create_invoice(db, invoice=invoice)
-
-        invoices.append(db_invoice)
-
-    return invoices
\ No newline at end of file
+
+    def read_or_create_invoices() -> list[Invoice]:
+        # Compute all the missing invoices at once, whatever the number of factories
+        missing_factory_uids = crud.read_factory_uids_without_invoice(
+            db, energy_producer_uid=energy_producer_uid, date=custom_date)
+        if missing_factory_uids:
+            invoices = compute_invoices(db, factory_uids=missing_factory_uids, date=custom_date)
+            crud.create_invoices(db, invoices=invoices)
+
+        invoices = [
+            Invoice.from_orm(db_invoice)
+            for db_invoice in crud.read_energy_producer_invoices_at_date(
+                db, energy_producer_uid=energy_producer_uid, date=custom_date)
+        ]
+        invoice_cache.set(cache_key, invoices)
+        return invoices
+
+    # Concurrent requests of the same invoices wait for a single computation
+    return invoice_flights.do(cache_key, read_or_create_invoices)
+
+
+@router.get(
+    "/{energy_producer_uid}/production",
+    response_model=list[ProductionPoint],
+    status_code=200,
+    responses={400: {"model": HTTPError}, 404: {"model": HTTPError}}
+)
+@query_budget(2)
+def read_energy_producer_production(
+    energy_producer_uid: int,
+    start: date = Query(alias="from"),
+    end: date = Query(alias="to"),
+    granularity: Granularity = Granularity.day,
+    db: Session = Depends(get_db)):
+    """
+    Read the net production of all the factories of a specific energy producer using its
+    `uid`, for each day, week or month from the `from` date (included) to the `to` date
+    (excluded).
+    Only the aggregated periods are returned, periods without any reading are skipped.
+    """
+    db_energy_producer = crud.read_energy_producer(db, uid=energy_producer_uid)
+    if db_energy_producer is None:
+        raise HTTPException(status_code=404, detail="Energy producer not found")
+
+    if start >= end:
+        raise HTTPException(status_code=400, detail="`from` must be before `to`")
+
+    series = compute_production_series(
+        db,
+        start=start,
+        end=end,
+        granularity=granularity.value,
+        energy_producer_uid=energy_producer_uid
+    )
+    return [ProductionPoint(date=day, production=production) for day, production in series]
@@ -1,17 +1,30 @@
 # Standard imports
-from datetime import datetime
+from datetime import date, datetime
 
 # 3rd party imports
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import extract
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 # Local imports 
+import async_crud
 import crud
-import models
-from database import get_db
-from schemas import ElectricalMeter, Factory, FactoryCreate, Invoice, HTTPError
-from utils import compute_invoice
+from cache import factory_invoice_key, invoice_cache, invoice_flights
+from database import get_async_db, get_db
+from http_cache import cache_headers, is_not_modified, not_modified_response
+from instrumentation import query_budget
+from pagination import uid_cursor, uid_key
+from serialization import rows_response
+from schemas import (
+    ElectricalMeter,
+    Factory,
+    FactoryCreate,
+    Granularity,
+    HTTPError,
+    Invoice,
+    ProductionPoint
+)
+from utils import MAX_YEAR, compute_invoice, compute_production_series
 
 # Create router for factories
 router = APIRouter(
@@ -25,22 +38,34 @@ router = APIRouter(
     "/",
     response_model=Factory,
     status_code=200,
-    responses={400: {"model": HTTPError}}
+    responses={404: {"model": HTTPError}}
 )
 def create_factory(
     factory: FactoryCreate, db: Session = Depends(get_db)):
     """
     Create a new factory in database.
     """
+    db_energy_producer = crud.read_energy_producer(db, uid=factory.owner_uid)
+    if db_energy_producer is None:
+        raise HTTPException(status_code=404, detail="Energy producer not found")
+
     return crud.create_factory(db, factory=factory)
 
 
 @router.get("/", response_model=list[Factory])
-def read_factories(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@query_budget(1)
+async def read_factories(
+    skip: int = 0,
+    limit: int = 100,
+    after: tuple | None = Depends(uid_cursor),
+    db: AsyncSession = Depends(get_async_db)):
     """
     Read all the factories in database.
+    Pages can be read with `skip` and `limit`, or by passing the `cursor`
+    returned in the `X-Next-Cursor` header of the previous page.
     """
-    return crud.read_factories(db, skip=skip, limit=limit)
+    db_factories = await async_crud.read_factories(db, skip=skip, limit=limit, after=after)
+    return rows_response(db_factories, limit, key=uid_key)
 
 
 @router.get(
@@ -49,11 +74,12 @@ def read_factories(skip: int = 0, limit: int = 100, db: Session = Depends(get_db
     status_code=200,
     responses={404: {"model": HTTPError}}
 )
-def read_factory(factory_uid: int, db: Session = Depends(get_db)):
+@query_budget(1)
+async def read_factory(factory_uid: int, db: AsyncSession = Depends(get_async_db)):
     """
     Read a specific factory using its `uid`.
     """
-    db_factory = crud.read_factory(db, uid=factory_uid)
+    db_factory = await async_crud.read_factory(db, uid=factory_uid)
     if db_factory is None:
         raise HTTPException(status_code=404, detail="Factory not found")
     return db_factory
@@ -65,6 +91,7 @@ def read_factory(factory_uid: int, db: Session = Depends(get_db)):
     status_code=200,
     responses={404: {"model": HTTPError}}
 )
+@query_budget(2)
 def read_factory_electrical_meters(factory_uid: int, db: Session = Depends(get_db)):
     """
     Read all the electric meters of a specific factory using its `uid`.
@@ -79,16 +106,27 @@ def read_factory_electrical_meters(factory_uid: int, db: Session = Depends(get_d
     "/{factory_uid}/invoices", 
     response_model=list[Invoice],
     status_code=200,
-    responses={404: {"model": HTTPError}}
+    responses={304: {"description": "Not modified"}, 404: {"model": HTTPError}}
 )
-def read_factory_invoices(factory_uid: int, db: Session = Depends(get_db)):
+@query_budget(3)
+def read_factory_invoices(factory_uid: int, request: Request, db: Session = Depends(get_db)):
     """
-    Read all the invoices of a specific factory using its `uid`.
+    Read all the invoices of a specific factory using its `uid`, ordered by `date`.
+    Responses carry an `ETag`, send it back in `If-None-Match` to get a `304`
+    when no invoice of the factory changed.
     """
+    counter = crud.read_change_counter(db, scope="factory_invoices", key=factory_uid)
+    headers = cache_headers(counter) if counter is not None else {}
+    if headers and is_not_modified(request, headers):
+        return not_modified_response(headers)
+
     db_factory = crud.read_factory(db, uid=factory_uid)
     if db_factory is None:
         raise HTTPException(status_code=404, detail="Factory not found")
-    return db_factory.invoices.all()
+
+    response = rows_response(crud.read_factory_invoices(db, factory_uid=factory_uid))
+    response.headers.update(headers)
+    return response
 
 @router.get(
     "/{factory_uid}/invoices/{year}/{month}", 
@@ -96,6 +134,7 @@ def read_factory_invoices(factory_uid: int, db: Session = Depends(get_db)):
     status_code=200,
     responses={404: {"model": HTTPError}}
 )
+@query_budget(5)
 def read_factory_invoice_at_date(
     factory_uid: int, 
     year: int, 
@@ -103,27 +142,72 @@ def read_factory_invoice_at_date(
     db: Session = Depends(get_db)):
     """
     Read the invoice of a specific `year` and `month` for a specific factory using its `uid`.
+    Invoices are cached, the cache entry is evicted when a reading of the month is created.
+    Concurrent requests of a missing invoice compute it once.
     """
+    cache_key = factory_invoice_key(factory_uid, year, month)
+    cached_invoice = invoice_cache.get(cache_key)
+    if cached_invoice is not None:
+        return cached_invoice
+
     db_factory = crud.read_factory(db, uid=factory_uid)
     if db_factory is None:
         raise HTTPException(status_code=404, detail="Factory not found")
 
     if year < 1900:
         raise HTTPException(status_code=400, detail="Year can't be < 1900")
+
+    if year > MAX_YEAR:
+        raise HTTPException(status_code=400, detail=f"Year can't be > {MAX_YEAR}")
     
     if not 1 <= month <= 12:
         raise HTTPException(status_code=400, detail="Month must be in range [1, 12]")
 
     
     custom_date = datetime.strptime(f"{year}-{month}", "%Y-%m")
-    invoice = db_factory.invoices.filter(
-        extract("year", models.Invoice.date) == custom_date.year,
-        extract("month", models.Invoice.date) == custom_date.month 
-    ).first()
-    if invoice is None:
-        # Call function to create an invoice
-        # Use a fixed price for 1 kWh produced
-        invoice = compute_invoice(db, factory_uid=factory_uid, date=custom_date)
-        return crud.create_invoice(db, invoice=invoice)
-
-    return invoice
\ No newline at end of file
+
+    def read_or_create_invoice() -> Invoice:
+        invoice = crud.read_factory_invoice_at_date(
+            db, factory_uid=factory_uid, date=custom_date)
+        if invoice is None:
+            # Call function to create an invoice
+            # Use a fixed price for 1 kWh produced
+            invoice = compute_invoice(db, factory_uid=factory_uid, date=custom_date)
+            invoice = crud.create_invoice(db, invoice=invoice)
+
+        invoice = Invoice.from_orm(invoice)
+        invoice_cache.set(cache_key, invoice)
+        return invoice
+
+    # Concurrent requests of the same invoice wait for a single computation
+    return invoice_flights.do(cache_key, read_or_create_invoice)
+
+
+@router.get(
+    "/{factory_uid}/production",
+    response_model=list[ProductionPoint],
+    status_code=200,
+    responses={400: {"model": HTTPError}, 404: {"model": HTTPError}}
+)
+@query_budget(2)
+def read_factory_production(
+    factory_uid: int,
+    start: date = Query(alias="from"),
+    end: date = Query(alias="to"),
+    granularity: Granularity = Granularity.day,
+    db: Session = Depends(get_db)):
+    """
+    Read the net production of a specific factory using its `uid`, for each day, week
+    or month from the `from` date (included) to the `to` date (excluded).
+    Only the aggregated periods are returned, periods without any reading are skipped.
+    """
+    db_factory = crud.read_factory(db, uid=factory_uid)
+    if db_factory is None:
+        raise HTTPException(status_code=404, detail="Factory not found")
+
+    if start >= end:
+        raise HTTPException(status_code=400, detail="`from` must be before `to`")
+
+    series = compute_production_series(
+        db, start=start, end=end, granularity=granularity.value, factory_uid=factory_uid)
+    return [ProductionPoint(date=day, production=production) for day, production in series]
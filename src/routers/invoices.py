@@ -2,13 +2,19 @@
 from datetime import datetime
 
 # 3rd party imports
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # Local imports 
-import crud
-from schemas import Invoice, HTTPError
-from database import get_db
+import async_crud
+from cache import invoice_cache
+from schemas import CacheStats, Invoice, HTTPError
+from database import get_async_db
+from http_cache import cache_headers, is_not_modified, not_modified_response
+from instrumentation import query_budget
+from pagination import date_uid_cursor, date_uid_key
+from serialization import rows_response
+from utils import MAX_YEAR
 
 
 # Create router for invoices
@@ -19,12 +25,42 @@ router = APIRouter(
 )
 
 
-@router.get("/", response_model=list[Invoice])
-def read_invoices(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@router.get("/cache-stats", response_model=CacheStats)
+async def read_invoice_cache_stats():
     """
-    Read all the invoices in database.
+    Read the hit and miss counters of the invoice cache of this worker.
     """
-    return crud.read_invoices(db, skip=skip, limit=limit)
+    return invoice_cache.stats()
+
+
+@router.get(
+    "/",
+    response_model=list[Invoice],
+    responses={304: {"description": "Not modified"}}
+)
+@query_budget(2)
+async def read_invoices(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    after: tuple | None = Depends(date_uid_cursor),
+    db: AsyncSession = Depends(get_async_db)):
+    """
+    Read all the invoices in database, ordered by `date`.
+    Pages can be read with `skip` and `limit`, or by passing the `cursor`
+    returned in the `X-Next-Cursor` header of the previous page.
+    Responses carry an `ETag`, send it back in `If-None-Match` to get a `304`
+    when no invoice changed.
+    """
+    counter = await async_crud.read_change_counter(db, scope="invoices")
+    headers = cache_headers(counter) if counter is not None else {}
+    if headers and is_not_modified(request, headers):
+        return not_modified_response(headers)
+
+    db_invoices = await async_crud.read_invoices(db, skip=skip, limit=limit, after=after)
+    response = rows_response(db_invoices, limit, key=date_uid_key)
+    response.headers.update(headers)
+    return response
 
 
 @router.get(
@@ -33,11 +69,12 @@ def read_invoices(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)
     status_code=200,
     responses={404: {"model": HTTPError}}
 )
-def read_invoice(invoice_uid: int, db: Session = Depends(get_db)):
+@query_budget(1)
+async def read_invoice(invoice_uid: int, db: AsyncSession = Depends(get_async_db)):
     """
     Read a specific invoice using its `uid`.
     """
-    db_invoice = crud.read_invoice(db, uid=invoice_uid)
+    db_invoice = await async_crud.read_invoice(db, uid=invoice_uid)
     if db_invoice is None:
         raise HTTPException(status_code=404, detail="Invoice not found")
     return db_invoice
@@ -47,21 +84,39 @@ def read_invoice(invoice_uid: int, db: Session = Depends(get_db)):
     "/{year}/{month}", 
     response_model=list[Invoice],
     status_code=200,
-    responses={400: {"model": HTTPError}}
+    responses={304: {"description": "Not modified"}, 400: {"model": HTTPError}}
 )
-def read_invoices_by_date(
+@query_budget(2)
+async def read_invoices_by_date(
+    request: Request,
     year: int,
     month: int, 
     skip: int = 0,
     limit: int = 100, 
-    db: Session = Depends(get_db)):
+    after: tuple | None = Depends(date_uid_cursor),
+    db: AsyncSession = Depends(get_async_db)):
     """
     Read all the invoices for a specific `date`.
+    Pages can be read with `skip` and `limit`, or by passing the `cursor`
+    returned in the `X-Next-Cursor` header of the previous page.
     """
     if year < 1900:
         raise HTTPException(status_code=400, detail="Year can't be < 1900")
+
+    if year > MAX_YEAR:
+        raise HTTPException(status_code=400, detail=f"Year can't be > {MAX_YEAR}")
     
     if not 1 <= month <= 12:
         raise HTTPException(status_code=400, detail="Month must be in range [1, 12]")
+
+    counter = await async_crud.read_change_counter(db, scope="invoices")
+    headers = cache_headers(counter) if counter is not None else {}
+    if headers and is_not_modified(request, headers):
+        return not_modified_response(headers)
+
     custom_date = datetime.strptime(f"{year}-{month}", "%Y-%m")
-    return crud.read_invoices(db, skip=skip, limit=limit, date=custom_date)
+    db_invoices = await async_crud.read_invoices(
+        db, skip=skip, limit=limit, date=custom_date, after=after)
+    response = rows_response(db_invoices, limit, key=date_uid_key)
+    response.headers.update(headers)
+    return response
@@ -1,11 +1,35 @@
+# Standard imports
+import asyncio
+import json
+from calendar import monthrange
+from typing import Any
+
 # 3rd party imports
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 # Local imports 
+import async_crud
 import crud
-from schemas import MeterReading, MeterReadingCreate, HTTPError
-from database import get_db
+from schemas import (
+    MeterReading,
+    MeterReadingBulkError,
+    MeterReadingBulkResult,
+    MeterReadingCreate,
+    HTTPError
+)
+from database import get_async_db, get_db
+from instrumentation import query_budget
+from pagination import date_uid_cursor, date_uid_key
+from serialization import rows_response
+from utils import MAX_YEAR
+
+MAX_BULK_SIZE = 100_000  # Max number of meter readings sent in a single request
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
 
 
 # Create router for electrical meters
@@ -20,22 +44,137 @@ router = APIRouter(
     "/",
     response_model=MeterReading,
     status_code=200,
-    responses={400: {"model": HTTPError}}
+    responses={404: {"model": HTTPError}}
 )
-def create_meter_reading(
-    meter_reading: MeterReadingCreate, db: Session = Depends(get_db)):
+async def create_meter_reading(
+    meter_reading: MeterReadingCreate, request: Request, db: Session = Depends(get_db)):
     """
     Create a new meter reading in database.
+    With group commit enabled, the reading is written by the writer thread along with the
+    readings of concurrent requests, and returned once their transaction is committed.
+    """
+    writer = request.app.state.meter_reading_writer
+    try:
+        if writer is not None:
+            return await asyncio.wrap_future(writer.submit(meter_reading))
+        return await run_in_threadpool(
+            crud.create_meter_reading, db, meter_reading=meter_reading)
+    except IntegrityError:
+        # The foreign key of the reading is checked by SQLite, without an extra query
+        raise HTTPException(status_code=404, detail="Electrical meter not found")
+
+
+async def read_bulk_payload(request: Request) -> list[tuple[int, Any]]:
+    """
+    Parse the body of a bulk request, either a JSON array or NDJSON (one JSON object
+    per line), into `(index, item)` pairs. The index of an NDJSON item is the number of
+    its line in the body (from 0, blank lines included), the index of a JSON array item
+    is its position in the array. A malformed NDJSON line is kept as a `JSONDecodeError`
+    so that it can be reported as a single rejected reading.
+    """
+    body = await request.body()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+
+    if content_type in NDJSON_CONTENT_TYPES:
+        items = []
+        for index, line in enumerate(body.splitlines()):
+            if not line.strip():
+                continue
+            try:
+                items.append((index, json.loads(line)))
+            except json.JSONDecodeError as error:
+                items.append((index, error))
+    else:
+        try:
+            items = json.loads(body)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Body must be a valid JSON array")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Body must be a valid JSON array")
+        items = list(enumerate(items))
+
+    if len(items) > MAX_BULK_SIZE:
+        raise HTTPException(
+            status_code=413, detail=f"Batches are limited to {MAX_BULK_SIZE} meter readings")
+
+    return items
+
+
+@router.post(
+    "/bulk",
+    response_model=MeterReadingBulkResult,
+    status_code=200,
+    responses={400: {"model": HTTPError}, 413: {"model": HTTPError}},
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": {"$ref": "#/components/schemas/MeterReadingCreate"}
+                    }
+                },
+                "application/x-ndjson": {
+                    "schema": {"type": "string", "description": "One reading per line"}
+                }
+            }
+        }
+    }
+)
+def create_meter_readings(
+    items: list[tuple[int, Any]] = Depends(read_bulk_payload),
+    db: Session = Depends(get_db)):
     """
-    return crud.create_meter_reading(db, meter_reading=meter_reading)
+    Create many meter readings in database, sent as a JSON array or as NDJSON.
+    The whole batch is validated first, then valid readings are inserted
+    in a single transaction. Invalid readings are reported with their position
+    in the array, or with their line number in the NDJSON body.
+    """
+    meter_readings = []
+    errors = []
+    for index, item in items:
+        if isinstance(item, json.JSONDecodeError):
+            errors.append(MeterReadingBulkError(index=index, detail=f"Invalid JSON: {item}"))
+            continue
+        try:
+            meter_readings.append((index, MeterReadingCreate.parse_obj(item)))
+        except ValidationError as error:
+            errors.append(MeterReadingBulkError(index=index, detail=str(error)))
+
+    existing_uids = crud.read_existing_electrical_meter_uids(
+        db, uids={meter_reading.electrical_meter_uid for _, meter_reading in meter_readings})
+    valid_meter_readings = []
+    for index, meter_reading in meter_readings:
+        if meter_reading.electrical_meter_uid not in existing_uids:
+            errors.append(MeterReadingBulkError(index=index, detail="Electrical meter not found"))
+        else:
+            valid_meter_readings.append(meter_reading)
+
+    inserted = crud.create_meter_readings(db, meter_readings=valid_meter_readings)
+    return MeterReadingBulkResult(
+        received=len(items),
+        inserted=inserted,
+        rejected=len(errors),
+        errors=sorted(errors, key=lambda error: error.index)
+    )
 
 
 @router.get("/", response_model=list[MeterReading])
-def read_meter_readings(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@query_budget(1)
+async def read_meter_readings(
+    skip: int = 0,
+    limit: int = 100,
+    after: tuple | None = Depends(date_uid_cursor),
+    db: AsyncSession = Depends(get_async_db)):
     """
-    Read all the meter readings in database.
+    Read all the meter readings in database, ordered by `date`.
+    Pages can be read with `skip` and `limit`, or by passing the `cursor`
+    returned in the `X-Next-Cursor` header of the previous page.
     """
-    return crud.read_meter_readings(db, skip=skip, limit=limit)
+    db_meter_readings = await async_crud.read_meter_readings(
+        db, skip=skip, limit=limit, after=after)
+    return rows_response(db_meter_readings, limit, key=date_uid_key)
 
 
 @router.get(
@@ -44,11 +183,13 @@ def read_meter_readings(skip: int = 0, limit: int = 100, db: Session = Depends(g
     status_code=200,
     responses={404: {"model": HTTPError}}
 )
-def read_meter_reading(meter_reading_uid: int, db: Session = Depends(get_db)):
+@query_budget(1)
+async def read_meter_reading(
+    meter_reading_uid: int, db: AsyncSession = Depends(get_async_db)):
     """
     Read a specific meter reading using its `uid`.
     """
-    db_meter_reading = crud.read_meter_reading(db, uid=meter_reading_uid)
+    db_meter_reading = await async_crud.read_meter_reading(db, uid=meter_reading_uid)
     if db_meter_reading is None:
         raise HTTPException(status_code=404, detail="Meter reading not found")
     return db_meter_reading
@@ -60,20 +201,28 @@ def read_meter_reading(meter_reading_uid: int, db: Session = Depends(get_db)):
     status_code=200,
     responses={400: {"model": HTTPError}}
 )
-def read_meter_readings_by_year(
+@query_budget(1)
+async def read_meter_readings_by_year(
     year: int, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)):
+    after: tuple | None = Depends(date_uid_cursor),
+    db: AsyncSession = Depends(get_async_db)):
     """
-    Read all the meter readings for a specific `year`.
+    Read all the meter readings for a specific `year`, ordered by `date`.
+    Pages can be read with `skip` and `limit`, or by passing the `cursor`
+    returned in the `X-Next-Cursor` header of the previous page.
     """
     if year < 1900:
         raise HTTPException(status_code=400, detail="Year can't be < 1900")
 
-    return crud.read_meter_readings(
-        db, skip=skip, limit=limit, year=year
+    if year > MAX_YEAR:
+        raise HTTPException(status_code=400, detail=f"Year can't be > {MAX_YEAR}")
+
+    db_meter_readings = await async_crud.read_meter_readings(
+        db, skip=skip, limit=limit, year=year, after=after
     )
+    return rows_response(db_meter_readings, limit, key=date_uid_key)
 
 
 @router.get(
@@ -82,24 +231,32 @@ def read_meter_readings_by_year(
     status_code=200,
     responses={400: {"model": HTTPError}}
 )
-def read_meter_readings_by_month(
+@query_budget(1)
+async def read_meter_readings_by_month(
     year: int,
     month: int,
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)):
+    after: tuple | None = Depends(date_uid_cursor),
+    db: AsyncSession = Depends(get_async_db)):
     """
-    Read all the meter readings for a specific `month`.
+    Read all the meter readings for a specific `month`, ordered by `date`.
+    Pages can be read with `skip` and `limit`, or by passing the `cursor`
+    returned in the `X-Next-Cursor` header of the previous page.
     """
     if year < 1900:
         raise HTTPException(status_code=400, detail="Year can't be < 1900")
 
+    if year > MAX_YEAR:
+        raise HTTPException(status_code=400, detail=f"Year can't be > {MAX_YEAR}")
+
     if not 1 <= month <= 12:
         raise HTTPException(status_code=400, detail="Month must be in range [1, 12]")
 
-    return crud.read_meter_readings(
-        db, skip=skip, limit=limit, year=year, month=month
+    db_meter_readings = await async_crud.read_meter_readings(
+        db, skip=skip, limit=limit, year=year, month=month, after=after
     )
+    return rows_response(db_meter_readings, limit, key=date_uid_key)
 
 
 @router.get(
@@ -108,25 +265,36 @@ def read_meter_readings_by_month(
     status_code=200,
     responses={400: {"model": HTTPError}}
 )
-def read_meter_readings_by_day(
+@query_budget(1)
+async def read_meter_readings_by_day(
     year: int,
     month: int,
     day: int, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)):
+    after: tuple | None = Depends(date_uid_cursor),
+    db: AsyncSession = Depends(get_async_db)):
     """
     Read all the meter readings for a specific `day`.
+    Pages can be read with `skip` and `limit`, or by passing the `cursor`
+    returned in the `X-Next-Cursor` header of the previous page.
     """
     if year < 1900:
         raise HTTPException(status_code=400, detail="Year can't be < 1900")
 
+    if year > MAX_YEAR:
+        raise HTTPException(status_code=400, detail=f"Year can't be > {MAX_YEAR}")
+
     if not 1 <= month <= 12:
         raise HTTPException(status_code=400, detail="Month must be in range [1, 12]")
 
     if not 1 <= day <= 31:
         raise HTTPException(status_code=400, detail="Day must be in range [1, 31]")
 
-    return crud.read_meter_readings(
-        db, skip=skip, limit=limit, year=year, month=month, day=day
+    if day > monthrange(year, month)[1]:
+        raise HTTPException(status_code=400, detail="Day is out of range for month")
+
+    db_meter_readings = await async_crud.read_meter_readings(
+        db, skip=skip, limit=limit, year=year, month=month, day=day, after=after
     )
+    return rows_response(db_meter_readings, limit, key=date_uid_key)
@@ -3,6 +3,7 @@ Schemas used for data validation
 """
 # Standard imports
 import datetime
+from enum import Enum
 from typing import Any
 
 # 3rd party imports
@@ -55,6 +56,16 @@ class MeterReading(MeterReadingBase):
     class Config:
         orm_mode = True
 
+class MeterReadingBulkError(BaseModel):
+    index: int  # Position of the rejected reading in the array, or its NDJSON line number
+    detail: str
+
+class MeterReadingBulkResult(BaseModel):
+    received: int
+    inserted: int
+    rejected: int
+    errors: list[MeterReadingBulkError]
+
 # -------------- Factories
 
 class FactoryBase(BaseModel):
@@ -86,6 +97,26 @@ class Invoice(InvoiceCreate):
     class Config:
         orm_mode = True
 
+# -------------- Cache
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    size: int
+    maxsize: int
+    ttl: float
+
+# -------------- Production
+
+class Granularity(str, Enum):
+    day = "day"
+    week = "week"  # Weeks start on Monday
+    month = "month"
+
+class ProductionPoint(BaseModel):
+    date: datetime.date  # First day of the period
+    production: float  # Net production of the period (in kWh)
+
 # -------------- Errors
 
 class HTTPError(BaseModel):
@@ -0,0 +1,30 @@
+"""
+Fast JSON serialization of list responses.
+List routes read plain column tuples from the database and return them encoded by
+orjson, so FastAPI skips the validation against their `response_model` (which still
+documents them in the OpenAPI schema). Database rows already have the types of the
+schemas fields, building a Pydantic model for each of them would only copy them.
+"""
+# Standard imports
+from typing import Any, Callable, Sequence
+
+# 3rd party imports
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.engine import Row
+
+# Local imports
+from pagination import set_next_cursor
+
+
+def rows_response(
+    rows: Sequence[Row],
+    limit: int = None,
+    key: Callable[[Any], tuple] = None) -> ORJSONResponse:
+    """
+    Encode rows as a JSON list of objects keyed by column name.
+    With a pagination `key`, the cursor of the next page is set in the headers.
+    """
+    response = ORJSONResponse([row._asdict() for row in rows])
+    if key is not None:
+        set_next_cursor(response, rows, limit, key=key)
+    return response
@@ -0,0 +1,140 @@
+# Standard imports
+import asyncio
+import os
+from datetime import date
+
+# 3rd party imports
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+# Fail the tests of the routes going over their query budget or running N+1 queries
+os.environ.setdefault("STREEM_QUERY_BUDGET_MODE", "raise")
+
+# Local imports
+from app import app
+from cache import invoice_cache
+from database import get_async_db, get_db
+from database.migrations import upgrade
+from models import ElectricalMeter, EnergyProducer, Factory, MeterReading
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    """
+    Path of an empty database, up to date with the models, created for each test.
+    """
+    path = tmp_path / "test.db"
+    engine = create_engine(f"sqlite:///{path}")
+    upgrade(engine)
+    engine.dispose()
+    return path
+
+
+@pytest.fixture
+def db(database_path):
+    """
+    Session on the database of the test, holding a producer, a factory
+    and a producer electrical meter (all with `uid` 1).
+    """
+    engine = create_engine(
+        f"sqlite:///{database_path}", connect_args={"check_same_thread": False})
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    db.add(EnergyProducer(uid=1, name="edf"))
+    db.add(Factory(uid=1, name="ED_Cha_1", owner_uid=1))
+    db.add(ElectricalMeter(uid=1, name="ED_Cha_1_em1", is_producer=True, factory_uid=1))
+    db.commit()
+    yield db
+    db.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def client(database_path, db):
+    """
+    Test client of the API using the database of the `db` fixture.
+    """
+    engine = create_engine(
+        f"sqlite:///{database_path}", connect_args={"check_same_thread": False})
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+    AsyncTestingSessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, bind=async_engine, class_=AsyncSession)
+
+    def override_get_db():
+        try:
+            db = TestingSessionLocal()
+            yield db
+        finally:
+            db.close()
+
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    invoice_cache.clear()
+    previous_overrides = dict(app.dependency_overrides)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    yield TestClient(app)
+    app.dependency_overrides = previous_overrides
+    engine.dispose()
+    asyncio.run(async_engine.dispose())
+
+
+@pytest.fixture
+def add_factories(db):
+    """
+    Add factories to the producer of the `db` fixture, each with a producer and
+    a consumer electrical meter reading every day of December 2022.
+    """
+    def add(count: int):
+        for factory_uid in range(2, count + 2):
+            db.add(Factory(uid=factory_uid, name=f"ED_Cha_{factory_uid}", owner_uid=1))
+            for is_producer in (True, False):
+                meter = ElectricalMeter(
+                    name=f"ED_Cha_{factory_uid}_em",
+                    is_producer=is_producer,
+                    factory_uid=factory_uid
+                )
+                db.add(meter)
+                db.flush()
+                db.add_all([
+                    MeterReading(
+                        date=date(2022, 12, day),
+                        amount=factory_uid * (100 if is_producer else 10),
+                        electrical_meter_uid=meter.uid
+                    )
+                    for day in range(1, 32)
+                ])
+        db.commit()
+
+    return add
+
+
+class StatementCounter:
+    """
+    Context manager counting the SQL statements executed by any engine.
+    """
+    def __enter__(self):
+        self.count = 0
+        event.listen(Engine, "before_cursor_execute", self.increment)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(Engine, "before_cursor_execute", self.increment)
+
+    def increment(self, *args):
+        self.count += 1
+
+
+@pytest.fixture
+def count_statements():
+    """
+    Context manager class counting the SQL statements, e.g.
+    `with count_statements() as statements: ...`
+    """
+    return StatementCounter
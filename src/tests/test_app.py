@@ -0,0 +1,45 @@
+# Standard imports
+import os
+import subprocess
+import sys
+
+# 3rd party imports
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, inspect
+
+# Local imports
+from app import create_app
+from config import Settings
+
+
+def test_import_does_not_open_database(tmp_path):
+    path = tmp_path / "api.db"
+    subprocess.run(
+        [sys.executable, "-c", "import app"],
+        check=True,
+        env={**os.environ, "STREEM_DATABASE_URL": f"sqlite:///{path}"}
+    )
+    assert not path.exists()
+
+
+def test_create_app_upgrades_on_startup(tmp_path):
+    path = tmp_path / "api.db"
+    app = create_app(Settings(database_url=f"sqlite:///{path}"))
+    with TestClient(app) as client:
+        assert client.get("/energy-producers/").json() == []
+        response = client.post("/energy-producers/", json={"name": "edf"})
+        assert response.status_code == 200
+
+    engine = create_engine(f"sqlite:///{path}")
+    assert "monthly_productions" in inspect(engine).get_table_names()
+    engine.dispose()
+
+
+def test_create_app_without_upgrade(tmp_path):
+    path = tmp_path / "api.db"
+    settings = Settings(database_url=f"sqlite:///{path}", upgrade_on_startup=False)
+    with TestClient(create_app(settings)):
+        pass
+    engine = create_engine(f"sqlite:///{path}")
+    assert inspect(engine).get_table_names() == []
+    engine.dispose()
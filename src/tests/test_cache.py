@@ -0,0 +1,106 @@
+# Standard imports
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 3rd party imports
+import pytest
+
+# Local imports
+from cache import SingleFlight, TTLCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_cache_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # "b" is the least recently used entry
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_expiration():
+    timer = FakeTimer()
+    cache = TTLCache(maxsize=10, ttl=5, timer=timer)
+    cache.set("a", 1)
+    timer.now = 4.9
+    assert cache.get("a") == 1
+    timer.now = 5
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_invoice_cache_evicted_by_new_readings(client, db):
+    client.post("/meter-readings/", json={
+        "date": "2022-12-01", "amount": 100, "electrical_meter_uid": 1})
+    assert client.get("/factories/1/invoices/2022/12").json()["production"] == 100
+    assert client.get("/energy-producers/1/invoices/2022/12").json()[0]["production"] == 100
+    client.get("/factories/1/invoices/2022/12")
+    stats = client.get("/invoices/cache-stats").json()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 2, 2)
+
+    # A reading of another month keeps the entries, one of the same month evicts them
+    client.post("/meter-readings/", json={
+        "date": "2022-11-01", "amount": 100, "electrical_meter_uid": 1})
+    assert client.get("/invoices/cache-stats").json()["size"] == 2
+    client.post("/meter-readings/bulk", json=[
+        {"date": "2022-12-02", "amount": 100, "electrical_meter_uid": 1}])
+    assert client.get("/invoices/cache-stats").json()["size"] == 0
+
+
+def test_invoice_cache_evicted_by_new_factories(client, db):
+    client.post("/meter-readings/", json={
+        "date": "2022-12-01", "amount": 100, "electrical_meter_uid": 1})
+    for month in (11, 12):
+        assert len(client.get(f"/energy-producers/1/invoices/2022/{month}").json()) == 1
+    client.get("/factories/1/invoices/2022/12")
+    assert client.get("/invoices/cache-stats").json()["size"] == 3
+
+    # The producer lists of every month miss the new factory, the factory invoice is kept
+    factory_uid = client.post(
+        "/factories/", json={"name": "ED_Cha_2", "owner_uid": 1}).json()["uid"]
+    assert client.get("/invoices/cache-stats").json()["size"] == 1
+    assert len(client.get("/energy-producers/1/invoices/2022/12").json()) == 2
+
+    client.post("/electrical-meters/", json={
+        "name": "ED_Cha_2_em1", "is_producer": True, "factory_uid": factory_uid})
+    assert client.get("/invoices/cache-stats").json()["size"] == 1
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return len(calls)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(flights.do, "key", compute)
+        started.wait(5)
+        followers = [executor.submit(flights.do, "key", compute) for _ in range(3)]
+        time.sleep(0.05)
+        release.set()
+        results = [leader.result(), *(follower.result() for follower in followers)]
+    assert results == [1, 1, 1, 1]
+    assert len(calls) == 1
+
+    # Calls made once the computation is over run it again, errors are not kept
+    with pytest.raises(ZeroDivisionError):
+        flights.do("key", lambda: 1 / 0)
+    assert flights.do("key", lambda: 2) == 2
@@ -0,0 +1,208 @@
+# Standard imports
+import multiprocessing
+import sys
+import threading
+from datetime import date, timedelta
+
+# 3rd party imports
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+# Local imports
+import columnar
+import crud
+import database
+import gunicorn_conf
+from app import create_app
+from columnar import ColumnarStore
+from config import Settings
+from database import migrations
+from models import MeterReading
+from schemas import MeterReadingCreate
+from utils import compute_productions
+
+
+@pytest.fixture
+def reading_store(tmp_path, monkeypatch):
+    """
+    Columnar store enabled for the API and the invoice computations.
+    """
+    store = ColumnarStore(tmp_path / "readings")
+    monkeypatch.setattr(columnar, "reading_store", store)
+    return store
+
+
+def test_columnar_store_append_and_read(tmp_path):
+    store = ColumnarStore(tmp_path)
+    assert store.read(1)[0].size == 0
+    store.append(1, [date(2022, 12, 1), date(2022, 12, 2)], [10, 20])
+    store.append(1, [date(2023, 1, 1)], [30])
+    store.append(2, [date(2022, 12, 1)], [5])
+
+    dates, amounts = store.read(1)
+    assert dates.tolist() == [date(2022, 12, 1), date(2022, 12, 2), date(2023, 1, 1)]
+    assert amounts.tolist() == [10, 20, 30]
+    assert store.read(1, start=date(2022, 12, 2), end=date(2023, 1, 1))[1].tolist() == [20]
+    totals = store.sum_amounts([1, 2, 3], date(2022, 12, 1), date(2023, 1, 1))
+    assert totals.tolist() == [30, 5, 0]
+
+    # Readings are visible to another store on the same files
+    assert ColumnarStore(tmp_path).read(1)[1].tolist() == [10, 20, 30]
+
+    with pytest.raises(ValueError):
+        store.append(1, [date(2022, 12, 3)], [1, 2])
+
+    # Readings sent again overwrite the amount of their date
+    store.append(1, [date(2022, 12, 2), date(2022, 11, 30)], [25, 5])
+    store.append(1, [date(2022, 12, 2)], [22])
+    dates, amounts = store.read(1)
+    assert dates.tolist() == [
+        date(2022, 11, 30), date(2022, 12, 1), date(2022, 12, 2), date(2023, 1, 1)]
+    assert amounts.tolist() == [5, 10, 22, 30]
+
+    store.clear()
+    store.append(1, [date(2022, 12, 3)], [40])
+    assert store.read(1)[1].tolist() == [40]
+
+
+def append_days(path, first_day: int):
+    """
+    Append readings whose amount is the day number of their date, from `first_day`.
+    """
+    store = ColumnarStore(path)
+    for day in range(first_day, first_day + 2000, 10):
+        days = range(day, day + 10)
+        store.append(1, [date(2000, 1, 1) + timedelta(days=day) for day in days], days)
+
+
+def test_columnar_store_append_from_processes(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=append_days, args=(tmp_path, first_day))
+        for first_day in (0, 2000, 4000, 6000)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    # Each reading keeps its amount, whatever the interleaving of the processes
+    dates, amounts = ColumnarStore(tmp_path).read(1)
+    assert len(dates) == 8000
+    days = (dates - np.datetime64("2000-01-01", "D")).astype(int)
+    assert (days == amounts).all()
+
+
+def test_ingest_feeds_columnar_store(client, db, reading_store):
+    client.post(
+        "/meter-readings/",
+        json={"date": "2022-11-30", "amount": 50, "electrical_meter_uid": 1},
+    )
+    client.post("/meter-readings/bulk", json=[
+        {"date": "2022-12-01", "amount": 100, "electrical_meter_uid": 1},
+        {"date": "2022-12-02", "amount": 200, "electrical_meter_uid": 1},
+    ])
+    dates, amounts = reading_store.read(1)
+    assert dates.astype(str).tolist() == ["2022-11-30", "2022-12-01", "2022-12-02"]
+    assert amounts.tolist() == [50, 100, 200]
+    assert client.get("/factories/1/invoices/2022/12").json()["production"] == 300
+
+    client.post(
+        "/meter-readings/",
+        json={"date": "2022-12-01", "amount": 120, "electrical_meter_uid": 1},
+    )
+    assert reading_store.read(1)[1].tolist() == [50, 120, 200]
+    assert compute_productions(db, [1], date(2022, 12, 1)) == {1: 320}
+
+
+def test_columnar_productions_match_rollup(db, tmp_path, monkeypatch, add_factories):
+    add_factories(3)
+    expected = compute_productions(db, [1, 2, 3, 4], date(2022, 12, 1))
+
+    reading_store = ColumnarStore(tmp_path)
+    monkeypatch.setattr(columnar, "reading_store", reading_store)
+    assert columnar.rebuild(reading_store, db.connection(), batch_size=50) == 6 * 31
+    assert compute_productions(db, [1, 2, 3, 4, 42], date(2022, 12, 1)) == expected
+    assert expected == {1: 0, 2: 2 * 90 * 31, 3: 3 * 90 * 31, 4: 4 * 90 * 31}
+    assert reading_store.read(6)[1].sum() == 4 * 100 * 31  # Producer meter of factory 4
+
+
+def test_concurrent_overwrites_match_database(database_path, db, reading_store, monkeypatch):
+    engine = create_engine(
+        f"sqlite:///{database_path}", connect_args={"check_same_thread": False})
+    appending, overwritten = threading.Event(), threading.Event()
+    append_readings = reading_store.append_readings
+
+    def slow_append_readings(meter_readings):
+        # The first writer is slow to append, the second one overwrites meanwhile
+        if not appending.is_set():
+            appending.set()
+            overwritten.wait(1)
+        append_readings(meter_readings)
+
+    def overwrite(amount: int):
+        with Session(engine) as session:
+            crud.create_meter_reading(session, MeterReadingCreate(
+                date=date(2022, 12, 1), amount=amount, electrical_meter_uid=1))
+
+    monkeypatch.setattr(reading_store, "append_readings", slow_append_readings)
+    first = threading.Thread(target=overwrite, args=(10,))
+    first.start()
+    appending.wait(5)
+    overwrite(20)  # Waits for the first writer to append
+    overwritten.set()
+    first.join(5)
+
+    assert [amount for amount, in db.query(MeterReading.amount)] == [20]
+    assert reading_store.read(1)[1].tolist() == [20]
+    engine.dispose()
+
+
+def add_duplicate_readings(db: Session, reading_store: ColumnarStore):
+    # Database created before readings were unique per meter and date
+    db.execute(text("DROP INDEX uq_meter_readings_electrical_meter_uid_date"))
+    db.execute(text(
+        "CREATE INDEX ix_meter_readings_electrical_meter_uid_date "
+        "ON meter_readings (electrical_meter_uid, date)"
+    ))
+    db.add_all([
+        MeterReading(date=date(2022, 12, 1), amount=amount, electrical_meter_uid=1)
+        for amount in (10, 20)
+    ])
+    db.commit()
+    # The store got the duplicates in another order than the database
+    reading_store.append(1, [date(2022, 12, 1), date(2022, 12, 1)], [20, 10])
+
+
+def test_startup_upgrades_keep_duplicate_readings(
+    database_path, db, reading_store, monkeypatch, caplog):
+    add_duplicate_readings(db, reading_store)
+    with TestClient(create_app(Settings(database_url=f"sqlite:///{database_path}"))):
+        pass
+    # The master of gunicorn upgrades the database, its workers skip the startup upgrade
+    monkeypatch.setattr(database, "engine", create_engine(f"sqlite:///{database_path}"))
+    gunicorn_conf.on_starting(server=None)
+
+    assert caplog.text.count("1 duplicate rows in the meter_readings table") == 2
+    assert db.query(MeterReading).count() == 2
+    assert reading_store.read(1)[1].tolist() == [10]
+
+
+def test_deduplicate_command_rebuilds_columnar_store(
+    database_path, db, reading_store, monkeypatch, capsys):
+    add_duplicate_readings(db, reading_store)
+    engine = create_engine(f"sqlite:///{database_path}")
+    monkeypatch.setattr(migrations, "default_engine", engine)
+    monkeypatch.setattr(sys, "argv", ["migrations", "deduplicate"])
+    migrations.main()
+    assert capsys.readouterr().out.splitlines() == [
+        "1 duplicate rows deleted from the meter_readings table",
+        "Columnar store rebuilt with 1 readings",
+    ]
+    assert [amount for amount, in db.query(MeterReading.amount)] == [20]
+    assert reading_store.read(1)[1].tolist() == [20]
+    engine.dispose()
@@ -0,0 +1,92 @@
+# Standard imports
+import gzip
+import json
+
+# 3rd party imports
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+# Local imports
+from compression import CompressionMiddleware, negotiate_encoding
+
+
+def compression_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+    @app.get("/small")
+    def small():
+        return PlainTextResponse("x" * 99)
+
+    @app.get("/large")
+    def large():
+        return PlainTextResponse("x" * 10_000)
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse(
+            (json.dumps({"uid": uid}) + "\n" for uid in range(1000)),
+            media_type="application/x-ndjson"
+        )
+
+    return app
+
+
+def test_negotiate_encoding():
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("deflate") is None
+    assert negotiate_encoding("") is None
+    assert negotiate_encoding("gzip;q=0, *;q=0.5") in ("br", None)
+    assert negotiate_encoding("identity, *;q=0.1") in ("br", "gzip")
+
+
+def test_gzip_compression():
+    client = TestClient(compression_app())
+    headers = {"Accept-Encoding": "gzip"}
+
+    response = client.get("/small", headers=headers)
+    assert "content-encoding" not in response.headers
+
+    # The test client decodes the body, check the raw length from the headers
+    response = client.get("/large", headers=headers)
+    assert response.headers["content-encoding"] == "gzip"
+    assert int(response.headers["content-length"]) < 200
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.text == "x" * 10_000
+
+    response = client.get("/large", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+
+
+def test_streaming_compression():
+    client = TestClient(compression_app())
+    with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        raw = b"".join(response.iter_raw())
+    lines = gzip.decompress(raw).decode().splitlines()
+    assert [json.loads(line)["uid"] for line in lines] == list(range(1000))
+
+
+def test_brotli_compression():
+    brotli = pytest.importorskip("brotli")
+    client = TestClient(compression_app())
+    with client.stream("GET", "/large", headers={"Accept-Encoding": "gzip, br"}) as response:
+        assert response.headers["content-encoding"] == "br"
+        assert brotli.decompress(b"".join(response.iter_raw())) == b"x" * 10_000
+
+
+def test_api_readings_export_is_compressed(client):
+    client.post("/meter-readings/bulk", json=[
+        {"date": f"2022-12-{day:02d}", "amount": day, "electrical_meter_uid": 1}
+        for day in range(1, 32)
+    ])
+    response = client.get(
+        "/electrical-meters/1/readings",
+        params={"format": "csv"},
+        headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.text.splitlines()) == 32
@@ -0,0 +1,27 @@
+# Local imports
+from config import Settings
+from database.connection import build_engine
+
+
+def test_sqlite_pragmas_applied_on_connect(tmp_path):
+    settings = Settings(
+        database_url=f"sqlite:///{tmp_path / 'config.db'}",
+        sqlite_busy_timeout=1234,
+        sqlite_cache_size=-1000
+    )
+    engine = build_engine(settings)
+    with engine.connect() as connection:
+        def pragma(name):
+            return connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+        assert pragma("journal_mode") == "wal"
+        assert pragma("synchronous") == 1  # NORMAL
+        assert pragma("foreign_keys") == 1
+        assert pragma("busy_timeout") == 1234
+        assert pragma("cache_size") == -1000
+    engine.dispose()
+
+
+def test_async_database_url():
+    settings = Settings(database_url="sqlite:///./test.db")
+    assert settings.get_async_database_url() == "sqlite+aiosqlite:///./test.db"
@@ -0,0 +1,66 @@
+# Standard imports
+import json
+from datetime import date
+
+# 3rd party imports
+from fastapi.testclient import TestClient
+
+# Local imports
+import routers.electrical_meters
+from app import create_app
+from config import Settings
+from models import ElectricalMeter, Factory, MeterReading
+
+
+def add_readings(db, count: int):
+    db.bulk_save_objects([
+        MeterReading(date=date(2022, month, day), amount=day, electrical_meter_uid=1)
+        for month in range(12, 0, -1)
+        for day in range(1, 29)
+    ][:count])
+    db.commit()
+
+
+def test_readings_stream_ndjson(client, db, monkeypatch):
+    monkeypatch.setattr(routers.electrical_meters, "STREAM_BATCH_SIZE", 7)
+    add_readings(db, 50)
+    response = client.get("/electrical-meters/1/readings", params={"format": "ndjson"})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 50
+    assert [row["date"] for row in rows] == sorted(row["date"] for row in rows)
+    assert rows == sorted(client.get("/electrical-meters/1/readings").json(),
+                          key=lambda row: (row["date"], row["uid"]))
+
+
+def test_readings_stream_csv(client, db):
+    add_readings(db, 3)
+    response = client.get("/electrical-meters/1/readings", params={"format": "csv"})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.splitlines()
+    assert lines[0] == "uid,date,amount,electrical_meter_uid"
+    assert len(lines) == 4
+
+
+def test_readings_stream_unknown_meter(client):
+    response = client.get("/electrical-meters/42/readings", params={"format": "csv"})
+    assert response.status_code == 404, response.text
+
+
+def test_create_with_unknown_parent(database_path, db):
+    # The engine built from the settings enforces the foreign keys
+    settings = Settings(database_url=f"sqlite:///{database_path}")
+    with TestClient(create_app(settings)) as client:
+        response = client.post("/factories/", json={"name": "ED_Cha_2", "owner_uid": 99})
+        assert response.status_code == 404, response.text
+        assert response.json()["detail"] == "Energy producer not found"
+
+        response = client.post("/electrical-meters/", json={
+            "name": "ED_Cha_1_em2", "is_producer": False, "factory_uid": 99})
+        assert response.status_code == 404, response.text
+        assert response.json()["detail"] == "Factory not found"
+
+    assert db.query(Factory).count() == 1
+    assert db.query(ElectricalMeter).count() == 1
@@ -0,0 +1,94 @@
+# Standard imports
+from datetime import date
+
+# 3rd party imports
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+# Local imports
+from app import create_app
+from config import Settings
+from database.connection import build_engine
+from group_commit import MeterReadingWriter
+from models import MeterReading
+from schemas import MeterReadingCreate
+
+
+@pytest.fixture
+def engine(database_path, db):
+    engine = build_engine(Settings(database_url=f"sqlite:///{database_path}"))
+    yield engine
+    engine.dispose()
+
+
+def test_writer_commits_readings_in_groups(engine, db):
+    commits = []
+    event.listen(engine, "commit", lambda connection: commits.append(1))
+    writer = MeterReadingWriter(engine, max_group_size=4, max_delay=1)
+    futures = [
+        writer.submit(MeterReadingCreate(
+            date=date(2022, 12, day), amount=day, electrical_meter_uid=1))
+        for day in range(1, 11)
+    ]
+    writer.start()
+    writer.stop(timeout=10)
+
+    created = [future.result(timeout=0) for future in futures]
+    assert [reading.amount for reading in created] == list(range(1, 11))
+    assert sorted(reading.uid for reading in db.query(MeterReading)) == \
+        [reading.uid for reading in created]
+    assert len(commits) == 3  # Groups of 4, 4 and 2 readings
+
+
+def test_writer_rejects_invalid_readings_only(engine, db):
+    writer = MeterReadingWriter(engine, max_delay=1)
+    valid = writer.submit(
+        MeterReadingCreate(date=date(2022, 12, 1), amount=10, electrical_meter_uid=1))
+    invalid = writer.submit(
+        MeterReadingCreate(date=date(2022, 12, 1), amount=10, electrical_meter_uid=42))
+    writer.start()
+    writer.stop(timeout=10)
+
+    assert valid.result(timeout=0).electrical_meter_uid == 1
+    assert isinstance(invalid.exception(timeout=0), IntegrityError)
+    assert db.query(MeterReading).count() == 1
+
+
+def test_create_meter_reading_with_group_commit(database_path, db):
+    settings = Settings(
+        database_url=f"sqlite:///{database_path}", meter_reading_group_commit=True)
+    with TestClient(create_app(settings)) as client:
+        response = client.post("/meter-readings/", json={
+            "date": "2022-12-01", "amount": 100, "electrical_meter_uid": 1})
+        assert response.status_code == 200, response.text
+        uid = response.json()["uid"]
+        assert client.get(f"/meter-readings/{uid}").json()["amount"] == 100
+
+
+@pytest.mark.parametrize("group_commit", [False, True])
+def test_create_meter_reading_of_unknown_meter(database_path, db, group_commit):
+    settings = Settings(
+        database_url=f"sqlite:///{database_path}", meter_reading_group_commit=group_commit)
+    with TestClient(create_app(settings)) as client:
+        response = client.post("/meter-readings/", json={
+            "date": "2022-12-01", "amount": 100, "electrical_meter_uid": 99})
+        assert response.status_code == 404, response.text
+        assert response.json()["detail"] == "Electrical meter not found"
+    assert db.query(MeterReading).count() == 0
+
+
+def test_writer_overwrites_readings_sent_again(engine, db):
+    writer = MeterReadingWriter(engine, max_delay=1)
+    futures = [
+        writer.submit(
+            MeterReadingCreate(date=date(2022, 12, 1), amount=amount, electrical_meter_uid=1))
+        for amount in (10, 20)
+    ]
+    writer.start()
+    writer.stop(timeout=10)
+
+    first, second = (future.result(timeout=0) for future in futures)
+    assert first.uid == second.uid
+    assert [reading.amount for reading in db.query(MeterReading)] == [20]
@@ -0,0 +1,97 @@
+# Standard imports
+import time
+from datetime import date
+
+# 3rd party imports
+from sqlalchemy import update
+
+# Local imports
+import crud
+from crud import DEFERRED_CHANGES_MIN_ROWS
+from models import DEFERRED_CHANGES_SCOPE, ChangeCounter, Invoice, MeterReading
+
+
+def test_invoices_conditional_get(client, db, count_statements):
+    db.add(Invoice(date=date(2022, 12, 1), production=10, price=5, factory_uid=1))
+    db.commit()
+
+    for path in ("/invoices/", "/invoices/2022/12", "/factories/1/invoices"):
+        response = client.get(path)
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert etag.startswith('W/"') and "Last-Modified" in response.headers
+
+        with count_statements() as statements:
+            response = client.get(path, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+        assert statements.count == 1  # Only the change counter is read
+
+    # Dates only have a one second resolution, changes of the current second may go on
+    db.execute(update(ChangeCounter).values(updated_at=int(time.time()) + 1))
+    db.commit()
+    last_modified = client.get("/invoices/").headers["Last-Modified"]
+    response = client.get("/invoices/", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 200
+    db.execute(update(ChangeCounter).values(updated_at=ChangeCounter.updated_at - 10))
+    db.commit()
+    for path in ("/invoices/", "/invoices/2022/12", "/factories/1/invoices"):
+        last_modified = client.get(path).headers["Last-Modified"]
+        response = client.get(path, headers={"If-Modified-Since": last_modified})
+        assert response.status_code == 304
+
+    # A new invoice changes the ETag of the collection
+    etag = client.get("/factories/1/invoices").headers["ETag"]
+    db.add(Invoice(date=date(2022, 11, 1), production=20, price=10, factory_uid=1))
+    db.commit()
+    response = client.get("/factories/1/invoices", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [invoice["date"] for invoice in response.json()] == ["2022-11-01", "2022-12-01"]
+
+
+def test_readings_conditional_get(client, db):
+    assert "ETag" not in client.get("/electrical-meters/1/readings").headers
+
+    client.post(
+        "/meter-readings/", json={"date": "2022-12-01", "amount": 50, "electrical_meter_uid": 1})
+    etag = client.get("/electrical-meters/1/readings").headers["ETag"]
+    for params in ({}, {"format": "csv"}, {"format": "ndjson"}):
+        response = client.get(
+            "/electrical-meters/1/readings", params=params, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
+    # Updates and deletes change the ETag too
+    reading = db.query(MeterReading).one()
+    reading.amount = 60
+    db.commit()
+    response = client.get("/electrical-meters/1/readings", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()[0]["amount"] == 60
+
+    assert client.get("/electrical-meters/42/readings").status_code == 404
+
+
+def test_bulk_writes_count_their_changes_once(client, db):
+    readings = [
+        {"date": f"2022-{month:02d}-{day:02d}", "amount": 1, "electrical_meter_uid": 1}
+        for month in range(1, 13) for day in range(1, 29)
+    ]
+    assert len(readings) >= DEFERRED_CHANGES_MIN_ROWS
+    response = client.post("/meter-readings/bulk", json=readings)
+    assert response.json()["inserted"] == len(readings)
+    # The triggers were disabled, the counter of the meter changed once
+    assert crud.read_change_counter(db, scope="meter_readings", key=1).version == 1
+    assert db.query(ChangeCounter).filter(
+        ChangeCounter.scope == DEFERRED_CHANGES_SCOPE).count() == 0
+
+    etag = client.get("/electrical-meters/1/readings").headers["ETag"]
+    client.post("/meter-readings/bulk", json=readings)
+    response = client.get("/electrical-meters/1/readings", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert crud.read_change_counter(db, scope="meter_readings", key=1).version == 2
+
+    # Smaller writes are counted by the triggers
+    client.post("/meter-readings/bulk", json=readings[:2])
+    assert crud.read_change_counter(db, scope="meter_readings", key=1).version == 6
@@ -0,0 +1,68 @@
+# 3rd party imports
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+# Local imports
+import insert_fake_data
+from insert_fake_data import generate_fake_data
+from models import TRIGGERS
+
+
+def dump(engine) -> dict:
+    with engine.connect() as connection:
+        return {
+            table: connection.exec_driver_sql(f"SELECT * FROM {table} ORDER BY 1").fetchall()
+            for table in ("energy_producers", "factories", "electrical_meters", "meter_readings")
+        }
+
+
+def test_generate_fake_data_is_deterministic(tmp_path):
+    dumps = []
+    for workers in (1, 2):
+        engine = create_engine(f"sqlite:///{tmp_path / f'fake_{workers}.db'}")
+        generate_fake_data(
+            engine, seed=42, producers=2, factories=2, meters=2, days=40,
+            workers=workers, batch_size=50
+        )
+        dumps.append(dump(engine))
+        with engine.connect() as connection:
+            rollup_total = connection.exec_driver_sql(
+                "SELECT SUM(amount) FROM monthly_productions").scalar()
+            readings_total = connection.exec_driver_sql(
+                "SELECT SUM(amount) FROM meter_readings").scalar()
+        assert rollup_total == readings_total
+        engine.dispose()
+
+    assert len(dumps[0]["meter_readings"]) == 2 * 2 * 2 * 40
+    assert dumps[0] == dumps[1]
+
+
+def test_generate_fake_data_failure_restores_triggers(tmp_path, monkeypatch):
+    # A single pooled connection, to check the setting it is given back with
+    engine = create_engine(f"sqlite:///{tmp_path / 'fake.db'}", poolclass=StaticPool)
+    insert_readings = insert_fake_data.insert_readings
+    calls = []
+
+    def failing_insert_readings(connection, *readings):
+        calls.append(1)
+        if len(calls) > 1:
+            raise RuntimeError("Disk full")
+        insert_readings(connection, *readings)
+
+    monkeypatch.setattr(insert_fake_data, "insert_readings", failing_insert_readings)
+    with pytest.raises(RuntimeError):
+        generate_fake_data(engine, producers=1, factories=2, meters=1, days=40, batch_size=40)
+
+    with engine.connect() as connection:
+        triggers = {name for name, in connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+        rollup_total = connection.exec_driver_sql(
+            "SELECT SUM(amount) FROM monthly_productions").scalar()
+        readings_total = connection.exec_driver_sql(
+            "SELECT SUM(amount) FROM meter_readings").scalar()
+        synchronous = connection.exec_driver_sql("PRAGMA synchronous").scalar()
+    assert triggers == set(TRIGGERS)
+    assert rollup_total == readings_total > 0  # The first batch was committed
+    assert synchronous == 2  # FULL, the default
+    engine.dispose()
@@ -0,0 +1,116 @@
+# Standard imports
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+# 3rd party imports
+from sqlalchemy import create_engine
+
+# Local imports
+import invoice_jobs
+from invoice_jobs import InvoiceScheduler, last_closed_month, precompute_invoices
+from models import Factory, Invoice, MeterReading
+
+
+def test_last_closed_month():
+    assert last_closed_month(date(2023, 1, 15)) == date(2022, 12, 1)
+    assert last_closed_month(date(2022, 12, 1)) == date(2022, 11, 1)
+
+
+def test_precompute_invoices(database_path, db, add_factories):
+    add_factories(4)
+    db.add(Invoice(date=date(2022, 12, 1), production=1, price=0.5, factory_uid=2))
+    db.add(Factory(uid=9, name="ED_Cha_9", owner_uid=1))
+    db.commit()
+
+    engine = create_engine(f"sqlite:///{database_path}")
+    # Factories without readings in the month (1) or without meters (9) are skipped
+    assert precompute_invoices(engine, month=date(2022, 12, 1), chunk_size=2) == 3
+    # Invoices already computed are kept
+    assert precompute_invoices(engine, month=date(2022, 12, 1)) == 0
+
+    invoices = {
+        invoice.factory_uid: invoice.production
+        for invoice in db.query(Invoice).filter(Invoice.date == date(2022, 12, 1))
+    }
+    assert invoices == {2: 1, 3: 31 * 270, 4: 31 * 360, 5: 31 * 450}
+    engine.dispose()
+
+
+def test_precompute_invoices_with_workers(database_path, db, add_factories):
+    add_factories(3)
+    engine = create_engine(f"sqlite:///{database_path}")
+    assert precompute_invoices(
+        engine, month=date(2022, 12, 1), workers=2, chunk_size=1) == 3
+    assert db.query(Invoice).count() == 3
+    engine.dispose()
+
+
+def test_precompute_invoices_stopped(database_path, db, add_factories):
+    add_factories(3)
+    engine = create_engine(f"sqlite:///{database_path}")
+    stopped = threading.Event()
+    stopped.set()
+    for workers in (1, 2):
+        assert precompute_invoices(
+            engine, month=date(2022, 12, 1), workers=workers, chunk_size=1,
+            stopped=stopped
+        ) <= 1
+    engine.dispose()
+
+
+def test_invoice_scheduler_computes_last_closed_month(database_path, db):
+    db.add(MeterReading(date=last_closed_month(), amount=10, electrical_meter_uid=1))
+    db.commit()
+    engine = create_engine(f"sqlite:///{database_path}")
+    scheduler = InvoiceScheduler(engine)
+    scheduler.start()
+    deadline = time.monotonic() + 10
+    while not db.query(Invoice).count() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+    assert [invoice.date for invoice in db.query(Invoice)] == [last_closed_month()]
+    engine.dispose()
+
+
+def test_invoice_scheduler_stop_is_bounded(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(
+        invoice_jobs, "precompute_invoices", lambda *args, **kwargs: release.wait(10))
+    scheduler = InvoiceScheduler(engine=None)
+    scheduler.start()
+    start = time.monotonic()
+    scheduler.stop(timeout=0.1)
+    assert time.monotonic() - start < 5
+    release.set()
+
+
+def test_invoice_scheduler_waits_for_late_readings(monkeypatch):
+    months = []
+    monkeypatch.setattr(
+        invoice_jobs, "precompute_invoices",
+        lambda *args, month, **kwargs: months.append(month))
+    scheduler = InvoiceScheduler(engine=None, delay=24 * 40)
+    scheduler.start()
+    scheduler.stop()
+    # 40 days after the end of a month, the month before it was the last one closed
+    assert months == [last_closed_month((datetime.now() - timedelta(days=40)).date())]
+
+
+def test_late_readings_delete_precomputed_invoices(database_path, client, db, add_factories):
+    add_factories(2)
+    engine = create_engine(f"sqlite:///{database_path}")
+    assert precompute_invoices(engine, month=date(2022, 12, 1)) == 2
+
+    reading = {"date": "2022-11-30", "amount": 10, "electrical_meter_uid": 2}
+    client.post("/meter-readings/", json=reading)
+    assert db.query(Invoice.factory_uid).order_by(Invoice.factory_uid).all() == [(2,), (3,)]
+
+    # The invoice of the factory and month of a late reading is computed again
+    reading["date"] = "2022-12-31"  # Overwrites the amount of 200 kWh
+    client.post("/meter-readings/", json=reading)
+    client.post("/meter-readings/bulk", json=[{**reading, "electrical_meter_uid": 4}])
+    assert db.query(Invoice).count() == 0
+    response = client.get("/factories/2/invoices/2022/12")
+    assert response.json()["production"] == 30 * (200 - 20) + (10 - 20)
+    engine.dispose()
@@ -0,0 +1,141 @@
+# Standard imports
+from datetime import date
+
+# 3rd party imports
+from sqlalchemy import create_engine, inspect
+
+# Local imports
+import crud
+from database.migrations import deduplicate, upgrade
+from models import Invoice
+from schemas import InvoiceCreate
+from utils import compute_invoice, period_bounds
+
+
+def test_energy_producer_invoices_at_date(client, db, add_factories, count_statements):
+    add_factories(5)
+    with count_statements() as statements:
+        response = client.get("/energy-producers/1/invoices/2022/12")
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert [invoice["factory_uid"] for invoice in data] == [1, 2, 3, 4, 5, 6]
+    for invoice in data:
+        expected = compute_invoice(db, invoice["factory_uid"], date(2022, 12, 1))
+        assert invoice["date"] == "2022-12-01"
+        assert invoice["production"] == expected.production
+        assert invoice["price"] == expected.price
+    # Lookup, computation and insertion don't depend on the number of factories
+    assert statements.count <= 8
+
+    # Invoices are only computed once
+    response = client.get("/energy-producers/1/invoices/2022/12")
+    assert response.json() == data
+    assert db.query(Invoice).count() == 6
+
+
+def test_energy_producer_invoices(client, db, add_factories, count_statements):
+    add_factories(5)
+    for month in (11, 12):
+        for factory_uid in range(1, 7):
+            db.add(Invoice(
+                date=date(2022, month, 1), factory_uid=factory_uid, production=1, price=1))
+    db.commit()
+
+    with count_statements() as statements:
+        response = client.get("/energy-producers/1/invoices")
+    assert response.status_code == 200, response.text
+    assert len(response.json()) == 12
+    assert statements.count == 2  # Producer lookup and invoices, whatever the factories
+
+    response = client.get("/energy-producers/1/invoices", params={"year": 2022, "month": 12})
+    assert [invoice["factory_uid"] for invoice in response.json()] == [1, 2, 3, 4, 5, 6]
+    assert {invoice["date"] for invoice in response.json()} == {"2022-12-01"}
+
+    # Pages of 5 invoices, following the cursor
+    invoices, params = [], {"year": 2022, "limit": 5}
+    while True:
+        response = client.get("/energy-producers/1/invoices", params=params)
+        invoices += response.json()
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert len(invoices) == 12
+    dates = [invoice["date"] for invoice in invoices]
+    assert dates == sorted(dates)
+
+    assert client.get("/energy-producers/1/invoices", params={"month": 12}).status_code == 400
+    assert client.get("/energy-producers/2/invoices").status_code == 404
+
+
+def test_invoices_of_years_out_of_range(client, db):
+    for path in (
+        "/invoices/10000/1",
+        "/factories/1/invoices/10000/1",
+        "/energy-producers/1/invoices/10000/1",
+        "/meter-readings/10000/",
+        "/meter-readings/10000/1/1",
+    ):
+        response = client.get(path)
+        assert response.status_code == 400, path
+        assert response.json()["detail"] == "Year can't be > 9999"
+    response = client.get("/energy-producers/1/invoices", params={"year": 10000})
+    assert response.status_code == 400
+
+
+def test_invoices_of_the_last_valid_month(client, db):
+    # The periods of December 9999 have no valid end date
+    for path in (
+        "/invoices/9999/12",
+        "/factories/1/invoices/9999/12",
+        "/energy-producers/1/invoices/9999/12",
+        "/meter-readings/9999/",
+        "/meter-readings/9999/12",
+        "/meter-readings/9999/12/31",
+    ):
+        assert client.get(path).status_code == 200, path
+    response = client.get("/energy-producers/1/invoices", params={"year": 9999})
+    assert response.status_code == 200
+    assert period_bounds(9999, 12) == (date(9999, 12, 1), None)
+    assert period_bounds(9999, 12, 31) == (date(9999, 12, 31), None)
+
+
+def test_create_invoice_upserts(db):
+    invoice = InvoiceCreate(date=date(2022, 12, 15), production=10, price=5, factory_uid=1)
+    first = crud.create_invoice(db, invoice=invoice)
+    assert first.date == date(2022, 12, 1)
+    # The invoice of the month computed concurrently is updated, not duplicated
+    second = crud.create_invoice(db, invoice=invoice.copy(update={"production": 20}))
+    assert (second.uid, second.production) == (first.uid, 20)
+    assert crud.create_invoices(db, invoices=[invoice]) == 1
+    assert [invoice.production for invoice in db.query(Invoice)] == [10]
+
+
+def test_deduplicate_invoices(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as connection:
+        # Database created before invoices were unique per factory and month
+        connection.exec_driver_sql(
+            "CREATE TABLE invoices (uid INTEGER PRIMARY KEY, date DATE, production FLOAT, "
+            "price FLOAT, factory_uid INTEGER)"
+        )
+        connection.exec_driver_sql(
+            "CREATE INDEX ix_invoices_factory_uid_date ON invoices (factory_uid, date)")
+        connection.exec_driver_sql(
+            "INSERT INTO invoices (date, production, price, factory_uid) VALUES "
+            "('2022-12-01', 1, 0.5, 1), ('2022-12-01', 2, 1, 1), ('2022-11-01', 3, 1.5, 1)"
+        )
+    assert upgrade(engine) == {"invoices": 1}
+    with engine.connect() as connection:
+        indexes = {index["name"] for index in inspect(connection).get_indexes("invoices")}
+    assert "uq_invoices_factory_uid_date" not in indexes
+    with engine.begin() as connection:
+        assert deduplicate(connection) == {"invoices": 1}
+    assert upgrade(engine) == {}
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            "SELECT uid, date FROM invoices ORDER BY uid").fetchall()
+        indexes = {index["name"] for index in inspect(connection).get_indexes("invoices")}
+    assert rows == [(1, "2022-12-01"), (3, "2022-11-01")]
+    assert "uq_invoices_factory_uid_date" in indexes
+    assert "ix_invoices_factory_uid_date" not in indexes
+    engine.dispose()
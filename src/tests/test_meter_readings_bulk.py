@@ -0,0 +1,72 @@
+# Standard imports
+import json
+
+# Local imports
+from models import MeterReading
+
+
+def count_readings(db) -> int:
+    return db.query(MeterReading).count()
+
+
+def test_bulk_json_array(client, db):
+    response = client.post("/meter-readings/bulk", json=[
+        {"date": "2022-12-01", "amount": 100, "electrical_meter_uid": 1},
+        {"date": "2022-12-02", "amount": 200, "electrical_meter_uid": 1},
+        {"date": "not a date", "amount": 300, "electrical_meter_uid": 1},
+        {"date": "2022-12-04", "amount": 400, "electrical_meter_uid": 42},
+    ])
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["received"] == 4
+    assert data["inserted"] == 2
+    assert data["rejected"] == 2
+    assert [error["index"] for error in data["errors"]] == [2, 3]
+    assert data["errors"][1]["detail"] == "Electrical meter not found"
+    assert count_readings(db) == 2
+
+
+def test_bulk_ndjson(client, db):
+    lines = [
+        json.dumps({"date": "2022-12-01", "amount": 100, "electrical_meter_uid": 1}),
+        "",
+        "{not json",
+        json.dumps({"date": "2022-12-02", "amount": 200, "electrical_meter_uid": 2}),
+        json.dumps({"date": "2022-12-02", "amount": 200, "electrical_meter_uid": 1}),
+    ]
+    response = client.post(
+        "/meter-readings/bulk",
+        content="\n".join(lines),
+        headers={"content-type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["received"] == 4
+    assert data["inserted"] == 2
+    # Errors are indexed by line number, blank lines included
+    assert [error["index"] for error in data["errors"]] == [2, 3]
+    assert count_readings(db) == 2
+
+
+def test_bulk_invalid_body(client, db):
+    response = client.post("/meter-readings/bulk", json={"date": "2022-12-01"})
+    assert response.status_code == 400, response.text
+    assert count_readings(db) == 0
+
+
+def test_readings_sent_again_are_overwritten(client, db):
+    reading = {"date": "2022-12-01", "amount": 100, "electrical_meter_uid": 1}
+    uid = client.post("/meter-readings/", json=reading).json()["uid"]
+    response = client.post("/meter-readings/", json={**reading, "amount": 150})
+    assert response.json() == {**reading, "amount": 150, "uid": uid}
+
+    # A bulk request re-sending a day's data is a safe overwrite, the last reading wins
+    response = client.post("/meter-readings/bulk", json=[
+        {**reading, "amount": 200},
+        {**reading, "date": "2022-12-02"},
+        {**reading, "amount": 250},
+    ])
+    assert response.json()["inserted"] == 3
+    readings = db.query(MeterReading).order_by(MeterReading.date).all()
+    assert [(r.uid, r.amount) for r in readings] == [(uid, 250), (readings[1].uid, 100)]
+    assert client.get("/factories/1/invoices/2022/12").json()["production"] == 350
@@ -0,0 +1,35 @@
+# 3rd party imports
+from prometheus_client import REGISTRY
+
+
+def sample(name: str, labels: dict) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_metrics_record_route_latency_and_queries(client):
+    labels = {"method": "GET", "route": "/factories/{factory_uid}"}
+    count = sample("http_request_duration_seconds_count", {**labels, "status": "200"})
+    queries = sample("http_request_db_queries_sum", labels)
+
+    response = client.get("/factories/1")
+    assert response.status_code == 200
+
+    assert sample("http_request_duration_seconds_count", {**labels, "status": "200"}) == count + 1
+    assert sample("http_request_db_queries_sum", labels) >= queries + 1
+    assert sample("http_requests_in_progress", {"method": "GET"}) == 0
+
+
+def test_metrics_label_unmatched_routes(client):
+    labels = {"method": "GET", "route": "unmatched", "status": "404"}
+    count = sample("http_request_duration_seconds_count", labels)
+    assert client.get("/does-not-exist").status_code == 404
+    assert sample("http_request_duration_seconds_count", labels) == count + 1
+
+
+def test_metrics_endpoint(client):
+    client.get("/invoices/cache-stats")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'route="/invoices/cache-stats"' in response.text
+    assert "invoice_cache_hits_total" in response.text
@@ -0,0 +1,60 @@
+# Standard imports
+from datetime import date, timedelta
+
+# Local imports
+from models import ElectricalMeter, EnergyProducer, MeterReading
+from pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+
+
+def read_all_pages(client, url: str, limit: int) -> list:
+    rows = []
+    params = {"limit": limit}
+    while True:
+        response = client.get(url, params=params)
+        assert response.status_code == 200, response.text
+        rows.extend(response.json())
+        if NEXT_CURSOR_HEADER not in response.headers:
+            return rows
+        params = {"limit": limit, "cursor": response.headers[NEXT_CURSOR_HEADER]}
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor((date(2022, 12, 1), 42))
+    assert decode_cursor(cursor, date.fromisoformat, int) == (date(2022, 12, 1), 42)
+
+
+def test_uid_cursor_pagination(client, db):
+    db.add_all([EnergyProducer(name=f"producer_{i}") for i in range(10)])
+    db.commit()
+    rows = read_all_pages(client, "/energy-producers/", limit=3)
+    assert [row["uid"] for row in rows] == list(range(1, 12))
+
+
+def test_date_uid_cursor_pagination(client, db):
+    # Insert readings in reverse chronological order, with several readings per day
+    db.add_all([
+        ElectricalMeter(uid=uid, name=f"ED_Cha_1_em{uid}", is_producer=True, factory_uid=1)
+        for uid in (2, 3)
+    ])
+    start = date(2022, 12, 1)
+    db.add_all([
+        MeterReading(date=start + timedelta(days=day), amount=i, electrical_meter_uid=i + 1)
+        for day in range(9, -1, -1)
+        for i in range(3)
+    ])
+    db.commit()
+    rows = read_all_pages(client, "/meter-readings/2022/12", limit=4)
+    assert len(rows) == 30
+    assert [(row["date"], row["uid"]) for row in rows] == sorted(
+        (row["date"], row["uid"]) for row in rows)
+
+    # Legacy offset pagination still works
+    response = client.get("/meter-readings/2022/12", params={"skip": 4, "limit": 4})
+    assert response.json() == rows[4:8]
+
+
+def test_invalid_cursor(client):
+    response = client.get("/invoices/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400, response.text
+    response = client.get("/invoices/", params={"cursor": encode_cursor((1,))})
+    assert response.status_code == 400, response.text
@@ -0,0 +1,57 @@
+# Standard imports
+from datetime import date
+
+# Local imports
+from models import MeterReading
+
+
+def test_factory_production(client, db, add_factories):
+    add_factories(1)  # Factory 2: +200 and -20 kWh every day of December 2022
+    params = {"from": "2022-12-01", "to": "2022-12-04"}
+    response = client.get("/factories/2/production", params=params)
+    assert response.status_code == 200, response.text
+    assert response.json() == [
+        {"date": "2022-12-01", "production": 180},
+        {"date": "2022-12-02", "production": 180},
+        {"date": "2022-12-03", "production": 180},
+    ]
+
+    # 2022-12-05 is a Monday, the first week only holds the readings of the range
+    params = {"from": "2022-12-01", "to": "2022-12-12", "granularity": "week"}
+    assert client.get("/factories/2/production", params=params).json() == [
+        {"date": "2022-11-28", "production": 4 * 180},
+        {"date": "2022-12-05", "production": 7 * 180},
+    ]
+
+    # Partial months are aggregated from the readings
+    params = {"from": "2022-12-10", "to": "2023-01-01", "granularity": "month"}
+    assert client.get("/factories/2/production", params=params).json() == [
+        {"date": "2022-12-01", "production": 22 * 180},
+    ]
+
+    assert client.get("/factories/2/production", params={**params, "to": "2022-12-10"}) \
+        .status_code == 400
+    assert client.get("/factories/42/production", params=params).status_code == 404
+    assert client.get("/factories/2/production", params={**params, "granularity": "year"}) \
+        .status_code == 422
+
+
+def test_energy_producer_monthly_production(client, db, add_factories, count_statements):
+    add_factories(2)
+    db.add(MeterReading(date=date(2022, 11, 30), amount=1000, electrical_meter_uid=1))
+    db.commit()
+
+    params = {"from": "2022-11-01", "to": "2023-01-01", "granularity": "month"}
+    with count_statements() as statements:
+        response = client.get("/energy-producers/1/production", params=params)
+    assert response.status_code == 200, response.text
+    assert response.json() == [
+        {"date": "2022-11-01", "production": 1000},
+        {"date": "2022-12-01", "production": (180 + 270) * 31},
+    ]
+    assert statements.count == 2
+
+    # Same totals whether whole months are read from the rollup or from the readings
+    params["to"] = "2022-12-31"
+    december = client.get("/energy-producers/1/production", params=params).json()[1]
+    assert december["production"] == (180 + 270) * 30
@@ -0,0 +1,82 @@
+# Standard imports
+import logging
+
+# 3rd party imports
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# Local imports
+import crud
+from app import create_app
+from config import Settings
+from database import get_db
+from instrumentation import (
+    QueryBudgetExceeded,
+    QueryBudgetMiddleware,
+    query_budget,
+    statement_shape
+)
+
+
+def budget_app(db, raise_errors: bool) -> FastAPI:
+    """
+    Application running one query per item, with a budget of 3 queries.
+    """
+    app = FastAPI()
+    app.add_middleware(QueryBudgetMiddleware, max_repeats=3, raise_errors=raise_errors)
+
+    @app.get("/items/{count}")
+    @query_budget(3)
+    def read_items(count: int):
+        return [db.execute(text("SELECT :uid"), {"uid": uid}).scalar() for uid in range(count)]
+
+    return app
+
+
+def test_statement_shape():
+    assert statement_shape("SELECT *\n  FROM invoices WHERE uid IN (?, ?,?)") == \
+        "SELECT * FROM invoices WHERE uid IN (?)"
+    assert statement_shape("SELECT * FROM invoices WHERE uid IN (?)") == \
+        "SELECT * FROM invoices WHERE uid IN (?)"
+
+
+def test_query_budget_raise(db):
+    client = TestClient(budget_app(db, raise_errors=True))
+    assert client.get("/items/3").json() == [0, 1, 2]
+    with pytest.raises(QueryBudgetExceeded, match="4 SQL statements run, budget is 3"):
+        client.get("/items/4")
+
+
+def test_query_budget_warn(db, caplog):
+    client = TestClient(budget_app(db, raise_errors=False))
+    with caplog.at_level(logging.WARNING):
+        assert client.get("/items/5").status_code == 200
+    assert "GET /items/{count}: 5 SQL statements run, budget is 3" in caplog.text
+    assert "statement run 5 times (N+1 query?): SELECT ?" in caplog.text
+
+
+
+def test_n_plus_one_detection(database_path, db, add_factories):
+    add_factories(5)
+    app = create_app(
+        Settings(database_url=f"sqlite:///{database_path}", query_budget_mode="raise"))
+
+    @app.get("/energy-producers/{energy_producer_uid}/electrical-meters")
+    def read_energy_producer_electrical_meters(
+        energy_producer_uid: int, db: Session = Depends(get_db)):
+        # The meters of each factory are lazy loaded one after the other
+        db_energy_producer = crud.read_energy_producer(db, uid=energy_producer_uid)
+        return [
+            electrical_meter.uid
+            for factory in db_energy_producer.factories
+            for electrical_meter in factory.electrical_meters
+        ]
+
+    with TestClient(app) as client:
+        with pytest.raises(QueryBudgetExceeded, match="N\\+1 query"):
+            client.get("/energy-producers/1/electrical-meters")
+        # Routes reading the rows of all the factories at once stay within their budget
+        assert len(client.get("/energy-producers/1/invoices/2022/12").json()) == 6
@@ -0,0 +1,88 @@
+# Standard imports
+from datetime import date
+
+# 3rd party imports
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# Local imports
+import crud
+from database.migrations import upgrade
+from utils import compute_productions
+
+engine = create_engine(
+    "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+upgrade(engine)
+
+
+def query_plans(run_queries) -> list[str]:
+    """
+    Run `run_queries` and return the `EXPLAIN QUERY PLAN` details of every
+    statement it executed.
+    """
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    db = TestingSessionLocal()
+    try:
+        run_queries(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+        db.close()
+
+    details = []
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            details.extend(row[-1] for row in rows)
+    return details
+
+
+def assert_uses_indexes(details: list[str], *tables: str):
+    for table in tables:
+        searches = [d for d in details if d.startswith(f"SEARCH {table} ")]
+        assert searches, details
+        # Automatic indexes are built by SQLite for a single query, they do not count
+        assert all(
+            "USING INDEX" in d or "USING COVERING INDEX" in d or "PRIMARY KEY" in d
+            for d in searches
+        ), details
+        assert not any(d.startswith(f"SCAN {table}") for d in details), details
+
+
+def test_meter_readings_date_filters_use_index():
+    filters = ({"year": 2022}, {"year": 2022, "month": 2}, {"year": 2022, "month": 2, "day": 3})
+    for kwargs in filters:
+        details = query_plans(lambda db: crud.read_meter_readings(db, **kwargs))
+        assert_uses_indexes(details, "meter_readings")
+
+
+def test_keyset_pagination_uses_index():
+    after = (date(2022, 2, 3), 42)
+    details = query_plans(lambda db: crud.read_meter_readings(db, year=2022, month=2, after=after))
+    assert_uses_indexes(details, "meter_readings")
+    assert not any("TEMP B-TREE" in d for d in details), details
+
+    details = query_plans(lambda db: crud.read_invoices(db, after=after))
+    assert not any("TEMP B-TREE" in d for d in details), details
+
+
+def test_invoices_date_filters_use_index():
+    details = query_plans(lambda db: crud.read_invoices(db, date=date(2022, 2, 1)))
+    assert_uses_indexes(details, "invoices")
+
+    details = query_plans(
+        lambda db: crud.read_factory_invoice_at_date(db, factory_uid=1, date=date(2022, 2, 1)))
+    assert_uses_indexes(details, "invoices")
+
+
+def test_compute_productions_uses_indexes():
+    details = query_plans(lambda db: compute_productions(db, [1, 2], date(2022, 2, 1)))
+    assert_uses_indexes(details, "factories", "electrical_meters", "monthly_productions")
@@ -0,0 +1,108 @@
+# Standard imports
+from datetime import date
+
+# 3rd party imports
+from sqlalchemy import create_engine
+
+# Local imports
+from database.migrations import deduplicate, rebuild_monthly_productions, upgrade
+from models import MeterReading, MonthlyProduction
+
+
+def read_rollup(db) -> list[tuple]:
+    return [
+        (row.electrical_meter_uid, row.year, row.month, row.amount, row.reading_count)
+        for row in db.query(MonthlyProduction).order_by(
+            MonthlyProduction.year, MonthlyProduction.month)
+    ]
+
+
+def test_rollup_follows_every_write_path(client, db):
+    client.post(
+        "/meter-readings/",
+        json={"date": "2022-11-30", "amount": 50, "electrical_meter_uid": 1},
+    )
+    client.post("/meter-readings/bulk", json=[
+        {"date": "2022-12-01", "amount": 100, "electrical_meter_uid": 1},
+        {"date": "2022-12-02", "amount": 200, "electrical_meter_uid": 1},
+    ])
+    assert read_rollup(db) == [(1, 2022, 11, 50, 1), (1, 2022, 12, 300, 2)]
+
+    # Overwrite a reading
+    client.post(
+        "/meter-readings/",
+        json={"date": "2022-11-30", "amount": 60, "electrical_meter_uid": 1},
+    )
+    assert read_rollup(db) == [(1, 2022, 11, 60, 1), (1, 2022, 12, 300, 2)]
+    client.post(
+        "/meter-readings/",
+        json={"date": "2022-11-30", "amount": 50, "electrical_meter_uid": 1},
+    )
+
+    # Move a reading to another month, then delete one
+    reading = db.query(MeterReading).filter(MeterReading.amount == 200).one()
+    reading.date = date(2022, 11, 29)
+    db.commit()
+    assert read_rollup(db) == [(1, 2022, 11, 250, 2), (1, 2022, 12, 100, 1)]
+
+    db.delete(db.query(MeterReading).filter(MeterReading.amount == 100).one())
+    db.commit()
+    assert read_rollup(db) == [(1, 2022, 11, 250, 2)]
+
+    expected = read_rollup(db)
+    rebuild_monthly_productions(db.connection())
+    db.commit()
+    assert read_rollup(db) == expected
+
+
+def test_upgrade_fills_new_rollup(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as connection:
+        # Database created before the rollup existed
+        connection.exec_driver_sql(
+            "CREATE TABLE meter_readings ("
+            "uid INTEGER PRIMARY KEY, date DATE, amount FLOAT, electrical_meter_uid INTEGER)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO meter_readings (date, amount, electrical_meter_uid) "
+            "VALUES ('2022-12-01', 10, 1), ('2022-12-02', 20, 1), ('2022-12-01', 5, 2)"
+        )
+    upgrade(engine)
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            "SELECT electrical_meter_uid, year, month, amount, reading_count "
+            "FROM monthly_productions ORDER BY electrical_meter_uid"
+        ).fetchall()
+    assert rows == [(1, 2022, 12, 30, 2), (2, 2022, 12, 5, 1)]
+    engine.dispose()
+
+
+def test_deduplicate_readings(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as connection:
+        # Database created before readings were unique per meter and date
+        connection.exec_driver_sql(
+            "CREATE TABLE meter_readings ("
+            "uid INTEGER PRIMARY KEY, date DATE, amount FLOAT, electrical_meter_uid INTEGER)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO meter_readings (date, amount, electrical_meter_uid) "
+            "VALUES ('2022-12-01', 10, 1), ('2022-12-01', 20, 1), ('2022-12-01', 5, 2)"
+        )
+    # Duplicates are only deleted on demand
+    assert upgrade(engine) == {"meter_readings": 1}
+    assert upgrade(engine) == {"meter_readings": 1}
+    with engine.begin() as connection:
+        assert deduplicate(connection) == {"meter_readings": 1}
+    assert upgrade(engine) == {}
+    with engine.connect() as connection:
+        readings = connection.exec_driver_sql(
+            "SELECT uid, amount FROM meter_readings ORDER BY uid").fetchall()
+        rollup = connection.exec_driver_sql(
+            "SELECT electrical_meter_uid, amount, reading_count FROM monthly_productions "
+            "ORDER BY electrical_meter_uid"
+        ).fetchall()
+    # The last reading sent is kept
+    assert readings == [(2, 20), (3, 5)]
+    assert rollup == [(1, 20, 1), (2, 5, 1)]
+    engine.dispose()
@@ -0,0 +1,43 @@
+# Standard imports
+from datetime import date
+
+# 3rd party imports
+from fastapi.encoders import jsonable_encoder
+
+# Local imports
+import schemas
+from app import app
+from models import Invoice, MeterReading
+
+
+def test_list_routes_match_response_models(client, db):
+    db.add_all([
+        MeterReading(date=date(2022, 12, day), amount=day * 1.5, electrical_meter_uid=1)
+        for day in range(1, 4)
+    ])
+    db.add(Invoice(date=date(2022, 12, 1), production=4.5, price=2.25, factory_uid=1))
+    db.commit()
+
+    for path, model, query in [
+        ("/meter-readings/", schemas.MeterReading, db.query(MeterReading)),
+        ("/electrical-meters/1/readings", schemas.MeterReading, db.query(MeterReading)),
+        ("/invoices/", schemas.Invoice, db.query(Invoice)),
+    ]:
+        response = client.get(path)
+        assert response.headers["content-type"] == "application/json"
+        expected = jsonable_encoder([model.from_orm(db_row) for db_row in query])
+        assert response.json() == expected
+
+    response = client.get("/electrical-meters/")
+    assert response.json() == [
+        {"uid": 1, "name": "ED_Cha_1_em1", "is_producer": True, "factory_uid": 1}]
+
+
+def test_list_routes_keep_openapi_schema():
+    paths = app.openapi()["paths"]
+    schema = paths["/meter-readings/{year}/{month}"]["get"]["responses"]["200"]
+    assert schema["content"]["application/json"]["schema"] == {
+        "title": "Response Read Meter Readings By Month Meter Readings  Year   Month  Get",
+        "type": "array",
+        "items": {"$ref": "#/components/schemas/MeterReading"}
+    }
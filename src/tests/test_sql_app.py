@@ -4,12 +4,14 @@ from datetime import datetime, timedelta
 # 3rd party imports
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 # Local imports
 from app import app
 from crud import create_invoice
-from database import Base, get_db
+from database import get_async_db, get_db
+from database.migrations import deduplicate, upgrade
 from utils import compute_invoice
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./database/test.db"
@@ -19,8 +21,16 @@ engine = create_engine(
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine("sqlite+aiosqlite:///./database/test.db", echo=True)
+AsyncTestingSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=async_engine, class_=AsyncSession
+)
+
 
-Base.metadata.create_all(bind=engine)
+# The test database holds readings sent twice, from before they were unique
+with engine.begin() as connection:
+    deduplicate(connection)
+upgrade(engine)
 
 
 def override_get_db():
@@ -31,7 +41,13 @@ def override_get_db():
         db.close()
 
 
+async def override_get_async_db():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 client = TestClient(app)
 
@@ -146,7 +162,8 @@ def test_invoice():
     assert db_invoice.date == invoice.date
     assert db_invoice.factory_uid == invoice.factory_uid
     assert db_invoice.production == invoice.production
-    assert db_invoice.production == 1100
+    # The reading sent twice for meter 1 on 2022-12-08 is only counted once
+    assert db_invoice.production == 1000
     assert db_invoice.price == invoice.price
-    assert db_invoice.price == 550
+    assert db_invoice.price == 500
     db.close()
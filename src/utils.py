@@ -2,16 +2,143 @@
 import datetime
 
 # 3rd party imports
-from sqlalchemy import extract
+from sqlalchemy import and_, case, func, tuple_
 from sqlalchemy.orm import Session
 
 # Local imports
-from crud import read_energy_producer, read_factory
-from models import MeterReading, Invoice
+import columnar
+from models import ElectricalMeter, Factory, Invoice, MeterReading, MonthlyProduction
 
 
 PRICE_PER_KWH = 0.5  # Constant price for 1 kWh produced (in €)
 
+MAX_YEAR = datetime.MAXYEAR  # Last valid year of a date
+
+# SQLite `date()` modifiers giving the first day of the period of a date
+PERIOD_START_MODIFIERS = {
+    "day": (),
+    "week": ("weekday 0", "-6 days"),  # Monday of the week
+    "month": ("start of month",),
+}
+
+
+def period_bounds(
+    year: int, month: int = None, day: int = None) -> tuple[datetime.date, datetime.date]:
+    """
+    Get the `[start, end[` date range of a year, a month or a day.
+    Filtering a date column on such a range (instead of using `extract`) lets SQLite
+    use the indexes defined on that column.
+    `end` is `None` for the periods ending with the last valid date (December 9999).
+    Raise a `ValueError` if the period is not a valid date.
+    """
+    if month is None:
+        start = datetime.date(year, 1, 1)
+    elif day is None:
+        start = datetime.date(year, month, 1)
+    else:
+        start = datetime.date(year, month, day)
+
+    if day is not None:
+        if start == datetime.date.max:
+            return start, None
+        return start, start + datetime.timedelta(days=1)
+
+    if month is None or month == 12:
+        next_year, next_month = year + 1, 1
+    else:
+        next_year, next_month = year, month + 1
+    if next_year > MAX_YEAR:
+        return start, None
+    return start, datetime.date(next_year, next_month, 1)
+
+
+def in_period(column, start: datetime.date, end: datetime.date):
+    """
+    Filter a date `column` on a `[start, end[` range returned by `period_bounds`.
+    """
+    if end is None:
+        return column >= start
+    return and_(column >= start, column < end)
+
+
+def compute_productions(
+    db: Session, factory_uids: list[int], date: datetime.date) -> dict[int, float]:
+    """
+    Compute the net electricity production (in kWh) of several factories for the month
+    of `date`, using a single grouped query on the monthly productions rollup,
+    so the cost depends on the number of meters and not on the number of readings.
+    Producer meters readings are added while consumer meters readings are substracted.
+    Factories that do not exist are missing from the returned mapping, existing factories
+    without any reading for the month have a production of 0 kWh.
+    """
+    if not factory_uids:
+        return {}
+
+    if columnar.reading_store is not None:
+        return compute_productions_columnar(db, factory_uids, date)
+
+    # Consumer meters (is_producer False or NULL) substract their readings
+    signed_amount = case(
+        (ElectricalMeter.is_producer, MonthlyProduction.amount),
+        else_=-MonthlyProduction.amount
+    )
+    rows = (
+        db.query(Factory.uid, func.coalesce(func.sum(signed_amount), 0))
+        .outerjoin(ElectricalMeter, ElectricalMeter.factory_uid == Factory.uid)
+        .outerjoin(MonthlyProduction, and_(
+            MonthlyProduction.electrical_meter_uid == ElectricalMeter.uid,
+            MonthlyProduction.year == date.year,
+            MonthlyProduction.month == date.month
+        ))
+        .filter(Factory.uid.in_(factory_uids))
+        .group_by(Factory.uid)
+        .all()
+    )
+    return {factory_uid: production for factory_uid, production in rows}
+
+
+def compute_productions_columnar(
+    db: Session, factory_uids: list[int], date: datetime.date) -> dict[int, float]:
+    """
+    Compute the net electricity production (in kWh) of several factories for the month
+    of `date`, like `compute_productions`, by summing the readings arrays of their meters
+    in the columnar store. Only the meters of the factories are read from the database.
+    """
+    rows = (
+        db.query(Factory.uid, ElectricalMeter.uid, ElectricalMeter.is_producer)
+        .outerjoin(ElectricalMeter, ElectricalMeter.factory_uid == Factory.uid)
+        .filter(Factory.uid.in_(factory_uids))
+        .all()
+    )
+    productions = {factory_uid: 0.0 for factory_uid, _, _ in rows}
+    meters = [row for row in rows if row[1] is not None]
+    start, end = period_bounds(date.year, date.month)
+    totals = columnar.reading_store.sum_amounts(
+        [meter_uid for _, meter_uid, _ in meters], start, end)
+    for (factory_uid, _, is_producer), total in zip(meters, totals.tolist()):
+        # Consumer meters (is_producer False or NULL) substract their readings
+        productions[factory_uid] += total if is_producer else -total
+    return productions
+
+
+def compute_invoices(
+    db: Session, factory_uids: list[int], date: datetime.date) -> list[Invoice]:
+    """
+    Compute the invoices of several factories at a specific date, with a single query.
+    Factories that do not exist are skipped.
+    """
+    productions = compute_productions(db, factory_uids, date)
+    return [
+        Invoice(
+            date=date,
+            production=productions[factory_uid],  # in kWh
+            price=productions[factory_uid] * PRICE_PER_KWH,  # in €
+            factory_uid=factory_uid
+        )
+        for factory_uid in factory_uids
+        if factory_uid in productions
+    ]
+
 
 def compute_invoice(db: Session, factory_uid: int, date: datetime.date) -> Invoice:
     """
@@ -19,31 +146,58 @@ def compute_invoice(db: Session, factory_uid: int, date: datetime.date) -> Invoi
     We assume that the price per kWh is a fixed amount every day (0.5€/kWh)
     Using this function, an invoice might be created with a production of 0 kWh.
     """
-    electricity_produced = 0
-    factory = read_factory(db, factory_uid)
-    if factory is None:
+    productions = compute_productions(db, [factory_uid], date)
+    if factory_uid not in productions:
         raise ValueError("Factory not found")
-    
-    electrical_meters = factory.electrical_meters
-    # There we want to sum all the electrical productions of each electrical meters at a
-    # given date for each factory owned by the energy producer
-    for elec_meter in electrical_meters:
-        # Get the all the readings for the given month
-        meter_readings = elec_meter.readings.filter(
-            extract("year", MeterReading.date) == date.year,
-            extract("month", MeterReading.date) == date.month
-        ).all()
-        # Sum each electricity meter readings
-        for mr in meter_readings:
-            # Set a default value (0) for production if it's None
-            reading = mr.amount if mr is not None else 0
-            # Handle case where there is one or many electrical meters that consume energy.
-            # In this case, we need to substract the 'amount' value as it is a consumption.
-            electricity_produced += reading if elec_meter.is_producer else (reading * -1)
 
+    electricity_produced = productions[factory_uid]
     return Invoice(
         date=date,
         production=electricity_produced,  # in kWh
         price=electricity_produced * PRICE_PER_KWH,  # in €
         factory_uid=factory_uid
     )
+
+
+def compute_production_series(
+    db: Session,
+    start: datetime.date,
+    end: datetime.date,
+    granularity: str = "day",
+    factory_uid: int = None,
+    energy_producer_uid: int = None) -> list[tuple[datetime.date, float]]:
+    """
+    Compute the net electricity production (in kWh) of a factory, or of all the factories
+    of an energy producer, for each day, week or month of the `[start, end[` range.
+    The readings are aggregated by a single grouped query, with the same sign rule as
+    `compute_productions`. Periods without any reading are missing from the result.
+    Whole months are read from the monthly productions rollup instead of the readings.
+    """
+    if granularity == "month" and start.day == 1 and end.day == 1:
+        source = MonthlyProduction
+        period = func.printf("%04d-%02d-01", source.year, source.month)
+        month = tuple_(source.year, source.month)
+        filters = (
+            month >= tuple_(start.year, start.month), month < tuple_(end.year, end.month))
+    else:
+        source = MeterReading
+        period = func.date(source.date, *PERIOD_START_MODIFIERS[granularity])
+        filters = (source.date >= start, source.date < end)
+
+    # Consumer meters (is_producer False or NULL) substract their readings
+    signed_amount = case((ElectricalMeter.is_producer, source.amount), else_=-source.amount)
+    query = (
+        db.query(period, func.sum(signed_amount))
+        .join(ElectricalMeter, ElectricalMeter.uid == source.electrical_meter_uid)
+        .filter(*filters)
+    )
+    if factory_uid is not None:
+        query = query.filter(ElectricalMeter.factory_uid == factory_uid)
+    if energy_producer_uid is not None:
+        query = query.join(Factory, Factory.uid == ElectricalMeter.factory_uid).filter(
+            Factory.owner_uid == energy_producer_uid)
+
+    return [
+        (datetime.date.fromisoformat(day), production)
+        for day, production in query.group_by(period).order_by(period)
+    ]